@@ -1,4 +1,4 @@
-"""Clients API pour OpenRouter et Transkribus."""
+"""Clients API pour OpenRouter, Transkribus et le démon Kraken local."""
 
 import os
 import base64
@@ -7,12 +7,14 @@ import io
 import math
 from PIL import Image
 from transkribus_api import query_transkribus
+from api_errors import APIError, InvalidModelError, ImageProcessingError
 from config import VALID_OPENROUTER_MODELS, VALID_TRANSKRIBUS_MODELS, system_prompt
+from tracing import span
 
 
 def validate_model_id(model_id):
     """
-    Validate if a model ID is known to be valid for OpenRouter or Transkribus.
+    Validate if a model ID is known to be valid for OpenRouter, Transkribus or the Kraken daemon.
     
     Args:
         model_id: The model ID to validate
@@ -22,6 +24,9 @@ def validate_model_id(model_id):
     """
     if model_id.startswith("transkribus/"):
         return model_id in VALID_TRANSKRIBUS_MODELS
+    elif model_id.startswith("kraken/"):
+        # Les modèles Kraken disponibles sont ceux chargés par le démon local
+        return len(model_id) > len("kraken/")
     else:
         return model_id in VALID_OPENROUTER_MODELS
 
@@ -39,6 +44,19 @@ def is_transkribus_model(model_id):
     return model_id.startswith("transkribus/")
 
 
+def is_kraken_model(model_id):
+    """
+    Check if a model ID is a Kraken model served by the local daemon (kraken_server.py).
+    
+    Args:
+        model_id: The model ID to check
+        
+    Returns:
+        bool: True if it's a Kraken model, False otherwise
+    """
+    return model_id.startswith("kraken/")
+
+
 def fetch_openrouter_pricing():
     """
     Fetch current model pricing from OpenRouter API
@@ -57,7 +75,7 @@ def fetch_openrouter_pricing():
     )
     
     if response.status_code != 200:
-        raise Exception(f"Error fetching model pricing: {response.text}")
+        raise APIError(f"Error fetching model pricing: {response.text}", status_code=response.status_code)
         
     models_data = response.json()
     pricing_dict = {}
@@ -82,17 +100,43 @@ except Exception as e:
     OPENROUTER_PRICING = {}
 
 
-def resize_image_if_needed(image_path, max_size_bytes=5*1024*1024, max_dimension=None):
+def get_image_limits(model):
     """
-    Resize an image if it exceeds the maximum size limit or dimension limit.
+    Model-specific limits applied to images before they are sent to OpenRouter.
+    
+    Args:
+        model: Model ID from OpenRouter
+        
+    Returns:
+        tuple: (max_size_bytes, max_dimension)
+    """
+    if "mistralai" in model:
+        return 2*1024*1024, None  # 2MB for Mistral models, no specific dimension limit
+    elif "anthropic" in model or "claude" in model:
+        # 4MB for Claude models (reduced from 5MB for safety)
+        # Claude has 8000 pixel limit, use 7500 for extra safety
+        return 4*1024*1024, 7500
+    elif "llama" in model.lower() or "pixtral" in model.lower():
+        # More conservative limits for Llama and Pixtral models
+        return 3*1024*1024, 6000
+    else:
+        return 5*1024*1024, None  # 5MB for other models, no specific dimension limit
+
+
+def prepare_image(image_path, max_size_bytes=5*1024*1024, max_dimension=None, keep_grayscale=False):
+    """
+    Convert an image to JPEG, resizing it if it exceeds the maximum size limit or dimension limit.
     
     Args:
         image_path: Path to the image file
         max_size_bytes: Maximum size in bytes (default: 5MB)
         max_dimension: Maximum allowed dimension in pixels (width or height)
+        keep_grayscale: Keep grayscale images as single-channel JPEG and send black and white
+            (mode '1') images that fit the limits as PNG (preprocessed pages only)
         
     Returns:
-        base64_image: Base64 encoded image data
+        image_bytes: JPEG (or PNG) encoded image data
+        dimensions: (width, height) of the encoded image
         was_resized: Boolean indicating if the image was resized
     """
     # Check file size
@@ -104,12 +148,30 @@ def resize_image_if_needed(image_path, max_size_bytes=5*1024*1024, max_dimension
         Image.MAX_IMAGE_PIXELS = 200000000  # Increase limit to handle very large images
         
         with Image.open(image_path) as img:
+            with span("image.decode", file_size=file_size, mode=img.mode, width=img.width, height=img.height):
+                img.load()
+            
             # Convert to RGB if needed
             if img.mode in ('RGBA', 'LA'):
                 background = Image.new('RGB', img.size, (255, 255, 255))
                 background.paste(img, mask=img.split()[-1])
                 img = background
-            elif img.mode != 'RGB':
+            elif not keep_grayscale:
+                if img.mode != 'RGB':
+                    img = img.convert('RGB')
+            elif img.mode == '1':
+                # Black and white pages: lossless PNG is far smaller than JPEG
+                if not max_dimension or max(img.size) <= max_dimension:
+                    with span("image.png_encode") as png_span:
+                        buffer = io.BytesIO()
+                        img.save(buffer, format='PNG', optimize=True)
+                        png_span.set(bytes=buffer.tell())
+                    if buffer.tell() <= max_size_bytes * 0.95:
+                        return buffer.getvalue(), img.size, False
+                img = img.convert('L')
+            elif img.mode == 'I;16':
+                img = img.convert('L')
+            elif img.mode not in ('RGB', 'L'):
                 img = img.convert('RGB')
             
             original_width, original_height = img.size
@@ -122,7 +184,8 @@ def resize_image_if_needed(image_path, max_size_bytes=5*1024*1024, max_dimension
                 scale_factor = max_dimension / max(original_width, original_height)
                 new_width = int(original_width * scale_factor)
                 new_height = int(original_height * scale_factor)
-                img = img.resize((new_width, new_height), Image.LANCZOS)
+                with span("image.resize", width=new_width, height=new_height):
+                    img = img.resize((new_width, new_height), Image.LANCZOS)
             else:
                 new_width, new_height = original_width, original_height
             
@@ -135,54 +198,80 @@ def resize_image_if_needed(image_path, max_size_bytes=5*1024*1024, max_dimension
                 quality = 85
             
             # Iteratively reduce quality until file size is under the limit
-            while True:
-                buffer.seek(0)
-                buffer.truncate(0)
-                img.save(buffer, format='JPEG', quality=quality)
-                buffer_size = buffer.tell()
-                
-                # If size is under the limit, we're done
-                if buffer_size <= max_size_bytes * 0.95:  # 5% safety margin
-                    break
-                
-                # If we've already reduced quality significantly and still too large
-                if quality <= 30:
-                    # Need to resize the image further
-                    scale_factor = math.sqrt(max_size_bytes * 0.9 / buffer_size)
-                    new_width = int(new_width * scale_factor)
-                    new_height = int(new_height * scale_factor)
-                    img = img.resize((new_width, new_height), Image.LANCZOS)
-                    quality = 70  # Reset quality after resize
-                else:
-                    # Reduce quality and try again
-                    quality -= 10
-                
-                needs_resize = True
+            with span("image.jpeg_search") as search_span:
+                attempts = 0
+                while True:
+                    buffer.seek(0)
+                    buffer.truncate(0)
+                    img.save(buffer, format='JPEG', quality=quality)
+                    buffer_size = buffer.tell()
+                    attempts += 1
+                    
+                    # If size is under the limit, we're done
+                    if buffer_size <= max_size_bytes * 0.95:  # 5% safety margin
+                        break
+                    
+                    # If we've already reduced quality significantly and still too large
+                    if quality <= 30:
+                        # Need to resize the image further
+                        scale_factor = math.sqrt(max_size_bytes * 0.9 / buffer_size)
+                        new_width = int(new_width * scale_factor)
+                        new_height = int(new_height * scale_factor)
+                        img = img.resize((new_width, new_height), Image.LANCZOS)
+                        quality = 70  # Reset quality after resize
+                    else:
+                        # Reduce quality and try again
+                        quality -= 10
+                    
+                    needs_resize = True
+                search_span.set(attempts=attempts, quality=quality, bytes=buffer_size)
             
-            return base64.b64encode(buffer.getvalue()).decode('utf-8'), needs_resize
+            return buffer.getvalue(), (new_width, new_height), needs_resize
     except Exception as e:
-        raise Exception(f"Error processing image {image_path}: {str(e)}")
+        raise ImageProcessingError(f"Error processing image {image_path}: {str(e)}")
 
 
-def query_openrouter(image_path, model, system_message=system_prompt):
+def resize_image_if_needed(image_path, max_size_bytes=5*1024*1024, max_dimension=None, keep_grayscale=False):
+    """
+    Resize an image if it exceeds the maximum size limit or dimension limit.
+    
+    Args:
+        image_path: Path to the image file
+        max_size_bytes: Maximum size in bytes (default: 5MB)
+        max_dimension: Maximum allowed dimension in pixels (width or height)
+        keep_grayscale: See `prepare_image`
+        
+    Returns:
+        base64_image: Base64 encoded image data
+        was_resized: Boolean indicating if the image was resized
+    """
+    image_bytes, _, was_resized = prepare_image(image_path, max_size_bytes, max_dimension, keep_grayscale)
+    with span("image.base64", bytes=len(image_bytes)):
+        return base64.b64encode(image_bytes).decode('utf-8'), was_resized
+
+
+def query_openrouter(image_path, model, system_message=system_prompt, keep_grayscale=False):
     """
     Query OpenRouter API for image analysis
     Args:
         image_path: Path to the image file
         model: Model ID from OpenRouter (e.g. "openai/gpt-4-vision-preview")
         system_message: Optional system message to prepend
+        keep_grayscale: See `prepare_image`
     Returns:
         tuple: (response_data, cost)
     """
     # Validate model ID
     if not validate_model_id(model):
-        raise Exception(f"Invalid model ID: {model}. Please check models_to_test.json for valid model IDs.")
+        raise InvalidModelError(f"Invalid model ID: {model}. Please check models_to_test.json for valid model IDs.")
     
     # Refresh pricing data before each query to ensure we have latest prices
-    try:
-        current_pricing = fetch_openrouter_pricing()
-    except Exception:
-        current_pricing = OPENROUTER_PRICING
+    with span("pricing.fetch") as pricing_span:
+        try:
+            current_pricing = fetch_openrouter_pricing()
+        except Exception:
+            current_pricing = OPENROUTER_PRICING
+            pricing_span.set(fallback=True)
     
     headers = {
         "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
@@ -193,43 +282,34 @@ def query_openrouter(image_path, model, system_message=system_prompt):
     
     # Process and resize image if needed
     try:
-        # Set model-specific limits
-        if "mistralai" in model:
-            max_size_bytes = 2*1024*1024  # 2MB for Mistral models
-            max_dimension = None  # No specific dimension limit
-        elif "anthropic" in model or "claude" in model:
-            max_size_bytes = 4*1024*1024  # 4MB for Claude models (reduced from 5MB for safety)
-            max_dimension = 7500  # Claude has 8000 pixel limit, use 7500 for extra safety
-        elif "llama" in model.lower() or "pixtral" in model.lower():
-            # More conservative limits for Llama and Pixtral models
-            max_size_bytes = 3*1024*1024  # 3MB for Llama/Pixtral
-            max_dimension = 6000  # Lower dimension limit
-        else:
-            max_size_bytes = 5*1024*1024  # 5MB for other models
-            max_dimension = None  # No specific dimension limit
+        with span("image.prepare"):
+            # Set model-specific limits
+            max_size_bytes, max_dimension = get_image_limits(model)
+            base64_image, was_resized = resize_image_if_needed(image_path, max_size_bytes, max_dimension, keep_grayscale)
             
-        base64_image, was_resized = resize_image_if_needed(image_path, max_size_bytes, max_dimension)
-        
-        # Double-check file size for Claude models to ensure it's under the limit
-        if ("anthropic" in model or "claude" in model):
-            # Decode base64 to get actual bytes
-            image_bytes = base64.b64decode(base64_image)
-            actual_size = len(image_bytes)
+            # Double-check file size for Claude models to ensure it's under the limit
+            if ("anthropic" in model or "claude" in model):
+                # Decode base64 to get actual bytes
+                image_bytes = base64.b64decode(base64_image)
+                actual_size = len(image_bytes)
             
-            # If still too large, force another resize with even stricter limits
-            if actual_size > 4.9*1024*1024:  # If over 4.9MB
-                print(f"Warning: Image {os.path.basename(image_path)} still too large ({actual_size/1024/1024:.2f}MB). Forcing stricter resize.")
-                max_size_bytes = 4*1024*1024  # 4MB hard limit
-                max_dimension = 6000  # Even smaller dimension
-                base64_image, _ = resize_image_if_needed(image_path, max_size_bytes, max_dimension)
-        
-        if was_resized:
-            resize_info = f"{max_size_bytes/1024/1024}MB"
-            if max_dimension:
-                resize_info += f" and {max_dimension}px max dimension"
-            print(f"Image {os.path.basename(image_path)} was resized to fit within {resize_info}")
+                # If still too large, force another resize with even stricter limits
+                if actual_size > 4.9*1024*1024:  # If over 4.9MB
+                    print(f"Warning: Image {os.path.basename(image_path)} still too large ({actual_size/1024/1024:.2f}MB). Forcing stricter resize.")
+                    max_size_bytes = 4*1024*1024  # 4MB hard limit
+                    max_dimension = 6000  # Even smaller dimension
+                    base64_image, _ = resize_image_if_needed(image_path, max_size_bytes, max_dimension, keep_grayscale)
+            
+            if was_resized:
+                resize_info = f"{max_size_bytes/1024/1024}MB"
+                if max_dimension:
+                    resize_info += f" and {max_dimension}px max dimension"
+                print(f"Image {os.path.basename(image_path)} was resized to fit within {resize_info}")
     except Exception as e:
-        raise Exception(f"Error processing image {image_path}: {str(e)}")
+        raise ImageProcessingError(f"Error processing image {image_path}: {str(e)}")
+    
+    # PNG signature once base64 encoded
+    mime_type = "image/png" if base64_image.startswith("iVBORw0KGgo") else "image/jpeg"
     
     messages = []
     if system_message:
@@ -251,7 +331,7 @@ def query_openrouter(image_path, model, system_message=system_prompt):
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/jpeg;base64,{base64_image}"
+                        "url": f"data:{mime_type};base64,{base64_image}"
                     }
                 }
             ]
@@ -263,7 +343,7 @@ def query_openrouter(image_path, model, system_message=system_prompt):
             "content": [{
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:image/jpeg;base64,{base64_image}"
+                    "url": f"data:{mime_type};base64,{base64_image}"
                 }
             }]
         })
@@ -274,20 +354,27 @@ def query_openrouter(image_path, model, system_message=system_prompt):
         "temperature": 0.1
     }
     
-    response = requests.post(
-        "https://openrouter.ai/api/v1/chat/completions",
-        headers=headers,
-        json=data
-    )
+    with span("http.request", image_base64_bytes=len(base64_image)) as request_span:
+        response = requests.post(
+            "https://openrouter.ai/api/v1/chat/completions",
+            headers=headers,
+            json=data
+        )
+        request_span.set(status_code=response.status_code, response_bytes=len(response.content))
     
     if response.status_code != 200:
-        raise Exception(f"Error from OpenRouter API: {response.text}")
+        raise APIError(f"Error from OpenRouter API: {response.text}", status_code=response.status_code)
         
-    response_data = response.json()
+    with span("response.parse"):
+        response_data = response.json()
     
     # Check if response has the expected structure
     if 'choices' not in response_data or not response_data['choices']:
-        raise Exception(f"Unexpected response format - missing 'choices' field: {response_data}")
+        # OpenRouter peut renvoyer une erreur du fournisseur avec un statut 200
+        error = response_data.get('error')
+        status_code = error.get('code') if isinstance(error, dict) else None
+        raise APIError(f"Unexpected response format - missing 'choices' field: {response_data}",
+                       status_code=status_code if isinstance(status_code, int) else None)
     
     # Before calculating costs, ensure usage data exists with defaults
     usage_data = response_data.get('usage', {})
@@ -314,22 +401,64 @@ def query_openrouter(image_path, model, system_message=system_prompt):
     return response_data, round(total_cost, 12)
 
 
-def query_model(image_path, model, system_message=system_prompt):
+def query_kraken(image_path, model):
+    """
+    Query the local Kraken daemon (kraken_server.py) which keeps models warm in memory
+    Args:
+        image_path: Path to the image file
+        model: Model ID with the "kraken/" prefix (e.g. "kraken/McCATMuS_nfd_nofix_V1")
+    Returns:
+        tuple: (response_data, cost)
+    """
+    kraken_model_id = model.replace("kraken/", "", 1)
+    server_url = os.getenv("KRAKEN_SERVER_URL", "http://127.0.0.1:8765")
+    
+    with span("image.read"), open(image_path, "rb") as image_file:
+        image_bytes = image_file.read()
+    
+    with span("http.request", image_bytes=len(image_bytes)) as request_span:
+        response = requests.post(
+            f"{server_url}/transcribe",
+            params={"model": kraken_model_id, "image": os.path.basename(image_path)},
+            data=image_bytes,
+            headers={"Content-Type": "application/octet-stream"}
+        )
+        request_span.set(status_code=response.status_code, response_bytes=len(response.content))
+    
+    if response.status_code != 200:
+        raise APIError(f"Error from Kraken daemon: {response.text}", status_code=response.status_code)
+    
+    with span("response.parse"):
+        response_data = response.json()
+    response_data['model_info'] = {
+        'id': model,
+        'pricing': (0, 0),
+        'total_cost': 0
+    }
+    return response_data, 0.0
+
+
+def query_model(image_path, model, system_message=system_prompt, keep_grayscale=False):
     """
     Query the appropriate API based on the model ID
     
     Args:
         image_path: Path to the image file
-        model: Model ID (e.g., "openai/gpt-4-vision" or "transkribus/CITlab_HTR+")
+        model: Model ID (e.g., "openai/gpt-4-vision", "transkribus/CITlab_HTR+" or "kraken/ManuMcFondue")
         system_message: Optional system message to prepend
+        keep_grayscale: Encoding of OpenRouter uploads, see `prepare_image` (Transkribus and
+            Kraken receive the image file as is)
         
     Returns:
         tuple: (response_data, cost)
     """
     # Determine which API to use based on the model ID
-    if is_transkribus_model(model):
-        # Extract the actual model ID without the "transkribus/" prefix
-        transkribus_model_id = model.replace("transkribus/", "")
-        return query_transkribus(image_path, transkribus_model_id)
-    else:
-        return query_openrouter(image_path, model, system_message)
\ No newline at end of file
+    with span("query", model=model, provider=model.split("/")[0]):
+        if is_transkribus_model(model):
+            # Extract the actual model ID without the "transkribus/" prefix
+            transkribus_model_id = model.replace("transkribus/", "")
+            return query_transkribus(image_path, transkribus_model_id)
+        elif is_kraken_model(model):
+            return query_kraken(image_path, model)
+        else:
+            return query_openrouter(image_path, model, system_message, keep_grayscale)
\ No newline at end of file
@@ -0,0 +1,24 @@
+"""Exceptions levées par les clients API, porteuses du statut HTTP de la réponse."""
+
+
+class APIError(Exception):
+    """
+    Erreur renvoyée par une API de transcription.
+
+    Hérite d'`Exception` : le code existant qui intercepte `Exception` reste valable.
+
+    Attributes:
+        status_code: Statut HTTP de la réponse (None si inconnu)
+    """
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class InvalidModelError(APIError):
+    """ID de modèle inconnu : l'appel ne peut pas réussir en le relançant."""
+
+
+class ImageProcessingError(Exception):
+    """L'image n'a pas pu être lue ou préparée pour l'envoi."""
@@ -1,13 +1,18 @@
 import os
-import json
+import math
+import argparse
 import subprocess
 import time
-from datetime import datetime
 from pathlib import Path
 from tqdm import tqdm
 import concurrent.futures
-from functools import partial
 from dotenv import load_dotenv
+from kraken_engine import (
+    transcribe_image, get_segmentation, build_result_data, init_worker, DEFAULT_BATCH_SIZE, KRAKEN_MODELS_DIR
+)
+from image_index import ImageIndex, list_images
+from results_store import open_result_store
+from tracing import TASK_SPAN, TRACE_FILE, configure as configure_tracing, span
 
 # Load environment variables from .env file
 load_dotenv()
@@ -15,40 +20,40 @@ load_dotenv()
 # Define the directories (these mirror those used in benchmark_htr.ipynb / utils.py)
 results_dir = Path("./résultats")
 images_dir = Path("./images")
-kraken_models_dir = Path("./kraken_models")
+kraken_models_dir = KRAKEN_MODELS_DIR
 
 # Create directories if they do not exist
 results_dir.mkdir(exist_ok=True)
 images_dir.mkdir(exist_ok=True)
 kraken_models_dir.mkdir(exist_ok=True)
 
-def process_image_kraken(img_path, kraken_model):
+# Result store of this process (see result_store)
+_result_store = None
+
+
+def result_store(legacy_json=False):
+    """
+    The result store of this process, opened once: new or modified legacy result
+    files are imported into it on first use. With `legacy_json`, every result is also
+    written to the results directory in the legacy JSON format.
     """
-    Process an image with a Kraken model using the Kraken CLI.
+    global _result_store
+    if _result_store is None:
+        _result_store = open_result_store(results_dir=results_dir, legacy_json=legacy_json)
+    return _result_store
+
+
+def run_kraken_cli(img_path, kraken_model, tmp_output_file):
+    """
+    Transcribe an image by shelling out to the Kraken CLI.
     
     This function builds a command of the form:
-      kraken ocr -i <input_image> <tmp_output_file> --model <kraken_model>
+      kraken -i <input_image> <tmp_output_file> segment -bl ocr --model <kraken_model>
     Note the correct ordering of the input pair immediately after the -i flag.
     
-    Args:
-        img_path (Path): Path to the image file.
-        kraken_model (Path): Path to the Kraken model file.
-    
     Returns:
-        dict: A dictionary containing the result data in a format compatible with
-              our main logic.
+        tuple: (transcription, latency), or None if the command failed
     """
-    safe_model_name = kraken_model.stem.replace(" ", "_")
-    result_file = results_dir / f"{img_path.stem}_{safe_model_name}.json"
-    
-    # Skip processing if the result file already exists
-    if result_file.exists():
-        print(f"Skipping existing result: {result_file}")
-        return None
-    
-    # Temporary file to hold Kraken's OCR output
-    tmp_output_file = results_dir / f"{img_path.stem}_{safe_model_name}_temp.txt"
-    
     # Build the command with proper input file pair syntax:
     # Instead of using a separate "-o" option, we provide:
     # "-i <input_image> <tmp_output_file>"
@@ -85,61 +90,215 @@ def process_image_kraken(img_path, kraken_model):
         print(f"Error reading temporary output for {img_path.name} with {kraken_model.name}: {str(e)}")
         transcription = ""
     
-    # Build the result data dictionary (compatible with our main logic)
-    result_data = {
-        "model": safe_model_name,
-        "editeur": "kraken",
-        "modele_type": "libre",
-        "image": str(img_path),
-        "result": transcription,
-        "timestamp": datetime.now().isoformat(),
-        "model_info": {"path": str(kraken_model)},
-        "usage": {},
-        "latency": latency
-    }
-    
-    # Save the result to a JSON file in the results directory
-    with open(result_file, "w", encoding="utf-8") as f:
-        json.dump(result_data, f, ensure_ascii=False, indent=2)
+    return transcription, latency
+
+
+def process_image_kraken(img_path, kraken_model, backend="inprocess", batch_size=DEFAULT_BATCH_SIZE,
+                         legacy_json=False):
+    """
+    Process an image with a Kraken model.
+    
+    Two backends are available:
+      - "inprocess" (default): uses the kraken Python API; models are loaded once
+        per worker process and the latency only covers segmentation + recognition.
+      - "cli": shells out to the `kraken` command for every (image, model) pair.
+    
+    Args:
+        img_path (Path): Path to the image file.
+        kraken_model (Path): Path to the Kraken model file.
+        backend (str): "inprocess" or "cli".
+        batch_size (int): Number of lines recognized per batch (in-process backend only).
+        legacy_json (bool): Also write the result to the results directory as a JSON file.
+    
+    Returns:
+        dict: A dictionary containing the result data in a format compatible with
+              our main logic.
+    """
+    safe_model_name = kraken_model.stem.replace(" ", "_")
+    store = result_store(legacy_json)
+    
+    # Skip processing if the result already exists (legacy result files are imported into the store)
+    if store.get(img_path.stem, safe_model_name) is not None:
+        print(f"Skipping existing result: {img_path.stem} with {safe_model_name}")
+        return None
+    
+    with span(TASK_SPAN, model=safe_model_name, provider="kraken", image=img_path.stem,
+              backend=backend) as task_span:
+        if backend == "cli":
+            # Temporary file to hold Kraken's OCR output
+            tmp_output_file = results_dir / f"{img_path.stem}_{safe_model_name}_temp.txt"
+            with span("kraken.cli"):
+                output = run_kraken_cli(img_path, kraken_model, tmp_output_file)
+            if output is None:
+                task_span.fail("kraken CLI failed")
+                return None
+            transcription, latency = output
+        else:
+            try:
+                transcription, latency = transcribe_image(img_path, kraken_model, batch_size)
+            except Exception as e:
+                print(f"Error processing {img_path.name} with {kraken_model.name}: {str(e)}")
+                task_span.fail(str(e))
+                return None
+        
+        result_data = build_result_data(img_path, kraken_model, transcription, latency)
+        
+        with span("result.write"):
+            store.put(result_data)
     
     print(f"Processed {img_path.name} with {kraken_model.name}")
     return result_data
 
+def physical_core_count():
+    """
+    Return the number of physical CPU cores (falls back to logical cores without psutil).
+    """
+    try:
+        import psutil
+        count = psutil.cpu_count(logical=False)
+    except ImportError:
+        count = None
+    return count or os.cpu_count() or 1
+
+
+def segment_only(img_path):
+    """
+    Fill the segmentation cache for one image without sending the result back to the parent.
+    
+    Returns:
+        Path: The image path, or None if the image could not be segmented (its recognition
+              tasks then report the error for each model)
+    """
+    try:
+        get_segmentation(img_path)
+    except Exception as e:
+        print(f"Error segmenting {img_path.name}: {str(e)}")
+        return None
+    return img_path
+
+
+def process_task(kraken_model, img_paths, backend, batch_size, legacy_json=False):
+    """
+    Process a chunk of images with a single model, so the worker loads it once.
+    
+    Returns:
+        list: The result data of each processed image (None for skipped/failed ones)
+    """
+    return [
+        process_image_kraken(img_path, kraken_model, backend=backend, batch_size=batch_size,
+                             legacy_json=legacy_json)
+        for img_path in img_paths
+    ]
+
+
+def build_tasks(kraken_model_files, image_files, workers):
+    """
+    Expand the full (model x image) matrix into (model, image chunk) tasks.
+    
+    Tasks are emitted model by model, and each one covers several images of the
+    same model, which maximizes model reuse inside a worker. Chunks are sized to
+    give every worker a few tasks so the slowest image does not stall the pool.
+    """
+    chunk_size = math.ceil(len(image_files) * len(kraken_model_files) / (workers * 4))
+    chunk_size = max(1, min(chunk_size, len(image_files)))
+    return [
+        (kraken_model, image_files[start:start + chunk_size])
+        for kraken_model in kraken_model_files
+        for start in range(0, len(image_files), chunk_size)
+    ]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark Kraken models on the 'images' directory.")
+    parser.add_argument("--backend", choices=["inprocess", "cli"], default="inprocess",
+                        help="Recognition backend: in-process Python API (default) or the kraken CLI")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Number of lines recognized per batch (in-process backend only)")
+    parser.add_argument("--workers", type=int, default=physical_core_count(),
+                        help="Number of worker processes (default: number of physical cores)")
+    parser.add_argument("--torch-threads", type=int, default=1,
+                        help="Torch intra-op threads per worker process (default: 1)")
+    parser.add_argument("--blank-pages", choices=["skip", "send"], default="skip",
+                        help="Blank pages detected by the image index: skipped (default) or sent to Kraken")
+    parser.add_argument("--legacy-json", action="store_true",
+                        help="Also write each result to the results directory as a legacy JSON file")
+    parser.add_argument("--trace", type=Path, nargs="?", const=TRACE_FILE, metavar="FILE",
+                        help="Record per-stage spans to a JSONL file (default: %(const)s; see tracing.py)")
+    return parser.parse_args()
+
 def main():
-    # Gather image files (supporting jpg, jpeg, png)
-    image_files = list(images_dir.glob("*.jpg")) + list(images_dir.glob("*.jpeg")) + list(images_dir.glob("*.png"))
+    args = parse_args()
+    # Before the pool starts: workers inherit the trace file through the environment
+    if args.trace:
+        configure_tracing(args.trace)
+    
+    # Gather image files (jpg and png, subfolders included)
+    image_files = list_images(images_dir)
     if not image_files:
         print("No images found in the 'images' directory.")
         return
     
+    # Index the images like run_benchmark.py: a page stored under several names is
+    # transcribed once, and blank pages are detected before any task is scheduled
+    index = ImageIndex()
+    index.update(image_files)
+    image_files, duplicates = index.distinct(image_files)
+    for img_path, image_name in duplicates:
+        print(f"{img_path}: copy of page {image_name}, skipped")
+    blank_pages = [img_path for img_path in image_files if index.is_blank(img_path.stem)]
+    if blank_pages and args.blank_pages == "skip":
+        image_files = [img_path for img_path in image_files if not index.is_blank(img_path.stem)]
+        print(f"{len(blank_pages)} blank page(s) not sent to Kraken: "
+              f"{', '.join(img_path.stem for img_path in blank_pages)}")
+    
     # Gather Kraken model files (expecting .pt files; adjust pattern if needed)
     kraken_model_files = list(kraken_models_dir.glob("*.pt")) + list(kraken_models_dir.glob("*.mlmodel"))
     if not kraken_model_files:
         print("No Kraken models found in the 'kraken_models' directory.")
         return
     
+    # Import pending legacy results once, before the workers inherit the store
+    result_store(args.legacy_json).set_image_hashes(index.hashes())
+    
     results = []
-    max_workers = 4  # You can adjust the number of worker threads as needed
+    tasks = build_tasks(kraken_model_files, image_files, args.workers)
+    print(f"Scheduling {len(image_files) * len(kraken_model_files)} pages ({len(tasks)} tasks) "
+          f"on {args.workers} worker processes x {args.torch_threads} torch thread(s)")
     
-    # Iterate over each Kraken model
-    for kraken_model in kraken_model_files:
-        print(f"\nProcessing images with model: {kraken_model.name}")
-        # Use functools.partial to fix the kraken_model parameter for the worker function
-        process_fn = partial(process_image_kraken, kraken_model=kraken_model)
+    start_wall = time.perf_counter()
+    start_cpu = os.times()
+    
+    # One process pool for the whole (model x image) matrix: no per-model barrier
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=init_worker,
+        initargs=(args.torch_threads,)
+    ) as executor:
+        # Segment every page once up front: the baseline segmentation does not depend on
+        # the recognition model, so every model then reads it from the segmentation cache
+        if args.backend == "inprocess":
+            list(tqdm(executor.map(segment_only, image_files), total=len(image_files), desc="Segmenting pages"))
         
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_img = {executor.submit(process_fn, img_path): img_path for img_path in image_files}
-            for future in tqdm(
-                concurrent.futures.as_completed(future_to_img),
-                total=len(future_to_img),
-                desc=f"Images for {kraken_model.name}",
-                leave=False
-            ):
-                result = future.result()
-                if result is not None:
-                    results.append(result)
+        futures = [
+            executor.submit(process_task, kraken_model, img_paths, args.backend, args.batch_size, args.legacy_json)
+            for kraken_model, img_paths in tasks
+        ]
+        with tqdm(total=len(image_files) * len(kraken_model_files), desc="Pages") as progress:
+            for future in concurrent.futures.as_completed(futures):
+                task_results = future.result()
+                results.extend(result for result in task_results if result is not None)
+                progress.update(len(task_results))
+    
+    wall_time = time.perf_counter() - start_wall
+    end_cpu = os.times()
+    # Worker processes (and their kraken subprocesses) are accounted as children once joined
+    cpu_time = sum(end - start for end, start in zip(end_cpu[:4], start_cpu[:4]))
+    logical_cores = os.cpu_count() or 1
     
     print(f"\nCompleted processing. Total results: {len(results)}")
+    print(f"Wall-clock time: {wall_time:.1f} s")
+    print(f"Throughput: {len(results) / wall_time:.2f} pages/s")
+    print(f"CPU utilization: {100 * cpu_time / (wall_time * logical_cores):.0f}% of {logical_cores} logical cores")
     
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,445 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Cascade de modèles : un modèle bon marché d'abord, un modèle coûteux seulement si nécessaire.
+
+Chaque page est d'abord transcrite par le premier niveau de la cascade (par exemple
+`google/gemini-2.0-flash-001` ou un modèle `kraken/`), accompagné d'un second modèle
+bon marché de contrôle. Un estimateur de qualité sans référence décide ensuite s'il
+faut passer au niveau suivant, à partir de quatre signaux :
+  - la densité de mots illisibles `[XXX]` ;
+  - la répétition (part de trigrammes répétés, symptôme des boucles d'hallucination) ;
+  - l'écart entre le nombre de mots obtenu et celui attendu d'après le nombre de lignes
+    de texte détectées sur l'image ;
+  - le désaccord (WER) avec le modèle de contrôle, ou avec le niveau précédent.
+Chaque signal est rapporté à son seuil ; la page est escaladée dès que l'un d'eux
+l'atteint (le facteur d'écart de longueur doit donc être supérieur à 1). Les appels passent par `run_benchmark.process_image` : les résultats déjà
+présents dans le store sont réutilisés.
+
+Usage :
+  python cascade.py run --levels google/gemini-2.0-flash-001 openai/gpt-4.5-preview \\
+      --check qwen/qwen2.5-vl-72b-instruct:free
+  python cascade.py report --levels google/gemini-2.0-flash-001 openai/gpt-4.5-preview \\
+      --check qwen/qwen2.5-vl-72b-instruct:free
+
+Les pages escaladées, le niveau retenu et le coût de chaque cascade exécutée figurent
+dans le rapport principal (`reporting.py`). `report` ne lance aucun appel : il rejoue la
+cascade sur les résultats du store pour tous les seuils possibles et écrit la courbe
+coût / WER dans `rapports/cascade.md`, pour choisir les seuils avant un run.
+"""
+
+import argparse
+import concurrent.futures
+import math
+import re
+import statistics
+from datetime import datetime
+from pathlib import Path
+
+from image_analysis import count_text_lines
+from metrics import calculate_wer, clean_text_for_wer
+from results_store import CASCADE_RUN, DEFAULT_DB_PATH, RESULTS_DIR, open_result_store
+from run_benchmark import IMAGES_DIR, MODELS_FILE, list_images, load_models, process_image
+from screening import REFERENCE_DIR, load_references
+
+REPORT_FILE = Path("rapports") / "cascade.md"
+
+# Seuils d'escalade de chaque signal
+DEFAULT_THRESHOLDS = {
+    "illegible": 0.15,     # part des mots remplacés par [XXX]
+    "repetition": 0.25,    # part de trigrammes répétés
+    "length": 2.0,         # facteur d'écart maximal entre nombre de mots obtenu et attendu
+    # WER entre la transcription et celle du modèle de contrôle ; sur ce corpus, même les
+    # meilleurs modèles ont un WER médian proche de 0,7, d'où un seuil élevé
+    "disagreement": 0.8,
+}
+
+# Mots par ligne de texte lorsqu'aucune référence ne permet de l'estimer
+DEFAULT_WORDS_PER_LINE = 7
+
+# Appels simultanés lors d'un run
+DEFAULT_CONCURRENCY = 4
+
+ILLEGIBLE_MARKER = re.compile(r"\[XXX\]")
+
+
+def illegible_density(text):
+    """Part des mots remplacés par le marqueur [XXX]."""
+    markers = len(ILLEGIBLE_MARKER.findall(text or ""))
+    words = len(clean_text_for_wer(text or "").split())
+    return markers / (markers + words) if markers + words else 0.0
+
+
+def repetition_rate(text):
+    """Part des trigrammes de mots qui répètent un trigramme déjà vu."""
+    words = clean_text_for_wer(text or "").lower().split()
+    trigrams = list(zip(words, words[1:], words[2:]))
+    if len(trigrams) < 3:
+        return 0.0
+    return 1 - len(set(trigrams)) / len(trigrams)
+
+
+def disagreement(text, other):
+    """WER symétrisé entre deux transcriptions."""
+    return (calculate_wer(text or "", other or "") + calculate_wer(other or "", text or "")) / 2
+
+
+def quality_signals(text, expected_words=None, other=None):
+    """
+    Signaux de qualité d'une transcription, sans référence.
+
+    Args:
+        text: La transcription
+        expected_words: Nombre de mots attendu pour la page (optionnel)
+        other: Transcription d'un autre modèle pour la même page (optionnel)
+
+    Returns:
+        dict: Valeur de chaque signal disponible
+    """
+    signals = {
+        "illegible": illegible_density(text),
+        "repetition": repetition_rate(text),
+    }
+    if expected_words:
+        words = max(1, len(clean_text_for_wer(text or "").split()))
+        signals["length"] = max(words / expected_words, expected_words / words)
+    if other is not None:
+        signals["disagreement"] = disagreement(text, other)
+    return signals
+
+
+def uncertainty(signals, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Score d'incertitude : le plus grand des signaux rapportés à leur seuil.
+
+    Un score supérieur ou égal à 1 déclenche l'escalade avec les seuils donnés.
+    """
+    scores = []
+    for name, value in signals.items():
+        threshold = thresholds[name]
+        if name == "length":
+            # Rapport de longueurs : comparaison en échelle logarithmique
+            scores.append(math.log(value) / math.log(threshold))
+        else:
+            scores.append(value / threshold)
+    return max(scores, default=0.0)
+
+
+def calibrate_words_per_line(images, reference_dir=REFERENCE_DIR):
+    """Nombre médian de mots par ligne de texte détectée, d'après les transcriptions de référence."""
+    references = load_references(images, reference_dir)
+    ratios = []
+    for img_path in images:
+        if img_path.stem in references:
+            lines = count_text_lines(img_path)
+            if lines:
+                ratios.append(len(clean_text_for_wer(references[img_path.stem]).split()) / lines)
+    return statistics.median(ratios) if ratios else DEFAULT_WORDS_PER_LINE
+
+
+def expected_word_count(img_path, words_per_line):
+    """Nombre de mots attendu pour une page, ou None si l'image est illisible."""
+    try:
+        return count_text_lines(img_path) * words_per_line or None
+    except OSError:
+        return None
+
+
+def cascade_id(levels):
+    """Identifiant d'une configuration de cascade, utilisé comme nom de modèle dans le store."""
+    return "cascade/" + "+".join(levels)
+
+
+class Cascade:
+    """
+    Exécution de la cascade sur des pages, avec réutilisation des résultats du store.
+    """
+
+    def __init__(self, levels, store, check_model=None, thresholds=None, words_per_line=DEFAULT_WORDS_PER_LINE,
+                 model_types=None, concurrency=DEFAULT_CONCURRENCY):
+        self.levels = levels
+        self.store = store
+        self.check_model = check_model
+        self.thresholds = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+        self.words_per_line = words_per_line
+        self.model_types = model_types or {}
+        # Pool des appels, distinct de celui des pages pour éviter tout interblocage
+        self._calls = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency * 2, thread_name_prefix="cascade-call")
+
+    def close(self):
+        self._calls.shutdown(wait=True)
+
+    def _transcribe(self, img_path, model):
+        record = self.store.get(img_path.stem, model)
+        if record is None:
+            record = process_image(img_path, (model, self.model_types.get(model, "proprietary")), self.store)
+            record["cost"] = float((record.get("model_info") or {}).get("total_cost", 0.0) or 0.0)
+        return record
+
+    def transcribe(self, img_path):
+        """
+        Transcrit une page en escaladant tant que l'estimateur de qualité doute.
+
+        Returns:
+            dict: Résultat au format historique pour la configuration de cascade, avec le
+            détail de chaque niveau dans `model_info["cascade"]`
+        """
+        expected_words = expected_word_count(img_path, self.words_per_line)
+        first = self._calls.submit(self._transcribe, img_path, self.levels[0])
+        check = self._calls.submit(self._transcribe, img_path, self.check_model) if self.check_model else None
+
+        record = first.result()
+        other = check.result()["result"] if check else None
+        trail = []
+        total_cost = record["cost"] + (check.result()["cost"] if check else 0.0)
+        for level, model in enumerate(self.levels):
+            if level > 0:
+                previous = record["result"]
+                record = self._transcribe(img_path, model)
+                total_cost += record["cost"]
+                other = previous
+            signals = quality_signals(record["result"], expected_words, other)
+            score = uncertainty(signals, self.thresholds)
+            trail.append({"model": model, "signals": signals, "uncertainty": score})
+            if score < 1:
+                break
+
+        return {
+            "model": cascade_id(self.levels),
+            "editeur": "cascade",
+            "modele_type": record.get("modele_type"),
+            "image": str(img_path),
+            "result": record["result"],
+            "timestamp": datetime.now().isoformat(),
+            "model_info": {
+                "id": cascade_id(self.levels),
+                "accepted_model": record["model"],
+                "check_model": self.check_model,
+                "cascade": trail,
+                "total_cost": total_cost,
+            },
+            "usage": record.get("usage") or {},
+            "latency": None,
+        }
+
+    def run(self, images, concurrency=DEFAULT_CONCURRENCY):
+        """Transcrit des pages en parallèle et enregistre les résultats retenus dans le run `cascade`."""
+        results = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="cascade-page") as pages:
+            future_to_image = {pages.submit(self.transcribe, img_path): img_path for img_path in images}
+            for future in concurrent.futures.as_completed(future_to_image):
+                img_path = future_to_image[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Error processing {img_path} with the cascade: {str(e)}")
+                    continue
+                self.store.put(result, run=CASCADE_RUN)
+                results.append(result)
+                levels_used = len(result["model_info"]["cascade"])
+                print(f"{img_path.stem} : {result['model_info']['accepted_model']} "
+                      f"(niveau {levels_used}/{len(self.levels)}, {result['model_info']['total_cost']:.4f} $)")
+        return results
+
+
+def page_outcomes(store, images, levels, check_model, references, words_per_line):
+    """
+    Résultats disponibles dans le store pour rejouer la cascade hors ligne.
+
+    Seules les pages ayant une référence et un résultat pour chaque niveau (et pour le
+    modèle de contrôle) sont retenues.
+
+    Returns:
+        list: Par page, un dictionnaire avec le coût fixe du premier passage et, pour
+        chaque niveau, le coût, le WER et le score d'incertitude
+    """
+    outcomes = []
+    for img_path in images:
+        image = img_path.stem
+        if image not in references:
+            continue
+        records = [store.get(image, model) for model in levels]
+        check = store.get(image, check_model) if check_model else None
+        if any(record is None for record in records) or (check_model and check is None):
+            continue
+
+        expected_words = expected_word_count(img_path, words_per_line) if img_path.exists() else None
+        other = check["result"] if check else None
+        steps = []
+        for record in records:
+            signals = quality_signals(record["result"], expected_words, other)
+            steps.append({
+                "cost": record["cost"],
+                "wer": calculate_wer(references[image], record["result"] or ""),
+                "signals": signals,
+            })
+            other = record["result"]
+        outcomes.append({"image": image, "check_cost": check["cost"] if check else 0.0, "steps": steps})
+    return outcomes
+
+
+def simulate(outcomes, thresholds, scale):
+    """
+    Rejoue la cascade : une page est escaladée lorsque son score d'incertitude atteint
+    `scale` (0 : toujours escalader, infini : ne jamais escalader).
+
+    Returns:
+        dict: Coût total, WER médian et moyen, nombre de pages escaladées
+    """
+    costs, wers, escalated = [], [], 0
+    for outcome in outcomes:
+        cost = outcome["check_cost"]
+        for level, step in enumerate(outcome["steps"]):
+            cost += step["cost"]
+            score = uncertainty(step["signals"], thresholds)
+            if score < scale or level == len(outcome["steps"]) - 1:
+                wers.append(step["wer"])
+                escalated += level > 0
+                break
+        costs.append(cost)
+    return {
+        "cost": sum(costs),
+        "median": statistics.median(wers) if wers else None,
+        "mean": statistics.mean(wers) if wers else None,
+        "escalated": escalated,
+    }
+
+
+def tradeoff_curve(outcomes, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Courbe coût / WER obtenue en faisant varier le seuil d'escalade.
+
+    Le score d'incertitude de chaque page est comparé à un seuil `scale` (1 correspond
+    aux seuils par défaut) ; chaque valeur distincte de score donne un point.
+
+    Returns:
+        list: Points (seuil, simulation), du moins au plus coûteux
+    """
+    scores = sorted({
+        uncertainty(step["signals"], thresholds)
+        for outcome in outcomes for step in outcome["steps"][:-1]
+    })
+    # Un seuil juste au-dessus de chaque score : la page correspondante n'est plus escaladée
+    scales = [math.inf] + [score + 1e-9 for score in reversed(scores)] + [0.0]
+    if 1.0 not in scales:
+        scales.append(1.0)
+    points = [(scale, simulate(outcomes, thresholds, scale)) for scale in scales]
+    points.sort(key=lambda point: (point[1]["cost"], -point[0]))
+    # Plusieurs seuils peuvent donner exactement les mêmes escalades : on garde le premier,
+    # sauf pour le point des seuils par défaut
+    deduplicated = []
+    for scale, result in points:
+        if deduplicated and deduplicated[-1][1] == result and scale != 1.0:
+            continue
+        deduplicated.append((scale, result))
+    return deduplicated
+
+
+def write_cascade_report(points, outcomes, levels, check_model, thresholds, output_file=REPORT_FILE):
+    """Écrit la courbe coût / WER de la cascade, en signalant les points Pareto-optimaux."""
+    output_file = Path(output_file)
+    output_file.parent.mkdir(exist_ok=True)
+    lines = [
+        "# Cascade de modèles : compromis coût / WER",
+        "",
+        f"Généré le {datetime.now().strftime('%d/%m/%Y à %H:%M:%S')}",
+        "",
+        f"Niveaux : {' → '.join(f'`{model}`' for model in levels)}"
+        + (f" ; modèle de contrôle : `{check_model}`" if check_model else ""),
+        "",
+        "Seuils par défaut : " + ", ".join(f"{name} = {value}" for name, value in thresholds.items()),
+        "",
+        f"Pages évaluées : {len(outcomes)} (pages ayant une référence et un résultat pour chaque modèle)",
+        "",
+        "| Seuil d'incertitude | Pages escaladées | Coût total ($) | Coût moyen ($) | WER médian | WER moyen | Pareto |",
+        "|---------------------|------------------|----------------|----------------|------------|-----------|--------|",
+    ]
+    best_mean = math.inf
+    for scale, result in points:
+        pareto = result["mean"] is not None and result["mean"] < best_mean
+        if pareto:
+            best_mean = result["mean"]
+        if scale == math.inf:
+            label = "∞ (premier niveau seul)"
+        elif scale == 0:
+            label = "0 (toujours escalader)"
+        elif scale == 1.0:
+            label = "1 (seuils par défaut)"
+        else:
+            label = f"{scale:.3f}"
+        mean_cost = result["cost"] / len(outcomes) if outcomes else 0.0
+        median = "-" if result["median"] is None else f"{result['median']:.3f}"
+        mean = "-" if result["mean"] is None else f"{result['mean']:.3f}"
+        lines.append(f"| {label} | {result['escalated']} | {result['cost']:.4f} | {mean_cost:.5f} | "
+                     f"{median} | {mean} | {'✓' if pareto else ''} |")
+    lines += [
+        "",
+        "Une page est escaladée au niveau suivant lorsque son score d'incertitude (le plus grand des "
+        "signaux rapportés à leur seuil) atteint le seuil de la ligne. Le coût inclut le modèle de "
+        "contrôle, appelé sur toutes les pages. Un point est Pareto-optimal lorsqu'aucun point moins "
+        "coûteux n'a un WER moyen inférieur.",
+    ]
+    output_file.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    print(f"Rapport de la cascade écrit dans '{output_file}'")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Cascade de modèles HTR déclenchée par un estimateur de qualité.")
+    parser.add_argument("command", choices=["run", "report"])
+    parser.add_argument("--levels", nargs="+", required=True,
+                        help="Modèles de la cascade, du moins coûteux au plus coûteux")
+    parser.add_argument("--check", help="Modèle bon marché de contrôle, comparé au premier niveau")
+    parser.add_argument("--images-dir", type=Path, default=IMAGES_DIR, help="Dossier des images")
+    parser.add_argument("--models-file", type=Path, default=MODELS_FILE, help="Fichier JSON des modèles (types)")
+    parser.add_argument("--db", type=Path, default=DEFAULT_DB_PATH, help="Store indexé des résultats (SQLite)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Pages traitées simultanément")
+    parser.add_argument("--max-illegible", type=float, default=DEFAULT_THRESHOLDS["illegible"])
+    parser.add_argument("--max-repetition", type=float, default=DEFAULT_THRESHOLDS["repetition"])
+    parser.add_argument("--max-length-ratio", type=float, default=DEFAULT_THRESHOLDS["length"])
+    parser.add_argument("--max-disagreement", type=float, default=DEFAULT_THRESHOLDS["disagreement"])
+    parser.add_argument("--output", type=Path, default=REPORT_FILE, help="Rapport de la courbe coût / WER")
+    args = parser.parse_args()
+    # Le signal de longueur est un facteur d'écart (≥ 1) comparé en échelle logarithmique
+    if args.max_length_ratio <= 1:
+        parser.error("--max-length-ratio doit être supérieur à 1")
+    if min(args.max_illegible, args.max_repetition, args.max_disagreement) <= 0:
+        parser.error("--max-illegible, --max-repetition et --max-disagreement doivent être positifs")
+    return args
+
+
+def main():
+    args = parse_args()
+    thresholds = {
+        "illegible": args.max_illegible,
+        "repetition": args.max_repetition,
+        "length": args.max_length_ratio,
+        "disagreement": args.max_disagreement,
+    }
+    store = open_result_store(args.db, RESULTS_DIR)
+    images = list_images(args.images_dir)
+    words_per_line = calibrate_words_per_line(images)
+    print(f"{words_per_line:.1f} mots par ligne de texte en moyenne d'après les références")
+
+    if args.command == "report":
+        outcomes = page_outcomes(store, images, args.levels, args.check, load_references(images), words_per_line)
+        if not outcomes:
+            print("Aucune page n'a de résultat pour tous les modèles de la cascade dans le store")
+            return
+        write_cascade_report(tradeoff_curve(outcomes, thresholds), outcomes, args.levels, args.check, thresholds,
+                             args.output)
+        return
+
+    cascade = Cascade(args.levels, store, args.check, thresholds, words_per_line,
+                      dict(load_models(args.models_file)), args.concurrency)
+    try:
+        results = cascade.run(images, args.concurrency)
+    finally:
+        cascade.close()
+    total_cost = sum(result["model_info"]["total_cost"] for result in results)
+    escalated = sum(len(result["model_info"]["cascade"]) > 1 for result in results)
+    print(f"Cascade terminée : {len(results)} pages, {escalated} escaladées, coût total {total_cost:.4f} $")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Estimation préalable du coût d'un benchmark et ordonnancement sous budget.
+
+Pour chaque couple (image, modèle), le nombre de tokens d'entrée est estimé à partir
+des dimensions de l'image telle que `api_clients.prepare_image` l'enverrait (limites
+propres au modèle), de la règle de découpage en tokens du fournisseur et de la longueur
+du prompt système. La longueur de la réponse est tirée de l'historique du store
+(médiane des tokens de sortie du modèle). Les tokens sont valorisés avec les tarifs
+OpenRouter mis en cache sur disque.
+
+Lorsque le budget ne suffit pas pour toute la file, les tâches sont choisies de façon
+gloutonne pour maximiser la couverture (pages × modèles) par dollar, avec un rendement
+décroissant par modèle pour que chaque modèle reçoive quelques pages. Pendant le run,
+`BudgetGuard` réserve le coût estimé (avec une marge) de chaque appel avant de le lancer
+et n'en lance plus dès que le budget serait dépassé.
+
+Usage : `python run_benchmark.py --estimate` ou `python run_benchmark.py --budget 5`.
+"""
+
+import heapq
+import json
+import math
+import statistics
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from api_clients import fetch_openrouter_pricing, get_image_limits, is_kraken_model, is_transkribus_model, prepare_image
+from config import system_prompt
+
+CACHE_DIR = Path("./cache")
+PRICING_CACHE_FILE = CACHE_DIR / "openrouter_pricing.json"
+DIMENSIONS_CACHE_FILE = CACHE_DIR / "image_dimensions.json"
+
+# Durée de validité du cache des tarifs (en secondes)
+PRICING_MAX_AGE = 24 * 3600
+
+# Nombre moyen de caractères par token pour le texte du prompt (français)
+CHARS_PER_TOKEN = 3.2
+
+# Tokens de sortie attendus lorsqu'aucun historique n'est disponible
+DEFAULT_OUTPUT_TOKENS = 500
+
+# Nombre minimal de résultats d'un modèle pour utiliser son historique de tokens
+MIN_HISTORY = 3
+
+# Marge appliquée au coût estimé réservé avant chaque appel
+RESERVE_MARGIN = 1.25
+
+
+class BudgetExceededError(Exception):
+    """Appel refusé car il ferait dépasser le budget du run."""
+
+
+def load_pricing(cache_file=PRICING_CACHE_FILE, max_age=PRICING_MAX_AGE):
+    """
+    Tarifs OpenRouter {modèle: (prix par token d'entrée, prix par token de sortie)}.
+
+    Le cache sur disque est utilisé tant qu'il a moins de `max_age` secondes ; sinon les
+    tarifs sont téléchargés à nouveau, et le cache périmé sert de repli hors connexion.
+    """
+    cached = None
+    if cache_file.exists():
+        with open(cache_file, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if time.time() - cached["fetched_at"] < max_age:
+            return {model: tuple(prices) for model, prices in cached["pricing"].items()}
+
+    try:
+        pricing = fetch_openrouter_pricing()
+    except Exception as e:
+        if cached is None:
+            print(f"Tarifs OpenRouter indisponibles, seuls les tarifs de l'historique seront utilisés : {e}")
+            return {}
+        print(f"Tarifs OpenRouter indisponibles, utilisation du cache du "
+              f"{time.strftime('%d/%m/%Y', time.localtime(cached['fetched_at']))} : {e}")
+        return {model: tuple(prices) for model, prices in cached["pricing"].items()}
+
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(cache_file, "w", encoding="utf-8") as f:
+        json.dump({"fetched_at": time.time(), "pricing": pricing}, f)
+    return pricing
+
+
+class ImageDimensions:
+    """
+    Dimensions des images après redimensionnement, mises en cache sur disque.
+
+    La clé tient compte de la date de modification de l'image et des limites appliquées :
+    le calcul (encodage JPEG itératif) n'est refait que si l'un des deux change.
+    """
+
+    def __init__(self, cache_file=DIMENSIONS_CACHE_FILE):
+        self.cache_file = cache_file
+        self._cache = {}
+        self._dirty = False
+        if cache_file.exists():
+            with open(cache_file, "r", encoding="utf-8") as f:
+                self._cache = json.load(f)
+
+    def get(self, img_path, max_size_bytes, max_dimension):
+        stat = Path(img_path).stat()
+        key = f"{img_path}|{stat.st_mtime_ns}|{stat.st_size}|{max_size_bytes}|{max_dimension}"
+        if key not in self._cache:
+            _, dimensions, _ = prepare_image(str(img_path), max_size_bytes, max_dimension)
+            self._cache[key] = list(dimensions)
+            self._dirty = True
+        return tuple(self._cache[key])
+
+    def save(self):
+        if self._dirty:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.cache_file, "w", encoding="utf-8") as f:
+                json.dump(self._cache, f)
+            self._dirty = False
+
+
+def _fit(width, height, max_long_edge=None, max_pixels=None):
+    """Dimensions après réduction (jamais d'agrandissement) sous un côté maximal et un nombre de pixels."""
+    scale = 1.0
+    if max_long_edge:
+        scale = min(scale, max_long_edge / max(width, height))
+    if max_pixels:
+        scale = min(scale, math.sqrt(max_pixels / (width * height)))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def estimate_image_tokens(model, width, height):
+    """
+    Tokens d'entrée consommés par une image, selon la règle de découpage du fournisseur.
+
+    Les règles reprennent la documentation publique de chaque fournisseur ; elles sont
+    approximatives et remplacées par l'historique du store dès qu'il existe.
+    """
+    provider = model.split("/")[0]
+    if provider == "openai":
+        # Détail « high » : 2048 px au plus, petit côté ramené à 768 px, tuiles de 512 px
+        width, height = _fit(width, height, max_long_edge=2048)
+        scale = min(1.0, 768 / min(width, height))
+        width, height = int(width * scale), int(height * scale)
+        return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+    if provider == "google":
+        # Gemini : 258 tokens par tuile de 768 px
+        if max(width, height) <= 384:
+            return 258
+        width, height = _fit(width, height, max_long_edge=3072)
+        return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+    if provider == "mistralai":
+        # Pixtral : patchs de 16 px sur une image de 1024 px au plus, plus un token par ligne
+        width, height = _fit(width, height, max_long_edge=1024)
+        rows = math.ceil(height / 16)
+        return math.ceil(width / 16) * rows + rows
+    if provider == "qwen":
+        # Qwen-VL : patchs de 28 px, 1280 patchs au plus
+        width, height = _fit(width, height, max_pixels=1280 * 28 * 28)
+        return math.ceil(width / 28) * math.ceil(height / 28)
+    if provider == "meta-llama":
+        # Llama 3.2 Vision : jusqu'à 4 tuiles de 560 px de 1601 tokens
+        return 1601 * min(4, math.ceil(width / 560) * math.ceil(height / 560))
+    # Règle d'Anthropic, utilisée par défaut : 1568 px et 1,15 Mpx au plus, 750 px par token
+    width, height = _fit(width, height, max_long_edge=1568, max_pixels=1_150_000)
+    return math.ceil(width * height / 750)
+
+
+def estimate_text_tokens(text):
+    """Nombre approximatif de tokens d'un texte."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def usage_history(store):
+    """
+    Historique des tokens et des tarifs par modèle, tiré du store.
+
+    Returns:
+        dict: {modèle: {"prompt_tokens": [...], "completion_tokens": [...], "pricing": (entrée, sortie)}}
+    """
+    history = defaultdict(lambda: {"prompt_tokens": [], "completion_tokens": [], "pricing": None})
+    for record in store.iter_records():
+        usage = record["usage"] or {}
+        entry = history[record["model"]]
+        if usage.get("prompt_tokens"):
+            entry["prompt_tokens"].append(usage["prompt_tokens"])
+            entry["completion_tokens"].append(usage.get("completion_tokens") or 0)
+        pricing = (record["model_info"] or {}).get("pricing")
+        if pricing:
+            entry["pricing"] = tuple(pricing)
+    return dict(history)
+
+
+class CostEstimator:
+    """
+    Estimation des tokens et du coût de chaque couple (image, modèle).
+    """
+
+    def __init__(self, store, pricing=None, system_message=system_prompt, output_tokens=None):
+        self.pricing = load_pricing() if pricing is None else pricing
+        self.history = usage_history(store)
+        self.prompt_tokens = estimate_text_tokens(system_message or "")
+        self.dimensions = ImageDimensions()
+
+        all_completions = [tokens for entry in self.history.values() for tokens in entry["completion_tokens"]]
+        self.default_output_tokens = output_tokens or (
+            statistics.median(all_completions) if all_completions else DEFAULT_OUTPUT_TOKENS
+        )
+        self.fixed_output_tokens = output_tokens
+
+    def model_pricing(self, model):
+        """Tarif d'un modèle : tarif OpenRouter courant, sinon dernier tarif connu dans l'historique."""
+        if model in self.pricing:
+            return self.pricing[model]
+        entry = self.history.get(model)
+        return entry["pricing"] if entry and entry["pricing"] else (0.0, 0.0)
+
+    def estimate(self, img_path, model):
+        """
+        Estime un appel.
+
+        Returns:
+            dict: prompt_tokens, completion_tokens, cost et source de l'estimation des tokens d'entrée
+        """
+        if is_transkribus_model(model) or is_kraken_model(model):
+            return {"prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0, "source": "gratuit"}
+
+        entry = self.history.get(model)
+        if entry and len(entry["prompt_tokens"]) >= MIN_HISTORY:
+            # Les fournisseurs ramènent les images à une taille fixe : l'historique du modèle
+            # est plus fiable que la règle théorique
+            prompt_tokens = statistics.median(entry["prompt_tokens"])
+            source = "historique"
+        else:
+            width, height = self.dimensions.get(img_path, *get_image_limits(model))
+            prompt_tokens = estimate_image_tokens(model, width, height) + self.prompt_tokens
+            source = "dimensions"
+
+        if self.fixed_output_tokens:
+            completion_tokens = self.fixed_output_tokens
+        elif entry and len(entry["completion_tokens"]) >= MIN_HISTORY:
+            completion_tokens = statistics.median(entry["completion_tokens"])
+        else:
+            completion_tokens = self.default_output_tokens
+
+        input_price, output_price = self.model_pricing(model)
+        return {
+            "prompt_tokens": int(prompt_tokens),
+            "completion_tokens": int(completion_tokens),
+            "cost": prompt_tokens * input_price + completion_tokens * output_price,
+            "source": source,
+        }
+
+    def estimate_tasks(self, tasks):
+        """
+        Estime chaque tâche de la file.
+
+        Returns:
+            dict: {(nom de l'image, modèle): estimation}
+        """
+        try:
+            return {
+                (img_path.stem, model_info[0]): self.estimate(img_path, model_info[0])
+                for img_path, model_info in tasks
+            }
+        finally:
+            self.dimensions.save()
+
+
+def plan_budget(tasks, estimates, budget):
+    """
+    Choisit les tâches à exécuter dans la limite du budget.
+
+    Sélection gloutonne par couverture par dollar : la valeur de la n-ième page d'un
+    modèle est 1/n (rendement décroissant, pour que chaque modèle soit couvert), divisée
+    par son coût estimé. Les tâches gratuites passent toujours en premier.
+
+    Returns:
+        tuple: (tâches retenues dans l'ordre d'exécution, tâches écartées, coût prévu)
+    """
+    by_model = defaultdict(list)
+    for task in tasks:
+        img_path, model_info = task
+        by_model[model_info[0]].append((estimates[(img_path.stem, model_info[0])]["cost"], img_path.stem, task))
+    for model_tasks in by_model.values():
+        model_tasks.sort(key=lambda item: (item[0], item[1]))
+
+    def priority(model, taken):
+        cost = by_model[model][taken][0]
+        value = 1.0 / (taken + 1)
+        return -(value / cost) if cost > 0 else -math.inf
+
+    heap = [(priority(model, 0), model, 0) for model in by_model]
+    heapq.heapify(heap)
+    selected = []
+    planned = 0.0
+    while heap:
+        _, model, taken = heapq.heappop(heap)
+        cost, _, task = by_model[model][taken]
+        if planned + cost > budget:
+            # Les tâches suivantes de ce modèle sont au moins aussi chères
+            continue
+        selected.append(task)
+        planned += cost
+        if taken + 1 < len(by_model[model]):
+            heapq.heappush(heap, (priority(model, taken + 1), model, taken + 1))
+
+    selected_ids = {id(task) for task in selected}
+    skipped = [task for task in tasks if id(task) not in selected_ids]
+    return selected, skipped, planned
+
+
+class BudgetGuard:
+    """
+    Garde-fou du budget pendant le run.
+
+    Avant son lancement, chaque appel réserve son coût estimé, majoré de `RESERVE_MARGIN`
+    et corrigé de l'écart déjà observé entre coûts réels et estimés pour ce modèle ; la
+    réservation est ensuite remplacée par le coût réel (rien pour un appel qui lève une
+    exception). Un appel n'est lancé que si le
+    coût dépensé, les réservations en cours et sa propre réservation tiennent dans le
+    budget : seuls des appels en cours dépassant leur réservation peuvent le faire déborder.
+    """
+
+    def __init__(self, budget, estimates, margin=RESERVE_MARGIN):
+        self.budget = budget
+        self.estimates = estimates
+        self.margin = margin
+        self.spent = 0.0
+        self.reserved = 0.0
+        self._ratios = {}
+        self._lock = threading.Lock()
+
+    def call(self, img_path, model, func, *args):
+        estimate = self.estimates.get((img_path.stem, model), {}).get("cost", 0.0)
+        with self._lock:
+            reservation = estimate * self.margin * max(1.0, self._ratios.get(model, 1.0))
+            if self.spent + self.reserved + reservation > self.budget:
+                raise BudgetExceededError(
+                    f"Budget de {self.budget:.4f} $ atteint ({self.spent:.4f} $ dépensés, "
+                    f"{self.reserved:.4f} $ réservés, {reservation:.4f} $ nécessaires pour cet appel)"
+                )
+            self.reserved += reservation
+
+        try:
+            result = func(*args)
+        except BaseException:
+            # Un appel en échec n'est pas facturé : sa réservation est simplement libérée
+            with self._lock:
+                self.reserved -= reservation
+            raise
+
+        actual = float((result.get("model_info") or {}).get("total_cost", estimate) or 0.0)
+        with self._lock:
+            self.reserved -= reservation
+            self.spent += actual
+            if estimate > 0:
+                self._ratios[model] = max(self._ratios.get(model, 0.0), actual / estimate)
+        return result
+
+
+def format_forecast(tasks, estimates):
+    """Résumé de la prévision par modèle, du plus cher au moins cher."""
+    per_model = defaultdict(lambda: {"tasks": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0, "sources": set()})
+    for img_path, model_info in tasks:
+        estimate = estimates[(img_path.stem, model_info[0])]
+        entry = per_model[model_info[0]]
+        entry["tasks"] += 1
+        entry["prompt_tokens"] += estimate["prompt_tokens"]
+        entry["completion_tokens"] += estimate["completion_tokens"]
+        entry["cost"] += estimate["cost"]
+        entry["sources"].add(estimate["source"])
+
+    lines = [
+        f"{'Modèle':<45} {'Pages':>6} {'Tokens entrée':>14} {'Tokens sortie':>14} {'Coût ($)':>10}  Estimation",
+    ]
+    for model, entry in sorted(per_model.items(), key=lambda item: -item[1]["cost"]):
+        lines.append(f"{model:<45} {entry['tasks']:>6} {entry['prompt_tokens']:>14} {entry['completion_tokens']:>14} "
+                     f"{entry['cost']:>10.4f}  {', '.join(sorted(entry['sources']))}")
+    total = sum(entry["cost"] for entry in per_model.values())
+    lines.append(f"{'Total':<45} {len(tasks):>6} {'':>14} {'':>14} {total:>10.4f}")
+    return "\n".join(lines)
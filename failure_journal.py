@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Journal persistant des appels en échec et politique de relance par classe d'erreur.
+
+Chaque échec d'un couple (image, modèle) est consigné avec sa classe d'erreur, son statut
+HTTP, le nombre de tentatives et la date de la prochaine relance autorisée. Les erreurs
+transitoires (limite de débit, erreur serveur, réseau) sont relancées avec un délai
+exponentiel propre à leur classe ; les erreurs permanentes (modèle invalide, image trop
+grande, authentification) ne le sont jamais.
+
+La relance se fait avec `python run_benchmark.py --replay` ; ce script permet de consulter
+le journal :
+  python failure_journal.py list
+  python failure_journal.py stats
+"""
+
+import argparse
+import random
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import requests
+
+from api_errors import InvalidModelError, ImageProcessingError
+from results_store import DEFAULT_DB_PATH, DEFAULT_RUN, image_stem
+
+# Politique de relance par classe d'erreur :
+# (erreur permanente, délai de base en secondes, nombre maximal de tentatives)
+RETRY_POLICIES = {
+    "invalid_model": (True, 0, 1),
+    "image_too_large": (True, 0, 1),
+    "image_unreadable": (True, 0, 1),
+    "auth": (True, 0, 1),
+    "bad_request": (True, 0, 1),
+    "rate_limit": (False, 60, 8),
+    "server_error": (False, 30, 5),
+    "network": (False, 10, 5),
+    "unknown": (False, 30, 3),
+}
+
+# Délai maximal entre deux tentatives (en secondes)
+MAX_BACKOFF = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS failures (
+    image TEXT NOT NULL,
+    model TEXT NOT NULL,
+    run TEXT NOT NULL DEFAULT 'default',
+    image_path TEXT NOT NULL,
+    model_type TEXT,
+    error_class TEXT NOT NULL,
+    http_status INTEGER,
+    message TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    first_failed TEXT,
+    last_failed TEXT,
+    next_retry_at REAL,
+    PRIMARY KEY (image, model, run)
+);
+"""
+
+
+def classify_error(exc):
+    """
+    Détermine la classe d'erreur et le statut HTTP d'une exception levée par `query_model`.
+
+    Returns:
+        tuple: (classe d'erreur, statut HTTP ou None)
+    """
+    status = getattr(exc, "status_code", None)
+    message = str(exc).lower()
+
+    if isinstance(exc, InvalidModelError):
+        return "invalid_model", status
+    if status == 413 or "too large" in message or "exceeds the maximum" in message:
+        return "image_too_large", status
+    if isinstance(exc, ImageProcessingError):
+        return "image_unreadable", status
+    if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return "network", status
+    if status in (401, 402, 403):
+        return "auth", status
+    if status == 404:
+        # OpenRouter répond 404 lorsqu'aucun fournisseur ne sert le modèle demandé
+        return "invalid_model", status
+    if status == 429:
+        return "rate_limit", status
+    if status is not None and status >= 500:
+        return "server_error", status
+    if status == 400:
+        return "bad_request", status
+    return "unknown", status
+
+
+def is_permanent(error_class):
+    """Indique si une classe d'erreur ne doit jamais être relancée."""
+    return RETRY_POLICIES.get(error_class, RETRY_POLICIES["unknown"])[0]
+
+
+def next_retry_delay(error_class, attempts):
+    """Délai avant la prochaine tentative (backoff exponentiel avec gigue)."""
+    _, base_delay, _ = RETRY_POLICIES.get(error_class, RETRY_POLICIES["unknown"])
+    delay = min(MAX_BACKOFF, base_delay * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class FailureJournal:
+    """
+    Journal des échecs, stocké dans la base SQLite du store des résultats.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.db_path = str(db_path)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record_failure(self, img_path, model, exc, model_type=None, run=DEFAULT_RUN):
+        """
+        Consigne l'échec d'un appel et planifie sa prochaine relance.
+
+        Returns:
+            str: La classe d'erreur retenue
+        """
+        error_class, status = classify_error(exc)
+        image = image_stem(str(img_path))
+        now = time.time()
+        timestamp = datetime.now().isoformat()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT attempts, first_failed FROM failures WHERE image = ? AND model = ? AND run = ?",
+                (image, model, run)
+            ).fetchone()
+            attempts = (row["attempts"] if row else 0) + 1
+            conn.execute(
+                "INSERT OR REPLACE INTO failures (image, model, run, image_path, model_type, error_class, "
+                "http_status, message, attempts, first_failed, last_failed, next_retry_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    image, model, run, str(img_path), model_type, error_class, status, str(exc)[:2000],
+                    attempts, row["first_failed"] if row else timestamp, timestamp,
+                    None if is_permanent(error_class) else now + next_retry_delay(error_class, attempts)
+                )
+            )
+        return error_class
+
+    def resolve(self, img_path, model, run=DEFAULT_RUN):
+        """Retire un couple du journal après un appel réussi."""
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM failures WHERE image = ? AND model = ? AND run = ?",
+                (image_stem(str(img_path)), model, run)
+            )
+
+    def _retryable_rows(self, conn, run):
+        rows = conn.execute(
+            "SELECT * FROM failures WHERE run = ? AND next_retry_at IS NOT NULL ORDER BY next_retry_at", (run,)
+        ).fetchall()
+        return [
+            dict(row) for row in rows
+            if row["attempts"] < RETRY_POLICIES.get(row["error_class"], RETRY_POLICIES["unknown"])[2]
+        ]
+
+    def retryable(self, run=DEFAULT_RUN):
+        """Échecs transitoires qui n'ont pas épuisé leurs tentatives, triés par date de relance."""
+        with self._connect() as conn:
+            return self._retryable_rows(conn, run)
+
+    def due(self, run=DEFAULT_RUN, now=None):
+        """Échecs transitoires dont la date de relance est atteinte."""
+        now = now or time.time()
+        return [row for row in self.retryable(run) if row["next_retry_at"] <= now]
+
+    def permanent_pairs(self, run=DEFAULT_RUN):
+        """Couples (image, modèle) en échec permanent, à exclure des prochains runs."""
+        with self._connect() as conn:
+            return {(row["image"], row["model"]) for row in conn.execute(
+                "SELECT image, model FROM failures WHERE run = ? AND next_retry_at IS NULL", (run,)
+            )}
+
+    def entries(self, run=DEFAULT_RUN):
+        """Toutes les entrées du journal pour un run."""
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(
+                "SELECT * FROM failures WHERE run = ? ORDER BY error_class, model, image", (run,)
+            )]
+
+    def stats(self, run=DEFAULT_RUN):
+        """Nombre d'échecs par classe d'erreur."""
+        with self._connect() as conn:
+            return dict(conn.execute(
+                "SELECT error_class, COUNT(*) FROM failures WHERE run = ? GROUP BY error_class", (run,)
+            ).fetchall())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consultation du journal des appels en échec.")
+    parser.add_argument("command", choices=["list", "stats"])
+    parser.add_argument("--db", default=str(DEFAULT_DB_PATH), help="Base SQLite du store des résultats")
+    parser.add_argument("--run", default=DEFAULT_RUN, help="Nom du run")
+    args = parser.parse_args()
+
+    journal = FailureJournal(args.db)
+    if args.command == "stats":
+        for error_class, count in sorted(journal.stats(args.run).items()):
+            kind = "permanente" if is_permanent(error_class) else "transitoire"
+            print(f"{error_class} ({kind}) : {count}")
+        return
+
+    for entry in journal.entries(args.run):
+        if entry["next_retry_at"] is None:
+            retry = "jamais"
+        else:
+            retry = datetime.fromtimestamp(entry["next_retry_at"]).strftime("%d/%m/%Y %H:%M:%S")
+        print(f"{entry['image']} | {entry['model']} | {entry['error_class']} | HTTP {entry['http_status']} | "
+              f"{entry['attempts']} tentative(s) | relance : {retry}")
+
+
+if __name__ == "__main__":
+    main()
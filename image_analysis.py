@@ -0,0 +1,238 @@
+"""Analyse d'images de pages avec NumPy : niveaux de gris, seuil d'Otsu, densité d'encre, pages blanches et empreintes perceptuelles."""
+
+import numpy as np
+from PIL import Image
+
+# Les scans du corpus dépassent souvent 60 Mpx
+Image.MAX_IMAGE_PIXELS = 200000000
+
+# Côté maximal des images réduites utilisées pour l'analyse (en pixels)
+ANALYSIS_MAX_SIDE = 1500
+
+# Écart minimal (en niveaux de gris) entre l'encre et le papier environnant
+INK_OFFSET = 30
+
+# Bande ignorée sur les bords des pages (contour du papier, fond du scanner), fraction du plus grand côté
+BORDER_BAND = 0.015
+
+# Grille de cellules (par côté) de l'histogramme de densité d'encre
+DENSITY_GRID = 32
+
+# Densité d'encre au-delà de laquelle une cellule de la grille contient de l'écriture
+CELL_INK_DENSITY = 0.02
+
+# Bornes de l'histogramme de densité d'encre des cellules
+DENSITY_BINS = (0.0, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 1.0)
+
+# Côté de la grille de l'empreinte perceptuelle (dHash de DHASH_SIZE² bits)
+DHASH_SIZE = 8
+
+# Empreintes comparées à la fois à toutes les autres : la mémoire reste en O(bloc × n)
+HAMMING_CHUNK_ROWS = 512
+
+# Largeur minimale d'une gouttière entre deux colonnes (fraction de la largeur de la page)
+MIN_GUTTER = 0.03
+
+# Largeur minimale d'une colonne (fraction de la largeur de la page)
+MIN_COLUMN_WIDTH = 0.08
+
+
+def load_grayscale(image_path, max_side=ANALYSIS_MAX_SIDE):
+    """
+    Charge une image en niveaux de gris (tableau uint8), réduite si nécessaire.
+
+    Returns:
+        tuple: (tableau 2D, facteur d'échelle appliqué par rapport à l'image d'origine)
+    """
+    with Image.open(image_path) as img:
+        scale = 1.0
+        if max_side and max(img.size) > max_side:
+            scale = max_side / max(img.size)
+            size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+            # Décodage JPEG directement à taille réduite lorsque c'est possible
+            img.draft("L", size)
+            img = img.convert("L").resize(size, Image.BILINEAR)
+        else:
+            img = img.convert("L")
+        return np.asarray(img, dtype=np.uint8), scale
+
+
+def otsu_threshold(gray):
+    """Seuil d'Otsu d'une image en niveaux de gris (maximise la variance inter-classes)."""
+    histogram = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    total = histogram.sum()
+    if total == 0:
+        return 128
+    levels = np.arange(256)
+    weight_background = np.cumsum(histogram)
+    weight_foreground = total - weight_background
+    cumulative_mean = np.cumsum(histogram * levels)
+    mean_background = cumulative_mean / np.maximum(weight_background, 1)
+    mean_foreground = (cumulative_mean[-1] - cumulative_mean) / np.maximum(weight_foreground, 1)
+    variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+    return int(np.argmax(variance))
+
+
+def local_mean(gray, window):
+    """Moyenne de chaque pixel sur une fenêtre carrée de côté `window` (image intégrale)."""
+    half = window // 2
+    padded = np.pad(gray.astype(np.float64), half + 1, mode="edge")
+    integral = padded.cumsum(axis=0).cumsum(axis=1)
+    height, width = gray.shape
+    top, left = np.arange(height), np.arange(width)
+    bottom, right = top + window, left + window
+    total = (integral[np.ix_(bottom, right)] - integral[np.ix_(top, right)]
+             - integral[np.ix_(bottom, left)] + integral[np.ix_(top, left)])
+    return total / (window * window)
+
+
+def ink_mask(gray, offset=INK_OFFSET):
+    """
+    Masque booléen des pixels d'encre.
+
+    Un pixel est de l'encre s'il est plus sombre de `offset` niveaux que la moyenne de
+    son voisinage : contrairement à un seuil global, le jaunissement du papier et les
+    variations d'éclairage du scan ne sont pas pris pour de l'écriture.
+    """
+    window = max(15, (max(gray.shape) // 40) | 1)
+    return gray < local_mean(gray, window) - offset
+
+
+def ink_ratio(image_path, max_side=ANALYSIS_MAX_SIDE):
+    """Proportion de pixels d'encre d'une page."""
+    gray, _ = load_grayscale(image_path, max_side)
+    return float(ink_mask(gray).mean())
+
+
+def clear_border(mask, band=BORDER_BAND):
+    """Copie du masque d'encre sans sa bande de bord, où le contour du papier passe pour des traits."""
+    inner = mask.copy()
+    band = max(1, int(band * max(mask.shape)))
+    inner[:band, :] = inner[-band:, :] = False
+    inner[:, :band] = inner[:, -band:] = False
+    return inner
+
+
+def cell_densities(mask, grid=DENSITY_GRID):
+    """Densité d'encre de chaque cellule d'une grille `grid` × `grid` posée sur le masque."""
+    height, width = mask.shape
+    rows = np.linspace(0, height, grid + 1).astype(int)
+    cols = np.linspace(0, width, grid + 1).astype(int)
+    # Sommes par cellule en deux réductions vectorisées (lignes puis colonnes)
+    sums = np.add.reduceat(np.add.reduceat(mask.astype(np.int32), rows[:-1], axis=0), cols[:-1], axis=1)
+    areas = np.outer(np.diff(rows), np.diff(cols))
+    return sums / np.maximum(areas, 1)
+
+
+def ink_density_histogram(mask, grid=DENSITY_GRID, bins=DENSITY_BINS):
+    """
+    Histogramme de la densité d'encre des cellules de la page (bords exclus).
+
+    Returns:
+        tuple: (effectifs par intervalle de `bins`, fraction des cellules contenant de l'écriture)
+    """
+    densities = cell_densities(clear_border(mask), grid)
+    counts, _ = np.histogram(densities, bins=bins)
+    return counts.tolist(), float((densities >= CELL_INK_DENSITY).mean())
+
+
+def row_runs(profile, threshold, min_height=1):
+    """Intervalles [début, fin) des lignes consécutives du profil au-dessus du seuil."""
+    on = np.concatenate([[0], (profile > threshold).astype(np.int8), [0]])
+    edges = np.diff(on)
+    runs = list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+    return [(int(start), int(end)) for start, end in runs if end - start >= min_height]
+
+
+def text_line_bands(mask):
+    """
+    Bandes horizontales de texte d'un masque d'encre (profil de projection horizontal).
+
+    Le profil est lissé, puis diminué de son niveau de fond (traits verticaux, bords
+    du scan) ; les bandes trop fines par rapport à la hauteur médiane sont ignorées.
+    """
+    profile = mask.mean(axis=1)
+    window = max(3, mask.shape[0] // 300)
+    profile = np.convolve(profile, np.ones(window) / window, mode="same")
+    profile = profile - np.percentile(profile, 20)
+    positive = profile[profile > 0]
+    if positive.size == 0:
+        return []
+    bands = row_runs(profile, max(0.01, 0.25 * np.percentile(positive, 90)))
+    if not bands:
+        return []
+    median_height = np.median([end - start for start, end in bands])
+    return [(start, end) for start, end in bands if end - start >= 0.3 * median_height]
+
+
+def count_text_lines(image_path, max_side=ANALYSIS_MAX_SIDE):
+    """Nombre approximatif de lignes de texte d'une page."""
+    gray, _ = load_grayscale(image_path, max_side)
+    return len(text_line_bands(ink_mask(gray)))
+
+
+def detect_columns(mask, min_gutter=MIN_GUTTER, min_width=MIN_COLUMN_WIDTH):
+    """
+    Colonnes de texte d'un masque d'encre, séparées par des gouttières vides.
+
+    Returns:
+        list: Intervalles [x0, x1) de gauche à droite
+    """
+    width = mask.shape[1]
+    profile = mask.mean(axis=0)
+    window = max(3, width // 100)
+    profile = np.convolve(profile, np.ones(window) / window, mode="same")
+    profile = profile - np.percentile(profile, 10)
+    positive = profile[profile > 0]
+    if positive.size == 0:
+        return [(0, width)]
+
+    # Une gouttière est presque vide : seuil bien plus bas que celui des lignes de texte
+    threshold = 0.05 * np.percentile(positive, 90)
+    gaps = [(x0, x1) for x0, x1 in row_runs(-profile, -threshold) if x1 - x0 >= min_gutter * width]
+    columns = []
+    start = 0
+    for x0, x1 in gaps + [(width, width)]:
+        if x0 - start >= min_width * width:
+            columns.append((start, x0))
+        start = x1
+    return columns or [(0, width)]
+
+
+def dhash(gray, size=DHASH_SIZE):
+    """
+    Empreinte perceptuelle (dHash) d'une image : signe du gradient horizontal sur une
+    vignette de `size` × `size + 1` pixels. Deux numérisations de la même page, ou une
+    page et un léger recadrage, ont des empreintes proches au sens de la distance de Hamming.
+
+    Returns:
+        str: Empreinte hexadécimale de `size²` bits
+    """
+    thumbnail = np.asarray(Image.fromarray(gray).resize((size + 1, size), Image.BILINEAR), dtype=np.int16)
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).ravel()
+    return np.packbits(bits).tobytes().hex()
+
+
+def close_hash_pairs(hashes, max_distance, chunk_rows=HAMMING_CHUNK_ROWS):
+    """
+    Couples d'empreintes hexadécimales (de même longueur) à distance de Hamming au plus
+    `max_distance`. Les distances sont calculées par blocs de `chunk_rows` empreintes,
+    sans jamais construire la matrice n × n complète.
+
+    Returns:
+        list: Couples d'indices (i, j) avec i < j
+    """
+    bits = np.unpackbits(
+        np.array([np.frombuffer(bytes.fromhex(value), dtype=np.uint8) for value in hashes]), axis=1
+    ).astype(np.float32)  # produit en BLAS, exact pour des comptes de bits aussi petits
+    ones = bits.sum(axis=1)
+    pairs = []
+    for start in range(0, len(hashes), chunk_rows):
+        block = bits[start:start + chunk_rows]
+        # Produit matriciel : nombre de bits à 1 en commun, puis distance = bits différents ;
+        # seules les empreintes qui suivent le bloc sont comparées (chaque couple une fois)
+        distances = ones[start:start + len(block), None] + ones[None, start:] - 2 * (block @ bits[start:].T)
+        for i, j in zip(*(distances <= max_distance).nonzero()):
+            if j > i:
+                pairs.append((start + int(i), start + int(j)))
+    return pairs
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Images dérivées des pages du corpus pour le web : vignettes et versions réduites.
+
+Le viewer affichait les PNG d'origine (plusieurs mégaoctets) partout, y compris dans les
+listes. Chaque page est déclinée en :
+  - une vignette WebP de `THUMBNAIL_WIDTH` pixels de large, pour les listes ;
+  - des versions WebP et AVIF (si Pillow sait écrire l'AVIF) aux largeurs de
+    `RENDITION_WIDTHS`, parmi lesquelles le navigateur choisit (`srcset`).
+
+Les dérivées sont adressées par contenu (`derivatives/<empreinte>/<largeur>.<format>`) :
+une page inchangée n'est jamais réencodée, une copie réutilise les dérivées de l'original.
+`derivatives/manifest.json` associe chaque image à ses dérivées ; `images_list.json`
+(`scripts/generate_viewer_data.py`) y renvoie pour chaque image.
+
+  python image_derivatives.py build
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+from pathlib import Path
+
+from PIL import Image, features
+
+from image_index import IMAGES_DIR, group_by_content, list_images
+from task_ledger import write_json_atomic
+
+DERIVATIVES_DIR = Path("derivatives")
+MANIFEST_FILE = DERIVATIVES_DIR / "manifest.json"
+
+# Largeur des vignettes (en pixels)
+THUMBNAIL_WIDTH = 200
+
+# Largeurs des versions réduites (aucune version n'est plus large que l'original)
+RENDITION_WIDTHS = (480, 960, 1600)
+
+# Formats des versions réduites, par ordre de préférence du navigateur
+FORMATS = ["avif", "webp"] if features.check("avif") else ["webp"]
+
+# Qualité d'encodage par format
+QUALITY = {"webp": 80, "avif": 55}
+
+
+def derivative_path(sha256, width, fmt, output_dir=DERIVATIVES_DIR):
+    """Chemin d'une dérivée : empreinte du contenu, largeur et format."""
+    return Path(output_dir) / sha256[:16] / f"{width}.{fmt}"
+
+
+def planned_derivatives(sha256, original_width, output_dir=DERIVATIVES_DIR, formats=None):
+    """
+    Dérivées d'une image : vignette et versions réduites plus étroites que l'original.
+
+    Returns:
+        list: (largeur, format, chemin)
+    """
+    formats = formats or FORMATS
+    widths = [width for width in RENDITION_WIDTHS if width < original_width]
+    planned = [(min(THUMBNAIL_WIDTH, original_width), "webp")]
+    planned += [(width, fmt) for fmt in formats for width in widths]
+    return [(width, fmt, derivative_path(sha256, width, fmt, output_dir)) for width, fmt in dict.fromkeys(planned)]
+
+
+def save_derivative(img, width, fmt, path):
+    """Réduit une image à la largeur demandée et l'écrit (fichier temporaire puis renommage)."""
+    height = max(1, round(img.height * width / img.width))
+    resized = img.resize((width, height), Image.Resampling.LANCZOS)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    resized.save(tmp_path, fmt.upper(), quality=QUALITY[fmt])
+    os.replace(tmp_path, path)
+
+
+def build_derivatives(image_path, sha256, output_dir=DERIVATIVES_DIR, formats=None):
+    """
+    Écrit les dérivées manquantes d'une image.
+
+    Returns:
+        tuple: (entrée du manifeste, nombre de dérivées écrites)
+    """
+    with Image.open(image_path) as img:
+        width, height = img.size
+        planned = planned_derivatives(sha256, width, output_dir, formats)
+        missing = [(w, fmt, path) for w, fmt, path in planned if not path.exists()]
+        if missing:
+            Path(missing[0][2]).parent.mkdir(parents=True, exist_ok=True)
+            source = img.convert("RGB")
+            for w, fmt, path in missing:
+                save_derivative(source, w, fmt, path)
+
+    entry = {"sha256": sha256, "width": width, "height": height, "thumbnail": planned[0][2].as_posix(),
+             "renditions": {}}
+    for w, fmt, path in planned[1:]:
+        entry["renditions"].setdefault(fmt, {})[str(w)] = path.as_posix()
+    return entry, len(missing)
+
+
+def load_manifest(path=MANIFEST_FILE):
+    """Manifeste des dérivées {nom de l'image: entrée}, vide s'il n'a pas encore été construit."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def build_all(images, output_dir=DERIVATIVES_DIR, formats=None, workers=None):
+    """
+    Construit en parallèle (processus) les dérivées manquantes et réécrit le manifeste.
+    Les images de même contenu partagent leurs dérivées.
+
+    Returns:
+        dict: Manifeste {nom de l'image: entrée}
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    by_sha256 = group_by_content(images, workers)
+
+    manifest = {}
+    written = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(build_derivatives, paths[0], sha256, output_dir, formats): paths
+                   for sha256, paths in by_sha256.items()}
+        for future in concurrent.futures.as_completed(futures):
+            paths = futures[future]
+            try:
+                entry, count = future.result()
+            except Exception as e:
+                print(f"{paths[0].name} : dérivées impossibles ({e})")
+                continue
+            for image_path in paths:
+                manifest[image_path.stem] = entry
+            written += count
+            if count:
+                print(f"{paths[0].stem} : {count} dérivée(s) écrite(s)")
+
+    write_json_atomic(output_dir / MANIFEST_FILE.name, dict(sorted(manifest.items())))
+    print(f"{written} dérivée(s) écrite(s), {len(manifest)} image(s) dans le manifeste")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vignettes et versions web (WebP/AVIF) des images du corpus.")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--images-dir", type=Path, default=IMAGES_DIR, help="Dossier des images")
+    parser.add_argument("--output-dir", type=Path, default=DERIVATIVES_DIR, help="Dossier des dérivées")
+    parser.add_argument("--formats", nargs="+", choices=["avif", "webp"], default=FORMATS,
+                        help="Formats des versions réduites (défaut : %(default)s)")
+    parser.add_argument("--workers", type=int, help="Processus d'encodage (défaut : nombre de cœurs)")
+    args = parser.parse_args()
+
+    build_all(list_images(args.images_dir), args.output_dir, args.formats, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Index des images du corpus (`data/image_index.json`), adressé par contenu.
+
+Chaque page y est décrite par son nom (sans extension, comme dans le store), l'empreinte
+SHA-256 de son contenu, son empreinte perceptuelle (dHash), ses dimensions, l'histogramme
+de densité d'encre de sa grille de cellules et ses étiquettes :
+  - `blank` : page blanche, sans écriture ; elle n'est pas envoyée aux modèles et elle est
+    exclue du calcul du WER par les rapports ;
+  - `low_ink` : page presque vide (quelques lignes), signalée mais traitée normalement.
+Ces étiquettes sont détectées automatiquement (`detected`) ; des étiquettes posées à la main
+(`tags`) s'y ajoutent et survivent aux nouvelles analyses.
+
+Une même page peut exister sous plusieurs noms ou emplacements (copie dans `images/samples/`,
+renommage) : toutes les copies ont la même empreinte SHA-256, seule la première est analysée
+et traitée par les modèles, les autres noms renvoient vers elle (`duplicate_of`). Les pages
+dont l'empreinte perceptuelle est proche (nouvelle numérisation, recadrage) sont signalées
+(`near_duplicates`) sans être écartées.
+
+Les fichiers déjà vus (chemin, taille, date) ne sont ni relus ni réanalysés :
+
+  python image_index.py update                 # analyse les images de images/ et sous-dossiers
+  python image_index.py tag <page> blank       # étiquette posée à la main
+  python image_index.py list --tag blank
+  python image_index.py duplicates             # copies et quasi-doublons
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+from datetime import datetime
+from pathlib import Path
+
+from image_analysis import close_hash_pairs, dhash, ink_density_histogram, ink_mask, load_grayscale
+from task_ledger import write_json_atomic
+
+INDEX_FILE = Path("data") / "image_index.json"
+IMAGES_DIR = Path("images")
+
+# Côté des images réduites analysées : la détection des pages blanches n'a pas besoin de détail
+BLANK_ANALYSIS_SIDE = 1000
+
+# Fraction des cellules écrites en dessous de laquelle une page est blanche
+BLANK_COVERAGE = 0.015
+
+# Fraction des cellules écrites en dessous de laquelle une page est presque vide
+LOW_INK_COVERAGE = 0.08
+
+# Étiquettes exclues du calcul du WER
+WER_EXCLUDED_TAGS = ("blank",)
+
+# Distance de Hamming (sur 64 bits) en dessous de laquelle deux pages sont des quasi-doublons
+NEAR_DUPLICATE_DISTANCE = 10
+
+# Champs d'une entrée qui ne viennent pas de l'analyse de l'image et lui survivent
+PRESERVED_FIELDS = ("tags", "source")
+
+
+def file_digest(path):
+    """Empreinte SHA-256 d'un fichier."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def list_images(images_dir=IMAGES_DIR):
+    """Images (jpg et png) d'un dossier et de ses sous-dossiers."""
+    return sorted(list(images_dir.rglob("*.jpg")) + list(images_dir.rglob("*.png")))
+
+
+def group_by_content(images, workers=None):
+    """
+    Regroupe des images par contenu (empreintes calculées en parallèle, par threads).
+
+    Returns:
+        dict: {empreinte SHA-256: [chemins des images de ce contenu]}
+    """
+    images = [Path(img_path) for img_path in images]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        digests = executor.map(file_digest, images)
+    by_sha256 = {}
+    for img_path, sha256 in zip(images, digests):
+        by_sha256.setdefault(sha256, []).append(img_path)
+    return by_sha256
+
+
+def analyze_image(image_path, sha256=None):
+    """
+    Empreintes, dimensions, histogramme de densité d'encre et étiquettes détectées d'une image.
+
+    Returns:
+        dict: Entrée de l'index (sans les étiquettes posées à la main)
+    """
+    image_path = Path(image_path)
+    gray, scale = load_grayscale(image_path, BLANK_ANALYSIS_SIDE)
+    histogram, coverage = ink_density_histogram(ink_mask(gray))
+    detected = []
+    if coverage < BLANK_COVERAGE:
+        detected.append("blank")
+    elif coverage < LOW_INK_COVERAGE:
+        detected.append("low_ink")
+    return {
+        "file": image_path.name,
+        "sha256": sha256 or file_digest(image_path),
+        "dhash": dhash(gray),
+        "width": round(gray.shape[1] / scale),
+        "height": round(gray.shape[0] / scale),
+        "ink_histogram": histogram,
+        "ink_coverage": round(coverage, 4),
+        "detected": detected,
+        "analyzed_at": datetime.now().isoformat(),
+    }
+
+
+class ImageIndex:
+    """
+    Index JSON des images du corpus.
+
+    `entries` : pages, clé : nom de l'image sans extension ;
+    `files` : fichiers déjà vus, clé : chemin, avec leur taille, leur date et leur empreinte.
+    """
+
+    def __init__(self, path=INDEX_FILE):
+        self.path = Path(path)
+        self.entries = {}
+        self.files = {}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.entries = data.get("images", {})
+            self.files = data.get("files", {})
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        write_json_atomic(self.path, {
+            "version": 2,
+            "images": dict(sorted(self.entries.items())),
+            "files": dict(sorted(self.files.items())),
+        })
+
+    def is_stale(self, image_path):
+        """Vrai si le fichier n'a jamais été vu ou a changé depuis."""
+        known = self.files.get(Path(image_path).as_posix())
+        if known is None or known.get("image") not in self.entries:
+            return True
+        stat = Path(image_path).stat()
+        return known["size"] != stat.st_size or known["mtime"] != stat.st_mtime
+
+    def _record_file(self, image_path, image_name, sha256):
+        stat = Path(image_path).stat()
+        self.files[Path(image_path).as_posix()] = {
+            "image": image_name, "sha256": sha256, "size": stat.st_size, "mtime": stat.st_mtime,
+        }
+
+    def _has_other_copy(self, image_name, image_path, sha256):
+        """Vrai si un autre fichier du même nom porte encore le contenu `sha256`."""
+        return any(
+            known["image"] == image_name and known["sha256"] == sha256 and path != Path(image_path).as_posix()
+            and Path(path).exists()
+            for path, known in self.files.items()
+        )
+
+    def _new_entry(self, image_name, fields):
+        """Remplace l'entrée d'une page en conservant ses champs posés à la main."""
+        previous = self.entries.get(image_name, {})
+        fields.update({field: previous[field] for field in PRESERVED_FIELDS if field in previous})
+        fields.setdefault("tags", [])
+        self.entries[image_name] = fields
+
+    def update(self, images, workers=None):
+        """
+        Indexe les fichiers nouveaux ou modifiés et enregistre l'index.
+
+        Les empreintes SHA-256 sont calculées en parallèle ; seules les pages au contenu
+        inconnu sont analysées (en parallèle, dans des processus), les copies d'une page
+        connue renvoient vers elle.
+
+        Returns:
+            int: Nombre d'images analysées
+        """
+        stale = sorted(Path(img_path) for img_path in images if self.is_stale(img_path))
+        if not stale:
+            return 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            digests = dict(zip(stale, executor.map(file_digest, stale)))
+
+        by_sha256 = {entry["sha256"]: image_name for image_name, entry in self.entries.items()
+                     if entry.get("sha256") and "duplicate_of" not in entry}
+        to_analyze = []
+        for img_path, sha256 in digests.items():
+            image_name = img_path.stem
+            entry = self.entries.get(image_name, {})
+            if entry.get("sha256") not in (None, sha256) and self._has_other_copy(image_name, img_path, entry["sha256"]):
+                print(f"{img_path} : une autre page porte déjà le nom {image_name}, fichier ignoré")
+                continue
+            canonical = by_sha256.get(sha256)
+            if canonical is None:
+                # Contenu inconnu : la page sera analysée
+                by_sha256[sha256] = image_name
+                to_analyze.append((img_path, sha256))
+            elif canonical != image_name:
+                # Copie ou renommage d'une page connue
+                self._new_entry(image_name, {"file": img_path.name, "sha256": sha256, "duplicate_of": canonical})
+                self._record_file(img_path, image_name, sha256)
+            else:
+                self._record_file(img_path, image_name, sha256)
+
+        analyzed = 0
+        if to_analyze:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(analyze_image, img_path, sha256): img_path for img_path, sha256 in to_analyze}
+                for future in concurrent.futures.as_completed(futures):
+                    img_path = futures[future]
+                    try:
+                        analysis = future.result()
+                    except Exception as e:
+                        print(f"Analyse impossible de {img_path.name} : {e}")
+                        continue
+                    self._new_entry(img_path.stem, analysis)
+                    self._record_file(img_path, img_path.stem, analysis["sha256"])
+                    analyzed += 1
+        self.mark_near_duplicates()
+        self.save()
+        return analyzed
+
+    def mark_near_duplicates(self, max_distance=NEAR_DUPLICATE_DISTANCE):
+        """Signale les pages distinctes dont les empreintes perceptuelles sont proches."""
+        names = sorted(image_name for image_name, entry in self.entries.items()
+                       if entry.get("dhash") and "duplicate_of" not in entry)
+        for image_name in self.entries:
+            self.entries[image_name].pop("near_duplicates", None)
+        if len(names) < 2:
+            return
+        near = {}
+        for i, j in close_hash_pairs([self.entries[image_name]["dhash"] for image_name in names], max_distance):
+            near.setdefault(names[i], []).append(names[j])
+            near.setdefault(names[j], []).append(names[i])
+        for image_name, near_names in near.items():
+            self.entries[image_name]["near_duplicates"] = sorted(near_names)
+
+    def canonical(self, image_name):
+        """Nom de la page dont `image_name` est une copie (ou `image_name` lui-même)."""
+        image_name = Path(image_name).stem
+        return self.entries.get(image_name, {}).get("duplicate_of", image_name)
+
+    def sha256(self, image_name):
+        return self.entries.get(Path(image_name).stem, {}).get("sha256")
+
+    def hashes(self):
+        """Empreinte SHA-256 de chaque page connue : {nom: empreinte}."""
+        return {image_name: entry["sha256"] for image_name, entry in self.entries.items() if entry.get("sha256")}
+
+    def distinct(self, images):
+        """
+        Garde un seul fichier par contenu, de préférence celui qui porte le nom de la page.
+
+        Returns:
+            tuple: (fichiers retenus, [(copie écartée, nom de la page)])
+        """
+        images = sorted(images, key=lambda img_path: self.canonical(img_path.stem) != img_path.stem)
+        kept, duplicates, seen = [], [], {}
+        for img_path in images:
+            known = self.files.get(Path(img_path).as_posix()) or {}
+            sha256 = known.get("sha256") or self.sha256(img_path.stem)
+            if sha256 is None:
+                kept.append(img_path)
+            elif sha256 in seen:
+                duplicates.append((img_path, seen[sha256]))
+            else:
+                seen[sha256] = self.canonical(img_path.stem)
+                kept.append(img_path)
+        return sorted(kept), duplicates
+
+    def set_source(self, image_name, source):
+        """Enregistre l'origine d'une page (document PDF, page, résolution...)."""
+        self.entries.setdefault(Path(image_name).stem, {})["source"] = source
+
+    def tags(self, image_name):
+        """Étiquettes d'une image (détectées et posées à la main, y compris sur la page copiée)."""
+        image_name = Path(image_name).stem
+        tags = set()
+        for name in {image_name, self.canonical(image_name)}:
+            entry = self.entries.get(name, {})
+            tags |= set(entry.get("detected", [])) | set(entry.get("tags", []))
+        return tags
+
+    def add_tag(self, image_name, tag):
+        entry = self.entries.setdefault(Path(image_name).stem, {})
+        entry["tags"] = sorted(set(entry.get("tags", [])) | {tag})
+
+    def remove_tag(self, image_name, tag):
+        entry = self.entries.get(Path(image_name).stem, {})
+        entry["tags"] = [existing for existing in entry.get("tags", []) if existing != tag]
+        entry["detected"] = [existing for existing in entry.get("detected", []) if existing != tag]
+
+    def with_tag(self, tag):
+        """Noms des images portant une étiquette."""
+        return {image_name for image_name in self.entries if tag in self.tags(image_name)}
+
+    def is_blank(self, image_name):
+        return "blank" in self.tags(image_name)
+
+    def excluded_from_wer(self):
+        """Noms des images exclues du calcul du WER (pages blanches)."""
+        return set().union(*(self.with_tag(tag) for tag in WER_EXCLUDED_TAGS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index des images du corpus et détection des pages blanches.")
+    parser.add_argument("--index", type=Path, default=INDEX_FILE, help="Fichier de l'index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    update = subparsers.add_parser("update", help="Indexer les images nouvelles ou modifiées")
+    update.add_argument("--images-dir", type=Path, default=IMAGES_DIR, help="Dossier des images")
+    update.add_argument("--workers", type=int, help="Processus d'analyse (défaut : nombre de cœurs)")
+    for command in ("tag", "untag"):
+        tag = subparsers.add_parser(command, help=f"{'Poser' if command == 'tag' else 'Retirer'} une étiquette")
+        tag.add_argument("image", help="Nom de l'image (avec ou sans extension)")
+        tag.add_argument("tag", help="Étiquette (blank, low_ink...)")
+    listing = subparsers.add_parser("list", help="Lister les images et leurs étiquettes")
+    listing.add_argument("--tag", help="N'afficher que les images portant cette étiquette")
+    subparsers.add_parser("duplicates", help="Lister les copies et les quasi-doublons")
+    args = parser.parse_args()
+
+    index = ImageIndex(args.index)
+    if args.command == "update":
+        images = list_images(args.images_dir)
+        print(f"{index.update(images, args.workers)} image(s) analysée(s) sur {len(images)}")
+    elif args.command == "duplicates":
+        for image_name, entry in sorted(index.entries.items()):
+            if "duplicate_of" in entry:
+                print(f"{image_name} : copie de {entry['duplicate_of']}")
+            if entry.get("near_duplicates"):
+                print(f"{image_name} : proche de {', '.join(entry['near_duplicates'])}")
+    elif args.command in ("tag", "untag"):
+        (index.add_tag if args.command == "tag" else index.remove_tag)(args.image, args.tag)
+        index.save()
+    else:
+        for image_name in sorted(index.with_tag(args.tag) if args.tag else index.entries):
+            coverage = index.entries[image_name].get("ink_coverage")
+            coverage = f"{coverage:.1%}" if coverage is not None else "-"
+            print(f"{image_name} | encre : {coverage} | {', '.join(sorted(index.tags(image_name))) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Pyramides de tuiles (format DeepZoom) des scans du corpus, pour le zoom du viewer.
+
+Les scans pèsent plusieurs mégaoctets : le viewer les affichait en entier avant de rendre
+quoi que ce soit. Chaque image est découpée en tuiles de `TILE_SIZE` pixels à tous les
+niveaux de résolution (chaque niveau divise la taille par deux, jusqu'à 1 pixel). Le viewer
+(OpenSeadragon) affiche d'abord les niveaux les plus petits, puis ne demande que les tuiles
+visibles au niveau de zoom courant.
+
+Les pyramides sont adressées par contenu : `pyramids/<empreinte>_<taille>_<format>.dzi`
+et ses tuiles `pyramids/<empreinte>_<taille>_<format>_files/<niveau>/<colonne>_<ligne>.<format>`.
+Une image inchangée n'est jamais redécoupée, une copie réutilise la pyramide de l'original.
+`pyramids/manifest.json` associe chaque image à sa pyramide (descripteur relatif au dossier
+des pyramides, servi sous `/pyramids/`).
+
+  python image_pyramid.py build                 # toutes les images, en parallèle
+  python image_pyramid.py build --format jpeg
+"""
+
+import argparse
+import concurrent.futures
+import math
+import os
+import shutil
+from pathlib import Path
+
+from PIL import Image, features
+
+from image_index import IMAGES_DIR, group_by_content, list_images
+from task_ledger import write_json_atomic
+
+PYRAMIDS_DIR = Path("pyramids")
+MANIFEST_FILE = PYRAMIDS_DIR / "manifest.json"
+
+# Côté des tuiles et recouvrement entre tuiles voisines (en pixels)
+TILE_SIZE = 256
+TILE_OVERLAP = 1
+
+# Qualité d'encodage des tuiles
+TILE_QUALITY = {"webp": 80, "jpeg": 85}
+
+# Format par défaut : WebP si Pillow sait l'écrire, JPEG sinon
+DEFAULT_FORMAT = "webp" if features.check("webp") else "jpeg"
+
+DZI_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="{tile_size}" Overlap="{overlap}" Format="{format}">
+  <Size Width="{width}" Height="{height}"/>
+</Image>
+"""
+
+
+def pyramid_key(sha256, tile_size=TILE_SIZE, fmt=DEFAULT_FORMAT):
+    """Nom de la pyramide d'une image : empreinte du contenu et paramètres de découpage."""
+    return f"{sha256[:16]}_{tile_size}_{fmt}"
+
+
+def max_level(width, height):
+    """Niveau de pleine résolution (le niveau 0 fait 1 pixel de côté)."""
+    return math.ceil(math.log2(max(width, height, 1)))
+
+
+def tile_boxes(width, height, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """
+    Tuiles d'un niveau, avec leur recouvrement.
+
+    Returns:
+        list: (colonne, ligne, (gauche, haut, droite, bas))
+    """
+    boxes = []
+    for row in range(math.ceil(height / tile_size)):
+        for col in range(math.ceil(width / tile_size)):
+            left = col * tile_size - (overlap if col else 0)
+            top = row * tile_size - (overlap if row else 0)
+            right = min((col + 1) * tile_size + overlap, width)
+            bottom = min((row + 1) * tile_size + overlap, height)
+            boxes.append((col, row, (left, top, right, bottom)))
+    return boxes
+
+
+def save_tile(tile, path, fmt):
+    if fmt == "webp":
+        tile.save(path, "WEBP", quality=TILE_QUALITY["webp"], method=4)
+    else:
+        tile.save(path, "JPEG", quality=TILE_QUALITY["jpeg"])
+
+
+def build_pyramid(image_path, sha256, output_dir=PYRAMIDS_DIR, tile_size=TILE_SIZE, overlap=TILE_OVERLAP,
+                  fmt=DEFAULT_FORMAT):
+    """
+    Découpe une image en pyramide de tuiles, sauf si elle existe déjà.
+
+    Les tuiles sont écrites dans un dossier temporaire renommé une fois complet ; le
+    descripteur `.dzi`, écrit en dernier, marque la pyramide comme terminée.
+
+    Returns:
+        dict: Entrée du manifeste (descripteur, largeur, hauteur, niveaux)
+    """
+    key = pyramid_key(sha256, tile_size, fmt)
+    dzi_path = output_dir / f"{key}.dzi"
+    tiles_dir = output_dir / f"{key}_files"
+
+    with Image.open(image_path) as img:
+        width, height = img.size
+        # Chemin relatif au dossier des pyramides : le viewer le résout depuis l'URL du manifeste
+        entry = {"dzi": dzi_path.name, "width": width, "height": height,
+                 "tile_size": tile_size, "format": fmt, "levels": max_level(width, height) + 1}
+        if dzi_path.exists():
+            return entry
+
+        level_image = img.convert("L" if img.mode in ("1", "L") and fmt == "jpeg" else "RGB")
+
+    tmp_dir = output_dir / f"{key}_files.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    # Du niveau de pleine résolution au niveau 0 : chaque niveau est la moitié du précédent
+    for level in range(max_level(width, height), -1, -1):
+        level_dir = tmp_dir / str(level)
+        level_dir.mkdir(parents=True)
+        level_width, level_height = level_image.size
+        for col, row, box in tile_boxes(level_width, level_height, tile_size, overlap):
+            save_tile(level_image.crop(box), level_dir / f"{col}_{row}.{fmt}", fmt)
+        if level:
+            level_image = level_image.resize((math.ceil(level_width / 2), math.ceil(level_height / 2)),
+                                             Image.Resampling.BOX)
+
+    shutil.rmtree(tiles_dir, ignore_errors=True)
+    os.replace(tmp_dir, tiles_dir)
+    dzi_path.write_text(DZI_TEMPLATE.format(tile_size=tile_size, overlap=overlap, format=fmt,
+                                            width=width, height=height), encoding="utf-8")
+    return entry
+
+
+def build_pyramids(images, output_dir=PYRAMIDS_DIR, tile_size=TILE_SIZE, fmt=DEFAULT_FORMAT, workers=None):
+    """
+    Construit en parallèle (processus) les pyramides manquantes et réécrit le manifeste.
+    Les images de même contenu partagent une seule pyramide.
+
+    Returns:
+        dict: Manifeste {nom de l'image: entrée}
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    by_sha256 = group_by_content(images, workers)
+
+    manifest = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(build_pyramid, paths[0], sha256, output_dir, tile_size, TILE_OVERLAP, fmt): paths
+                   for sha256, paths in by_sha256.items()}
+        for future in concurrent.futures.as_completed(futures):
+            paths = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                print(f"{paths[0].name} : pyramide impossible ({e})")
+                continue
+            for image_path in paths:
+                manifest[image_path.stem] = entry
+            print(f"{paths[0].stem} : {entry['width']}x{entry['height']}, {entry['levels']} niveaux")
+
+    write_json_atomic(output_dir / MANIFEST_FILE.name, dict(sorted(manifest.items())))
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pyramides de tuiles (DeepZoom) des images pour le viewer.")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--images-dir", type=Path, default=IMAGES_DIR, help="Dossier des images")
+    parser.add_argument("--output-dir", type=Path, default=PYRAMIDS_DIR, help="Dossier des pyramides")
+    parser.add_argument("--format", choices=["webp", "jpeg"], default=DEFAULT_FORMAT,
+                        help="Format des tuiles (défaut : %(default)s)")
+    parser.add_argument("--tile-size", type=int, default=TILE_SIZE, help="Côté des tuiles en pixels")
+    parser.add_argument("--workers", type=int, help="Processus de découpage (défaut : nombre de cœurs)")
+    args = parser.parse_args()
+
+    manifest = build_pyramids(list_images(args.images_dir), args.output_dir, args.tile_size, args.format, args.workers)
+    print(f"{len(manifest)} pyramide(s) dans {args.output_dir}/")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""Moteur Kraken en processus : chargement unique des modèles et reconnaissance par lots."""
+
+import dataclasses
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from PIL import Image
+
+from image_index import file_digest
+from tracing import span
+
+# Dossier des modèles de reconnaissance Kraken (.pt, .mlmodel)
+KRAKEN_MODELS_DIR = Path("./kraken_models")
+
+# Nombre de lignes reconnues ensemble lorsque le modèle le permet
+DEFAULT_BATCH_SIZE = 16
+
+# Marge horizontale (en pixels) ajoutée par Kraken autour de chaque ligne
+LINE_PADDING = 16
+
+# Dossier du cache persistant des segmentations (une par image et par modèle de segmentation)
+SEGMENTATION_CACHE_DIR = Path("./cache/segmentation")
+
+# Cache des modèles chargés, propre à chaque processus
+_RECOGNITION_MODELS = {}
+_SEGMENTATION_MODEL = None
+_SEGMENTATION_MODEL_ID = None
+_MODELS_LOCK = threading.Lock()
+
+# Empreintes des images déjà calculées par ce processus, par (chemin, date de modification, taille)
+_IMAGE_DIGESTS = {}
+_DIGESTS_LOCK = threading.Lock()
+
+
+def load_recognition_model(model_path):
+    """
+    Charge un modèle de reconnaissance Kraken (.mlmodel ou .pt) une seule fois par processus.
+
+    Args:
+        model_path: Chemin vers le fichier du modèle
+
+    Returns:
+        TorchSeqRecognizer: Le modèle prêt pour la reconnaissance
+    """
+    key = str(Path(model_path).resolve())
+    with _MODELS_LOCK:
+        if key not in _RECOGNITION_MODELS:
+            from kraken.lib import models
+            _RECOGNITION_MODELS[key] = models.load_any(key)
+        return _RECOGNITION_MODELS[key]
+
+
+def init_worker(torch_threads):
+    """
+    Fixe le nombre de threads torch d'un processus de reconnaissance.
+
+    Les variables d'environnement sont aussi héritées par les sous-processus `kraken`
+    lancés par la CLI.
+    """
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(torch_threads)
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+        torch.set_num_interop_threads(1)
+    except (ImportError, RuntimeError):
+        pass
+
+
+def image_digest(img_path):
+    """
+    Empreinte d'une image, calculée une seule fois par processus tant que le fichier
+    n'est pas modifié : chaque image est lue par tous les modèles de reconnaissance.
+    """
+    path = Path(img_path).resolve()
+    stat = path.stat()
+    key = (str(path), stat.st_mtime_ns, stat.st_size)
+    with _DIGESTS_LOCK:
+        digest = _IMAGE_DIGESTS.get(key)
+    if digest is None:
+        digest = file_digest(path)
+        with _DIGESTS_LOCK:
+            _IMAGE_DIGESTS[key] = digest
+    return digest
+
+
+def load_segmentation_model():
+    """
+    Charge le modèle de segmentation par lignes de base par défaut de Kraken
+    (celui qu'utilise `kraken segment -bl`) une seule fois par processus.
+    """
+    global _SEGMENTATION_MODEL, _SEGMENTATION_MODEL_ID
+    with _MODELS_LOCK:
+        if _SEGMENTATION_MODEL is None:
+            from kraken.kraken import SEGMENTATION_DEFAULT_MODEL
+            from kraken.lib.vgsl import TorchVGSLModel
+            _SEGMENTATION_MODEL = TorchVGSLModel.load_model(str(SEGMENTATION_DEFAULT_MODEL))
+            _SEGMENTATION_MODEL_ID = file_digest(SEGMENTATION_DEFAULT_MODEL)[:16]
+        return _SEGMENTATION_MODEL
+
+
+def segment_page(im):
+    """
+    Segmente une page en lignes de base avec le modèle de segmentation en mémoire.
+
+    Args:
+        im: Image PIL de la page
+
+    Returns:
+        La segmentation Kraken (lignes de base, polygones, ordre de lecture)
+    """
+    from kraken import blla
+    return blla.segment(im, model=load_segmentation_model())
+
+
+def _segmentation_to_dict(segmentation):
+    """Convertit une segmentation Kraken (dict pour Kraken 4, dataclass pour Kraken 5) en dict JSON."""
+    if dataclasses.is_dataclass(segmentation):
+        return {"format": "dataclass", "data": dataclasses.asdict(segmentation)}
+    return {"format": "dict", "data": segmentation}
+
+
+def _segmentation_from_dict(payload):
+    """Reconstruit la segmentation Kraken sérialisée par `_segmentation_to_dict`."""
+    data = payload["data"]
+    if payload["format"] != "dataclass":
+        return data
+    from kraken.containers import BaselineLine, Region, Segmentation
+    data = dict(data)
+    data["lines"] = [BaselineLine(**line) for line in data.get("lines", [])]
+    data["regions"] = {
+        region_type: [Region(**region) for region in regions]
+        for region_type, regions in (data.get("regions") or {}).items()
+    }
+    return Segmentation(**data)
+
+
+def _json_default(obj):
+    # Tableaux et scalaires NumPy, chemins
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    return str(obj)
+
+
+def segmentation_cache_path(img_path):
+    """Chemin du fichier de cache pour la segmentation d'une image avec le modèle courant."""
+    load_segmentation_model()
+    return SEGMENTATION_CACHE_DIR / f"{image_digest(img_path)}_{_SEGMENTATION_MODEL_ID}.json"
+
+
+def get_segmentation(img_path, im=None):
+    """
+    Renvoie la segmentation d'une image, calculée une seule fois puis réutilisée
+    par tous les modèles de reconnaissance.
+
+    Les segmentations sont persistées dans `SEGMENTATION_CACHE_DIR`, indexées par
+    l'empreinte du contenu de l'image et par celle du modèle de segmentation.
+
+    Args:
+        img_path: Chemin vers l'image
+        im: Image PIL déjà ouverte (optionnel)
+
+    Returns:
+        La segmentation Kraken (lignes de base, polygones, ordre de lecture)
+    """
+    cache_file = segmentation_cache_path(img_path)
+    if cache_file.exists():
+        with open(cache_file, "r", encoding="utf-8") as f:
+            return _segmentation_from_dict(json.load(f))
+
+    if im is None:
+        with Image.open(img_path) as page:
+            page.load()
+            segmentation = segment_page(page)
+    else:
+        segmentation = segment_page(im)
+
+    # Écriture atomique : un autre worker peut lire le cache au même moment
+    SEGMENTATION_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(_segmentation_to_dict(segmentation), f, default=_json_default)
+    os.replace(tmp_file, cache_file)
+    return segmentation
+
+
+def supports_batching(network):
+    """
+    Indique si un modèle peut reconnaître plusieurs lignes en un seul passage.
+
+    Les lignes d'un lot doivent partager la même hauteur : seuls les modèles
+    à hauteur d'entrée fixe exposant `predict_string` sont donc éligibles.
+    """
+    _, _, height, _ = network.nn.input
+    return height > 0 and hasattr(network, "predict_string")
+
+
+def _recognize_batched(network, im, segmentation, batch_size):
+    """Reconnaît les lignes par lots de taille `batch_size`, dans l'ordre de lecture."""
+    import torch
+    from kraken.lib.dataset import ImageInputTransforms
+    from kraken.lib.segmentation import extract_polygons
+
+    batch, channels, height, width = network.nn.input
+    transforms = ImageInputTransforms(batch, height, width, channels, (LINE_PADDING, 0), valid_norm=False)
+
+    line_tensors = []
+    for line_im, _ in extract_polygons(im, segmentation):
+        try:
+            line_tensors.append(transforms(line_im))
+        except Exception:
+            # Ligne dégénérée (polygone vide, largeur nulle...) : transcription vide
+            line_tensors.append(None)
+
+    predictions = [""] * len(line_tensors)
+    # Trier par largeur limite le remplissage inutile à l'intérieur d'un lot
+    order = sorted(
+        (i for i, t in enumerate(line_tensors) if t is not None),
+        key=lambda i: line_tensors[i].shape[2]
+    )
+    for start in range(0, len(order), batch_size):
+        indices = order[start:start + batch_size]
+        max_width = max(line_tensors[i].shape[2] for i in indices)
+        lines = torch.zeros(len(indices), channels, height, max_width)
+        for row, i in enumerate(indices):
+            lines[row, :, :, :line_tensors[i].shape[2]] = line_tensors[i]
+        lens = torch.tensor([line_tensors[i].shape[2] for i in indices])
+        for i, text in zip(indices, network.predict_string(lines, lens)):
+            predictions[i] = text
+    return predictions
+
+
+def recognize_page(network, im, segmentation, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Transcrit une page déjà segmentée.
+
+    Args:
+        network: Modèle de reconnaissance (voir `load_recognition_model`)
+        im: Image PIL de la page
+        segmentation: Segmentation Kraken de la page
+        batch_size: Nombre de lignes par lot (1 pour désactiver les lots)
+
+    Returns:
+        str: Transcription de la page, une ligne de texte par ligne détectée
+    """
+    if batch_size > 1 and supports_batching(network):
+        predictions = _recognize_batched(network, im, segmentation, batch_size)
+    else:
+        from kraken import rpred
+        predictions = [record.prediction for record in rpred.rpred(network=network, im=im, bounds=segmentation)]
+    return "\n".join(predictions).strip()
+
+
+def transcribe_image(img_path, kraken_model, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Transcrit une image avec un modèle Kraken sans passer par la CLI.
+
+    Les modèles sont chargés avant le démarrage du chronomètre : la latence
+    mesurée ne couvre que la segmentation (ou sa lecture depuis le cache) et
+    la reconnaissance de la page.
+
+    Args:
+        img_path (Path): Chemin vers l'image
+        kraken_model (Path): Chemin vers le modèle de reconnaissance
+        batch_size: Nombre de lignes reconnues par lot
+
+    Returns:
+        tuple: (transcription, latency)
+    """
+    with span("model.load"):
+        network = load_recognition_model(kraken_model)
+        load_segmentation_model()
+
+    with Image.open(img_path) as im:
+        with span("image.decode"):
+            im.load()
+        start_time = time.perf_counter()
+        with span("segmentation"):
+            segmentation = get_segmentation(img_path, im)
+        with span("recognition", batch_size=batch_size) as recognition_span:
+            transcription = recognize_page(network, im, segmentation, batch_size)
+            recognition_span.set(lines=len(transcription.splitlines()) if transcription else 0)
+        latency = time.perf_counter() - start_time
+    return transcription, latency
+
+
+def build_result_data(img_path, kraken_model, transcription, latency):
+    """Résultat d'une transcription Kraken, au format des fichiers de `résultats/`."""
+    safe_model_name = kraken_model.stem.replace(" ", "_")
+    return {
+        "model": safe_model_name,
+        "editeur": "kraken",
+        "modele_type": "libre",
+        "image": str(img_path),
+        "result": transcription,
+        "timestamp": datetime.now().isoformat(),
+        "model_info": {"path": str(kraken_model)},
+        "usage": {},
+        "latency": latency
+    }
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Démon local de reconnaissance Kraken.
+
+Garde un ensemble de modèles Kraken chauds en mémoire et expose une petite API HTTP :
+
+  POST /transcribe?model=<nom>&image=<nom_image>   corps : octets de l'image
+       -> JSON au format des fichiers de `résultats/`
+  GET  /models                                     -> liste des modèles chargés
+  GET  /health                                     -> état du démon et de la file d'attente
+
+Exemple :
+  python kraken_server.py --models kraken_models/McCATMuS_nfd_nofix_V1.mlmodel --workers 2
+  curl --data-binary @page.png "http://127.0.0.1:8765/transcribe?model=McCATMuS_nfd_nofix_V1"
+
+Les modèles sont ensuite accessibles depuis `query_model` avec le préfixe `kraken/`
+(par exemple `kraken/McCATMuS_nfd_nofix_V1`).
+"""
+
+import argparse
+import json
+import queue
+import tempfile
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+from kraken_engine import (
+    DEFAULT_BATCH_SIZE,
+    KRAKEN_MODELS_DIR,
+    build_result_data,
+    init_worker,
+    load_recognition_model,
+    load_segmentation_model,
+    transcribe_image,
+)
+
+# Adresse par défaut du démon (reprise par `api_clients.query_kraken`)
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Délai maximal d'attente d'une transcription (en secondes)
+REQUEST_TIMEOUT = 600
+
+
+class KrakenDaemon:
+    """
+    File d'attente de requêtes et pool de workers partageant les modèles en mémoire.
+    """
+
+    def __init__(self, model_paths, workers=2, queue_size=64, batch_size=DEFAULT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.models = {}
+        for model_path in model_paths:
+            model_path = Path(model_path)
+            name = model_path.stem.replace(" ", "_")
+            print(f"Chargement du modèle {name}...")
+            load_recognition_model(model_path)
+            self.models[name] = model_path
+        load_segmentation_model()
+
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.workers = [
+            threading.Thread(target=self._worker, name=f"kraken-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def _worker(self):
+        while True:
+            future, image_bytes, suffix, model_name, image_name = self.jobs.get()
+            try:
+                if future.set_running_or_notify_cancel():
+                    future.set_result(self._transcribe(image_bytes, suffix, model_name, image_name))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self.jobs.task_done()
+
+    def _transcribe(self, image_bytes, suffix, model_name, image_name):
+        kraken_model = self.models[model_name]
+        # Le cache de segmentation est indexé par le contenu : une même page
+        # envoyée plusieurs fois n'est segmentée qu'une fois.
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            img_path = Path(tmp_dir) / f"page{suffix}"
+            img_path.write_bytes(image_bytes)
+            transcription, latency = transcribe_image(img_path, kraken_model, self.batch_size)
+        return build_result_data(Path(image_name), kraken_model, transcription, latency)
+
+    def submit(self, image_bytes, suffix, model_name, image_name):
+        """
+        Ajoute une page à la file d'attente.
+
+        Raises:
+            KeyError: si le modèle n'est pas chargé
+            queue.Full: si la file d'attente est pleine
+        """
+        if model_name not in self.models:
+            raise KeyError(model_name)
+        future = Future()
+        self.jobs.put_nowait((future, image_bytes, suffix, model_name, image_name))
+        return future
+
+
+def make_handler(daemon):
+    """Construit le handler HTTP lié à une instance de `KrakenDaemon`."""
+
+    class KrakenRequestHandler(BaseHTTPRequestHandler):
+        """Handler de l'API du démon Kraken"""
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/models":
+                self._send_json(200, sorted(daemon.models))
+            elif path == "/health":
+                self._send_json(200, {
+                    "status": "ok",
+                    "models": len(daemon.models),
+                    "workers": len(daemon.workers),
+                    "queued": daemon.jobs.qsize()
+                })
+            else:
+                self._send_json(404, {"error": f"Route inconnue: {path}"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != "/transcribe":
+                self._send_json(404, {"error": f"Route inconnue: {url.path}"})
+                return
+
+            params = parse_qs(url.query)
+            model_name = params.get("model", [""])[0]
+            image_name = params.get("image", ["page.png"])[0]
+            suffix = Path(image_name).suffix or ".png"
+
+            length = int(self.headers.get("Content-Length", 0))
+            if length <= 0:
+                self._send_json(400, {"error": "Corps de requête vide : envoyez les octets de l'image"})
+                return
+            image_bytes = self.rfile.read(length)
+
+            try:
+                future = daemon.submit(image_bytes, suffix, model_name, image_name)
+            except KeyError:
+                self._send_json(404, {"error": f"Modèle non chargé: {model_name}", "models": sorted(daemon.models)})
+                return
+            except queue.Full:
+                self._send_json(503, {"error": "File d'attente pleine, réessayez plus tard"})
+                return
+
+            try:
+                self._send_json(200, future.result(timeout=REQUEST_TIMEOUT))
+            except FutureTimeoutError:
+                # Une page encore en file est retirée ; une page déjà en cours de reconnaissance se termine
+                cancelled = future.cancel()
+                self._send_json(504, {"error": f"Transcription non terminée après {REQUEST_TIMEOUT} s"
+                                               + ("" if cancelled else " (toujours en cours)")})
+            except Exception as e:
+                self._send_json(500, {"error": f"Erreur lors de la transcription: {str(e)}"})
+
+    return KrakenRequestHandler
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Démon local de reconnaissance Kraken (API HTTP).")
+    parser.add_argument("--models", nargs="*", type=Path,
+                        help="Modèles à garder en mémoire (défaut : tous ceux du dossier 'kraken_models')")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Adresse d'écoute")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port d'écoute")
+    parser.add_argument("--workers", type=int, default=2, help="Nombre de workers de reconnaissance")
+    parser.add_argument("--torch-threads", type=int, default=1, help="Threads torch par opération")
+    parser.add_argument("--queue-size", type=int, default=64, help="Taille maximale de la file d'attente")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Nombre de lignes reconnues par lot")
+    return parser.parse_args()
+
+
+def run_server():
+    """Démarrer le démon Kraken"""
+    args = parse_args()
+
+    model_paths = args.models or (list(KRAKEN_MODELS_DIR.glob("*.pt")) + list(KRAKEN_MODELS_DIR.glob("*.mlmodel")))
+    if not model_paths:
+        print("Aucun modèle Kraken trouvé dans le dossier 'kraken_models'.")
+        return
+
+    init_worker(args.torch_threads)
+    daemon = KrakenDaemon(model_paths, workers=args.workers, queue_size=args.queue_size, batch_size=args.batch_size)
+    httpd = ThreadingHTTPServer((args.host, args.port), make_handler(daemon))
+
+    print(f"Démon Kraken démarré sur http://{args.host}:{args.port} avec {len(daemon.models)} modèle(s)")
+
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        # Arrêter le serveur proprement avec Ctrl+C
+        print("\nDémon arrêté.")
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    run_server()
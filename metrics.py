@@ -2,6 +2,8 @@
 
 import re
 
+import numpy as np
+
 
 def clean_text_for_wer(text):
     """
@@ -66,6 +68,30 @@ def clean_text_for_wer(text):
     return text
 
 
+def edit_distance_sequences(reference, hypothesis):
+    """
+    Levenshtein distance between two sequences of integers.
+
+    The matrix is filled one row at a time with NumPy: substitutions and deletions come
+    from the previous row, and insertions (a running minimum along the row) are resolved
+    with `np.minimum.accumulate`, so each row costs a few vector operations.
+    """
+    hypothesis = np.asarray(hypothesis, dtype=np.int64)
+    if len(reference) == 0:
+        return len(hypothesis)
+    positions = np.arange(len(hypothesis) + 1)
+    previous = positions.copy()
+    for i, token in enumerate(reference, 1):
+        current = np.empty_like(previous)
+        current[0] = i
+        # Substitution (or match) and deletion
+        current[1:] = np.minimum(previous[:-1] + (hypothesis != token), previous[1:] + 1)
+        # Insertion: current[j] = min over k <= j of current[k] + (j - k)
+        current = np.minimum.accumulate(current - positions) + positions
+        previous = current
+    return int(previous[-1])
+
+
 def calculate_wer(reference: str, hypothesis: str) -> float:
     """
     Calculate Word Error Rate (WER) between reference and hypothesis texts.
@@ -89,26 +115,31 @@ def calculate_wer(reference: str, hypothesis: str) -> float:
     if len(ref_words) == 0:
         return 1.0 if len(hyp_words) > 0 else 0.0
     
-    # Create a matrix to store the edit distances
-    d = [[0] * (len(hyp_words) + 1) for _ in range(len(ref_words) + 1)]
-    
-    # Initialize matrix edges
-    for i in range(len(ref_words) + 1):
-        d[i][0] = i
-    for j in range(len(hyp_words) + 1):
-        d[0][j] = j
-    
-    # Fill the matrix using Levenshtein distance algorithm
-    for i in range(1, len(ref_words) + 1):
-        for j in range(1, len(hyp_words) + 1):
-            if ref_words[i-1] == hyp_words[j-1]:
-                d[i][j] = d[i-1][j-1]
-            else:
-                substitution = d[i-1][j-1] + 1
-                insertion = d[i][j-1] + 1
-                deletion = d[i-1][j] + 1
-                d[i][j] = min(substitution, insertion, deletion)
-    
-    # The bottom-right cell contains the edit distance
-    edit_distance = d[len(ref_words)][len(hyp_words)]
-    return edit_distance / len(ref_words)
\ No newline at end of file
+    # Levenshtein distance over word identifiers
+    vocabulary = {}
+    ref_ids = [vocabulary.setdefault(word, len(vocabulary)) for word in ref_words]
+    hyp_ids = [vocabulary.setdefault(word, len(vocabulary)) for word in hyp_words]
+    edit_distance = edit_distance_sequences(ref_ids, hyp_ids)
+    return edit_distance / len(ref_words)
+
+
+def calculate_cer(reference: str, hypothesis: str) -> float:
+    """
+    Calculate Character Error Rate (CER) between reference and hypothesis texts.
+    
+    Args:
+        reference: The reference text (ground truth)
+        hypothesis: The hypothesis text (prediction)
+        
+    Returns:
+        float: CER score (0.0 = perfect match, 1.0 = all characters wrong)
+    """
+    # Nettoyer les textes avant le calcul
+    reference = clean_text_for_wer(reference)
+    hypothesis = clean_text_for_wer(hypothesis)
+    
+    if len(reference) == 0:
+        return 1.0 if len(hypothesis) > 0 else 0.0
+    
+    edit_distance = edit_distance_sequences([ord(c) for c in reference], [ord(c) for c in hypothesis])
+    return edit_distance / len(reference)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Ingestion des documents PDF du corpus (fascicules AN-284AP) dans `images/`.
+
+Les pages sont rastérisées une par une (pdftoppm via pdf2image, qui écrit directement
+sur le disque, sans charger le document en mémoire), en parallèle, à la résolution la plus
+basse qui suffit au modèle le plus exigeant : la résolution de chaque page est calculée
+pour que son plus grand côté atteigne la plus petite dimension maximale des modèles de
+`models_to_test.json` (`api_clients.get_image_limits`), sans dépasser `MAX_DPI`. Rien ne sert
+d'écrire des pages plus grandes : elles seraient réduites avant l'envoi.
+
+Les pages rastérisées sont mises en cache (`cache/pdf_pages/`) sous la clé (empreinte du
+PDF, page, résolution), puis liées dans `images/` sous le nom `<document>_page_<n>.png`
+et enregistrées dans l'index des images (`image_index.py`) avec leur origine.
+
+  python pdf_ingest.py "sources/AN-284AP-4-doss 11.pdf" --pages 30-40
+
+pdf2image s'appuie sur les outils poppler (`pdftoppm`, `pdfinfo`), à installer sur le système.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import re
+import shutil
+from pathlib import Path
+
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+from image_index import ImageIndex, file_digest
+
+CACHE_DIR = Path("./cache/pdf_pages")
+IMAGES_DIR = Path("images")
+MODELS_FILE = Path("models_to_test.json")
+
+# Résolution utilisée si aucun modèle n'impose de dimension maximale
+DEFAULT_DPI = 300
+
+# Bornes de la résolution de rastérisation (au-delà de MAX_DPI, le grain du scan d'origine domine)
+MIN_DPI = 100
+MAX_DPI = 400
+
+# Taille de page par défaut (points PostScript) si pdfinfo ne la donne pas : A4
+DEFAULT_PAGE_SIZE = (595.0, 842.0)
+
+PAGE_SIZE = re.compile(r"([\d.]+) x ([\d.]+) pts")
+
+
+def strictest_dimension(models_file=MODELS_FILE):
+    """Plus petite dimension maximale (en pixels) imposée par les modèles à tester, ou None."""
+    # Import local : les clients des API (requests, dotenv, tarifs) ne servent qu'ici
+    from api_clients import get_image_limits
+    with open(models_file, "r") as f:
+        models = [model for model, _ in json.load(f)]
+    dimensions = [get_image_limits(model)[1] for model in models]
+    dimensions = [dimension for dimension in dimensions if dimension]
+    return min(dimensions) if dimensions else None
+
+
+def page_sizes(pdf_path, first_page, last_page):
+    """
+    Taille (en points) de chaque page d'un intervalle, d'après pdfinfo.
+
+    Returns:
+        dict: {numéro de page: (largeur, hauteur)}
+    """
+    info = pdfinfo_from_path(str(pdf_path), first_page=first_page, last_page=last_page)
+    sizes = {}
+    for key, value in info.items():
+        match = re.fullmatch(r"Page\s+(\d+) size", key)
+        size = PAGE_SIZE.search(str(value))
+        if match and size:
+            sizes[int(match.group(1))] = (float(size.group(1)), float(size.group(2)))
+    return sizes
+
+
+def page_dpi(page_size, max_dimension):
+    """Résolution qui amène le plus grand côté de la page à `max_dimension` pixels."""
+    if not max_dimension:
+        return DEFAULT_DPI
+    dpi = int(max_dimension * 72 / max(page_size))
+    return max(MIN_DPI, min(MAX_DPI, dpi))
+
+
+def parse_pages(spec, page_count):
+    """Pages demandées (« 1-10,15 »), toutes si `spec` est vide."""
+    if not spec:
+        return list(range(1, page_count + 1))
+    pages = set()
+    for part in spec.split(","):
+        start, _, end = part.partition("-")
+        pages.update(range(int(start), int(end or start) + 1))
+    return sorted(page for page in pages if 1 <= page <= page_count)
+
+
+def rasterize_page(pdf_path, pdf_digest, page, dpi, cache_dir=CACHE_DIR):
+    """
+    Rastérise une page dans le cache si elle n'y est pas déjà.
+
+    Returns:
+        Path: Chemin de la page dans le cache
+    """
+    cached = cache_dir / f"{pdf_digest[:16]}_p{page:04d}_{dpi}dpi.png"
+    if cached.exists():
+        return cached
+    # pdftoppm écrit un fichier temporaire, renommé une fois complet
+    tmp_name = f"{cached.stem}.{os.getpid()}.tmp"
+    convert_from_path(str(pdf_path), dpi=dpi, first_page=page, last_page=page, fmt="png",
+                      output_folder=str(cache_dir), output_file=tmp_name, single_file=True, paths_only=True)
+    os.replace(cache_dir / f"{tmp_name}.png", cached)
+    return cached
+
+
+def link_page(cached, target):
+    """Place une page du cache dans `images/` (lien physique, copie à défaut)."""
+    if target.exists():
+        target.unlink()
+    try:
+        os.link(cached, target)
+    except OSError:
+        shutil.copy2(cached, target)
+
+
+def ingest_pdf(pdf_path, pages=None, max_dimension=None, workers=None, images_dir=IMAGES_DIR, index=None,
+               overwrite=False):
+    """
+    Rastérise les pages d'un PDF en parallèle et les enregistre dans `images/` et l'index.
+
+    Args:
+        pdf_path: Document PDF
+        pages: Pages à ingérer (« 1-10,15 »), toutes par défaut
+        max_dimension: Plus grand côté visé (pixels), None pour `DEFAULT_DPI`
+        workers: Pages rastérisées simultanément (défaut : nombre de cœurs)
+        overwrite: Remplacer les images déjà présentes dans `images/`
+
+    Returns:
+        list: Chemins des images ajoutées dans `images/`
+    """
+    pdf_path = Path(pdf_path)
+    index = index if index is not None else ImageIndex()
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    images_dir.mkdir(exist_ok=True)
+
+    pdf_digest = file_digest(pdf_path)
+    page_count = int(pdfinfo_from_path(str(pdf_path))["Pages"])
+    selected = parse_pages(pages, page_count)
+    targets = {page: images_dir / f"{pdf_path.stem}_page_{page}.png" for page in selected}
+    selected = [page for page in selected if overwrite or not targets[page].exists()]
+    if not selected:
+        print(f"{pdf_path.name} : toutes les pages demandées sont déjà dans {images_dir}/")
+        return []
+    sizes = page_sizes(pdf_path, selected[0], selected[-1])
+
+    added = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        # Chaque page est un processus pdftoppm : les threads suffisent à occuper tous les cœurs
+        futures = {}
+        for page in selected:
+            dpi = page_dpi(sizes.get(page, DEFAULT_PAGE_SIZE), max_dimension)
+            futures[executor.submit(rasterize_page, pdf_path, pdf_digest, page, dpi)] = (page, dpi)
+        for future in concurrent.futures.as_completed(futures):
+            page, dpi = futures[future]
+            try:
+                cached = future.result()
+            except Exception as e:
+                print(f"{pdf_path.name}, page {page} : rastérisation impossible ({e})")
+                continue
+            link_page(cached, targets[page])
+            index.set_source(targets[page].stem, {"pdf": pdf_path.name, "sha256": pdf_digest, "page": page, "dpi": dpi})
+            added.append(targets[page])
+            print(f"{targets[page].name} ({dpi} dpi)")
+
+    index.update(added, workers)
+    index.save()
+    return sorted(added)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rastérise les pages de documents PDF dans images/.")
+    parser.add_argument("pdfs", nargs="+", type=Path, help="Documents PDF à ingérer")
+    parser.add_argument("--pages", help="Pages à ingérer, par exemple 1-10,15 (défaut : toutes)")
+    parser.add_argument("--models-file", type=Path, default=MODELS_FILE,
+                        help="Modèles dont les limites fixent la résolution (défaut : %(default)s)")
+    parser.add_argument("--max-dimension", type=int,
+                        help="Plus grand côté visé en pixels (défaut : le plus strict des modèles à tester)")
+    parser.add_argument("--workers", type=int, help="Pages rastérisées simultanément (défaut : nombre de cœurs)")
+    parser.add_argument("--images-dir", type=Path, default=IMAGES_DIR, help="Dossier des images")
+    parser.add_argument("--overwrite", action="store_true", help="Remplacer les images déjà présentes")
+    args = parser.parse_args()
+
+    max_dimension = args.max_dimension or strictest_dimension(args.models_file)
+    print(f"Plus grand côté visé : {max_dimension or 'aucune limite'}"
+          f"{' px' if max_dimension else f' ({DEFAULT_DPI} dpi)'}")
+    index = ImageIndex()
+    for pdf_path in args.pdfs:
+        added = ingest_pdf(pdf_path, args.pages, max_dimension, args.workers, args.images_dir, index, args.overwrite)
+        print(f"{pdf_path.name} : {len(added)} page(s) ajoutée(s) dans {args.images_dir}/")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Prétraitement des pages avant envoi aux modèles (NumPy).
+
+Les scans d'archives ont de grandes marges, un fond coloré et sont parfois de travers.
+Chaque profil de prétraitement combine, avant l'encodage de `api_clients.prepare_image` :
+  - le recadrage automatique sur le texte (profils de projection du masque d'encre) ;
+  - le redressement (angle qui maximise la variance du profil horizontal) ;
+  - le passage en niveaux de gris ou la binarisation adaptative (seuil local).
+Les pages prétraitées gardent à l'envoi leur unique canal (JPEG en niveaux de gris, PNG
+pour les pages binarisées) ; les autres runs envoient toujours un JPEG RGB.
+Les images prétraitées sont mises en cache dans `cache/preprocessed/`, sous une clé
+formée de l'empreinte de l'image et du profil.
+
+Chaque modèle reçoit le profil qui lui convient (`MODEL_PROFILES`), ou celui forcé par
+`python run_benchmark.py --preprocess <profil>`. Les résultats de chaque profil vont dans
+le run `preprocess-<profil>` du store, et
+
+  python preprocessing.py report
+
+compare leur WER, leurs tokens d'entrée et leur coût à ceux du run par défaut
+(`rapports/preprocessing.md`).
+
+  python preprocessing.py build --profile gray   # remplit le cache en parallèle
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import statistics
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from api_clients import get_image_limits, prepare_image, query_model
+from image_analysis import BORDER_BAND, clear_border, detect_columns, ink_mask, load_grayscale, local_mean, text_line_bands
+from image_index import file_digest
+from metrics import calculate_wer
+from results_store import DEFAULT_DB_PATH, DEFAULT_RUN, RESULTS_DIR, open_result_store
+from screening import load_references
+
+CACHE_DIR = Path("./cache/preprocessed")
+REPORT_FILE = Path("rapports") / "preprocessing.md"
+
+# Préfixe des runs du store produits avec un profil de prétraitement
+RUN_PREFIX = "preprocess-"
+
+# Profils de prétraitement
+PROFILES = {
+    "none": {},
+    "crop": {"crop": True},
+    "gray": {"crop": True, "deskew": True, "mode": "gray"},
+    "binary": {"crop": True, "deskew": True, "mode": "binary"},
+}
+
+# Profil par fournisseur (préfixe de l'ID du modèle) ; "default" pour les autres.
+# Les moteurs HTR classiques (Transkribus, Kraken) font leur propre binarisation :
+# seul le recadrage leur est appliqué.
+MODEL_PROFILES = {
+    "transkribus": "crop",
+    "kraken": "crop",
+    "default": "gray",
+}
+
+# Angle maximal de redressement et pas de recherche (en degrés)
+MAX_SKEW = 5.0
+SKEW_STEP = 0.25
+
+# Marge conservée autour du texte lors du recadrage (fraction du plus grand côté)
+CROP_PADDING = 0.02
+
+# Décalage sous la moyenne locale au-delà duquel un pixel est noirci par la binarisation
+BINARIZE_OFFSET = 12
+
+
+def profile_for_model(model):
+    """Profil de prétraitement d'un modèle."""
+    return MODEL_PROFILES.get(model.split("/")[0], MODEL_PROFILES["default"])
+
+
+def content_box(mask, padding=CROP_PADDING):
+    """
+    Boîte englobant le texte d'un masque d'encre, ou None si aucun texte n'est trouvé.
+
+    Les bords du masque sont ignorés : le masque d'encre y prend le contour du papier
+    pour des traits.
+
+    Returns:
+        tuple: (gauche, haut, droite, bas) dans les coordonnées du masque
+    """
+    height, width = mask.shape
+    inner = clear_border(mask)
+    bands = text_line_bands(inner)
+    if not bands:
+        return None
+    columns = detect_columns(inner[bands[0][0]:bands[-1][1], :])
+    pad = int(padding * max(height, width))
+    return (
+        max(0, columns[0][0] - pad),
+        max(0, bands[0][0] - pad),
+        min(width, columns[-1][1] + pad),
+        min(height, bands[-1][1] + pad),
+    )
+
+
+def estimate_skew(mask, max_angle=MAX_SKEW, step=SKEW_STEP):
+    """
+    Angle d'inclinaison des lignes, en degrés dans le sens de `Image.rotate` : la page
+    est redressée par `rotate(-angle)`.
+
+    Pour chaque angle candidat, les pixels d'encre sont projetés sur l'axe vertical
+    tourné ; les lignes sont horizontales lorsque ce profil est le plus contrasté
+    (variance maximale).
+    """
+    ys, xs = np.nonzero(mask)
+    if ys.size < 100:
+        return 0.0
+    if ys.size > 200_000:
+        keep = np.random.default_rng(0).choice(ys.size, 200_000, replace=False)
+        ys, xs = ys[keep], xs[keep]
+    angles = np.arange(-max_angle, max_angle + step / 2, step)
+    radians = np.deg2rad(angles)
+    # Une ligne inclinée de θ (rotation trigonométrique de l'image) vérifie y + x·tan θ = constante
+    projections = (ys[None, :] * np.cos(radians)[:, None] + xs[None, :] * np.sin(radians)[:, None]).astype(np.int64)
+    projections -= projections.min(axis=1, keepdims=True)
+    variances = [np.bincount(row).var() for row in projections]
+    return float(angles[int(np.argmax(variances))])
+
+
+def binarize(gray, offset=BINARIZE_OFFSET):
+    """Binarisation adaptative : noir sous la moyenne locale diminuée de `offset`, blanc sinon."""
+    window = max(15, (max(gray.shape) // 40) | 1)
+    return np.where(gray < local_mean(gray, window) - offset, 0, 255).astype(np.uint8)
+
+
+def preprocess(image_path, profile):
+    """
+    Applique un profil de prétraitement à une image.
+
+    Returns:
+        PIL.Image: L'image prétraitée (RGB, niveaux de gris ou noir et blanc)
+    """
+    steps = PROFILES[profile]
+    Image.MAX_IMAGE_PIXELS = 200000000
+    with Image.open(image_path) as img:
+        img = img.convert("L" if steps.get("mode") else "RGB")
+
+    if steps.get("deskew") or steps.get("crop"):
+        gray, scale = load_grayscale(image_path)
+        mask = ink_mask(gray)
+        if steps.get("deskew"):
+            angle = estimate_skew(clear_border(mask))
+            if angle:
+                # Sans agrandissement du cadre : les coins perdus (quelques degrés) sont dans la marge
+                fill = 255 if img.mode == "L" else (255, 255, 255)
+                img = img.rotate(-angle, resample=Image.BICUBIC, fillcolor=fill)
+                # Le masque du recadrage est recalculé sur l'image réduite, redressée de même
+                gray = Image.fromarray(gray).rotate(-angle, resample=Image.BICUBIC, fillcolor=255)
+                mask = ink_mask(np.asarray(gray, dtype=np.uint8))
+        if steps.get("crop"):
+            box = content_box(mask)
+            if box is not None:
+                img = img.crop(tuple(int(value / scale) for value in box))
+
+    if steps.get("mode") == "binary":
+        # Image 1 bit : envoyée en PNG par `prepare_image`, bien plus léger qu'un JPEG
+        img = Image.fromarray(binarize(np.asarray(img, dtype=np.uint8)) > 0)
+    return img
+
+
+def profile_key(profile):
+    """Empreinte des réglages d'un profil : le cache est invalidé si un réglage change."""
+    settings = {"steps": PROFILES[profile], "max_skew": MAX_SKEW, "step": SKEW_STEP, "padding": CROP_PADDING,
+                "border": BORDER_BAND, "offset": BINARIZE_OFFSET}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def preprocessed_path(image_path, profile, cache_dir=CACHE_DIR):
+    """
+    Chemin de l'image prétraitée, calculée et mise en cache si nécessaire.
+
+    Le profil `none` renvoie l'image d'origine.
+    """
+    if not PROFILES[profile]:
+        return Path(image_path)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    cached = cache_dir / f"{file_digest(image_path)}_{profile}_{profile_key(profile)}.png"
+    if not cached.exists():
+        # Écriture dans un fichier temporaire puis renommage : jamais de fichier partiel dans le cache
+        tmp_path = cached.with_name(f"{cached.stem}.{os.getpid()}.tmp.png")
+        preprocess(image_path, profile).save(tmp_path, format="PNG")
+        os.replace(tmp_path, cached)
+    return cached
+
+
+def query_preprocessed(image_path, model, profile=None):
+    """
+    Appelle `query_model` sur l'image prétraitée avec le profil donné (ou celui du modèle).
+
+    Returns:
+        tuple: (response_data, cost)
+    """
+    profile = profile or profile_for_model(model)
+    response_data, cost = query_model(str(preprocessed_path(image_path, profile)), model, keep_grayscale=True)
+    response_data.setdefault("model_info", {})["preprocessing"] = profile
+    return response_data, cost
+
+
+def payload_size(image_path, model, keep_grayscale=False):
+    """Taille (octets) et dimensions de l'image telle qu'elle serait envoyée au modèle."""
+    image_bytes, dimensions, _ = prepare_image(str(image_path), *get_image_limits(model), keep_grayscale=keep_grayscale)
+    return len(image_bytes), dimensions
+
+
+def _build_one(image_path, profile):
+    path = preprocessed_path(image_path, profile)
+    return Path(image_path).name, payload_size(image_path, "default")[0], payload_size(path, "default", keep_grayscale=True)[0]
+
+
+def build_cache(images, profile, workers=None):
+    """Prétraite des images en parallèle (processus) et affiche le gain de taille des envois."""
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_build_one, img_path, profile) for img_path in images]
+        for future in concurrent.futures.as_completed(futures):
+            name, before, after = future.result()
+            print(f"{name} : {before / 1024:.0f} Ko -> {after / 1024:.0f} Ko ({after / before:.0%})")
+
+
+def profile_report(store, images, output_file=REPORT_FILE):
+    """
+    Compare, modèle par modèle, le WER, les tokens d'entrée et le coût de chaque run de
+    prétraitement à ceux du run par défaut, sur les pages communes.
+    """
+    references = load_references(images)
+    runs = [DEFAULT_RUN] + [run for run in store.runs() if run.startswith(RUN_PREFIX)]
+    data = defaultdict(dict)
+    for run in runs:
+        for record in store.iter_records(run=run):
+            if record["image_name"] in references:
+                data[(record["model"], run)][record["image_name"]] = (
+                    calculate_wer(references[record["image_name"]], record["result"] or ""),
+                    (record["usage"] or {}).get("prompt_tokens") or 0,
+                    record["cost"],
+                )
+
+    lines = [
+        "# Impact du prétraitement des images",
+        "",
+        f"Généré le {datetime.now().strftime('%d/%m/%Y à %H:%M:%S')}",
+        "",
+        "Profils : " + ", ".join(f"`{name}` ({', '.join(f'{k}={v}' for k, v in steps.items()) or 'aucun'})"
+                                 for name, steps in PROFILES.items()),
+        "",
+        "| Modèle | Profil | Pages | WER médian | Δ WER médian | Tokens d'entrée moyens | Δ tokens | Coût moyen ($) |",
+        "|--------|--------|-------|------------|--------------|------------------------|----------|----------------|",
+    ]
+    for model in sorted({model for model, _ in data}):
+        baseline = data.get((model, DEFAULT_RUN), {})
+        for run in runs[1:]:
+            variant = data.get((model, run))
+            common = sorted(set(variant or {}) & set(baseline))
+            if not common:
+                continue
+            wer = statistics.median(variant[image][0] for image in common)
+            base_wer = statistics.median(baseline[image][0] for image in common)
+            tokens = statistics.mean(variant[image][1] for image in common)
+            base_tokens = statistics.mean(baseline[image][1] for image in common)
+            cost = statistics.mean(variant[image][2] for image in common)
+            delta_tokens = f"{(tokens - base_tokens) / base_tokens:+.0%}" if base_tokens else "-"
+            lines.append(f"| {model} | {run[len(RUN_PREFIX):]} | {len(common)} | {wer:.3f} | {wer - base_wer:+.3f} | "
+                         f"{tokens:.0f} | {delta_tokens} | {cost:.5f} |")
+    lines += [
+        "",
+        "Les écarts (Δ) sont calculés par rapport au run sans prétraitement, sur les pages traitées "
+        "dans les deux runs. Un Δ WER négatif indique une amélioration.",
+    ]
+
+    output_file = Path(output_file)
+    output_file.parent.mkdir(exist_ok=True)
+    output_file.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    print(f"Rapport de prétraitement écrit dans '{output_file}'")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prétraitement des pages avant envoi aux modèles.")
+    parser.add_argument("command", choices=["build", "report"])
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="gray", help="Profil à appliquer (build)")
+    parser.add_argument("--images-dir", type=Path, default=Path("images"), help="Dossier des images")
+    parser.add_argument("--workers", type=int, help="Processus de prétraitement (défaut : nombre de cœurs)")
+    parser.add_argument("--db", type=Path, default=DEFAULT_DB_PATH, help="Store indexé des résultats (SQLite)")
+    parser.add_argument("--output", type=Path, default=REPORT_FILE, help="Rapport de comparaison des profils")
+    args = parser.parse_args()
+
+    images = sorted(list(args.images_dir.glob("*.jpg")) + list(args.images_dir.glob("*.png")))
+    if args.command == "build":
+        build_cache(images, args.profile, args.workers)
+    else:
+        profile_report(open_result_store(args.db, RESULTS_DIR), images, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Esquisse de quantiles en flux, à erreur relative bornée (principe de DDSketch).
+
+Chaque valeur positive est rangée dans un seau logarithmique : le seau `i` couvre
+l'intervalle ]γ^(i-1), γ^i], avec γ = (1 + α) / (1 - α). Tout quantile est donc estimé
+à ±α près en valeur relative, quel que soit le nombre de valeurs, et la mémoire ne
+dépend que de l'étendue des valeurs (quelques centaines de seaux de la milliseconde à la
+journée pour α = 1 %). Deux esquisses de même précision se fusionnent exactement.
+"""
+
+import math
+
+# Erreur relative maximale des quantiles estimés
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+# En dessous de cette valeur, les valeurs sont comptées comme nulles
+MIN_POSITIVE_VALUE = 1e-9
+
+
+class QuantileSketch:
+    """Esquisse de quantiles de valeurs positives ou nulles, alimentée une valeur à la fois."""
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy doit être compris entre 0 et 1 (exclus)")
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """Ajoute une valeur (les valeurs négatives sont refusées)."""
+        if value < 0:
+            raise ValueError(f"Valeur négative : {value}")
+        if value < MIN_POSITIVE_VALUE:
+            self.zero_count += 1
+        else:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[key] = self.buckets.get(key, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """Ajoute les valeurs d'une autre esquisse de même précision."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Les esquisses fusionnées doivent avoir la même précision")
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        for bound in (other.min, other.max):
+            if bound is not None:
+                self.min = bound if self.min is None else min(self.min, bound)
+                self.max = bound if self.max is None else max(self.max, bound)
+
+    def quantile(self, q):
+        """
+        Estime le quantile `q` (entre 0 et 1) des valeurs ajoutées.
+
+        Returns:
+            float: Valeur estimée à ±`relative_accuracy` près, ou None si l'esquisse est vide
+        """
+        if not 0 <= q <= 1:
+            raise ValueError("q doit être compris entre 0 et 1")
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return self.min
+        cumulative = self.zero_count
+        for key in sorted(self.buckets):
+            cumulative += self.buckets[key]
+            if cumulative > rank:
+                # Milieu (en erreur relative) du seau ]γ^(key-1), γ^key]
+                value = 2 * self._gamma ** key / (self._gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else None
@@ -2,9 +2,14 @@
 
 import os
 import json
-import re
 import datetime
 from metrics import calculate_wer, clean_text_for_wer
+from results_store import open_result_store, record_latency, CASCADE_RUN, DEFAULT_DB_PATH
+from image_index import ImageIndex
+from quantile_sketch import QuantileSketch
+
+# Quantiles de latence publiés dans le résumé
+LATENCY_QUANTILES = (0.5, 0.95, 0.99)
 
 
 def compute_median(values):
@@ -19,96 +24,171 @@ def compute_median(values):
         return sorted_vals[mid]
 
 
-def generate_results_md_table(results_dir="résultats", reference_dir="transcriptions_de_référence", output_file="resultats_summary.md"):
+def new_speed_stats():
+    """Compteurs de vitesse d'un modèle, alimentés résultat par résultat (voir `add_speed_record`)."""
+    return {
+        "latencies": QuantileSketch(),
+        "token_pages": 0,
+        "tokens": 0,
+        "timed_completion_tokens": 0,
+        "timed_generation_latency": 0.0,
+    }
+
+
+def add_speed_record(speed, record):
+    """
+    Ajoute un résultat aux compteurs de vitesse de son modèle.
+
+    Les résultats enregistrés sans appel (pages blanches de `run_benchmark.py --blank-pages stub`)
+    et les latences absentes ou invraisemblables (anciens fichiers, voir `record_latency`)
+    sont ignorés ; le débit de sortie ne porte que sur les pages chronométrées qui ont
+    produit des tokens.
+    """
+    if (record.get("model_info") or {}).get("skipped"):
+        return
+    usage = record.get("usage") or {}
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    completion_tokens = usage.get("completion_tokens") or 0
+    if prompt_tokens or completion_tokens:
+        speed["token_pages"] += 1
+        speed["tokens"] += prompt_tokens + completion_tokens
+
+    latency = record_latency(record)
+    if latency is None:
+        return
+    speed["latencies"].add(latency)
+    if completion_tokens and latency > 0:
+        speed["timed_completion_tokens"] += completion_tokens
+        speed["timed_generation_latency"] += latency
+
+
+def speed_summary(speed):
+    """
+    Statistiques de vitesse d'un modèle ; les valeurs non mesurables valent None.
+
+    Returns:
+        dict: pages chronométrées, latences p50/p95/p99 (s), tokens par page,
+              tokens de sortie par seconde et pages par minute
+    """
+    latencies = speed["latencies"]
+    summary = {"timed_pages": latencies.count}
+    for q in LATENCY_QUANTILES:
+        summary[f"p{round(q * 100)}"] = latencies.quantile(q)
+    summary["tokens_per_page"] = speed["tokens"] / speed["token_pages"] if speed["token_pages"] else None
+    summary["output_tokens_per_s"] = (
+        speed["timed_completion_tokens"] / speed["timed_generation_latency"]
+        if speed["timed_generation_latency"] else None
+    )
+    # Un seul appel à la fois : avec N appels en parallèle, le débit est jusqu'à N fois plus élevé
+    summary["pages_per_min"] = 60 * latencies.count / latencies.total if latencies.total else None
+    return summary
+
+
+def format_stat(value, spec):
+    return "—" if value is None else format(value, spec)
+
+
+def load_reference_text(reference_dir, base_name):
+    """Transcription de référence d'une page, ou None si le fichier est absent."""
+    ref_file_path = os.path.join(reference_dir, base_name + ".md")
+    if not os.path.exists(ref_file_path):
+        return None
+    with open(ref_file_path, "r", encoding="utf-8") as ref_file:
+        ref_content = ref_file.read().strip()
+    try:
+        return json.loads(ref_content).get("result", ref_content)
+    except (json.JSONDecodeError, AttributeError):
+        return ref_content
+
+
+def cascade_summary(store, reference_dir, excluded_from_wer):
+    """
+    Statistiques d'escalade des cascades exécutées (run `cascade` du store).
+
+    Returns:
+        list: Une entrée par configuration de cascade : pages, pages escaladées, pages
+        retenues à chaque niveau, coût total et WER médian (pages ayant une référence)
+    """
+    by_cascade = {}
+    for record in store.iter_records(run=CASCADE_RUN):
+        info = record["model_info"] or {}
+        entry = by_cascade.setdefault(record["model"], {"pages": 0, "escalated": 0, "accepted": {}, "cost": 0.0, "wers": []})
+        entry["pages"] += 1
+        entry["escalated"] += len(info.get("cascade") or []) > 1
+        accepted = info.get("accepted_model") or "inconnu"
+        entry["accepted"][accepted] = entry["accepted"].get(accepted, 0) + 1
+        entry["cost"] += record["cost"]
+        if record["image_name"] not in excluded_from_wer:
+            reference = load_reference_text(reference_dir, record["image_name"])
+            if reference is not None:
+                entry["wers"].append(calculate_wer(reference, record["result"] or ""))
+    return [
+        {"cascade": cascade, **entry, "wer_med": compute_median(entry["wers"]) if entry["wers"] else None}
+        for cascade, entry in sorted(by_cascade.items())
+    ]
+
+
+def generate_results_md_table(results_dir="résultats", reference_dir="transcriptions_de_référence", output_file="resultats_summary.md",
+                              db_path=DEFAULT_DB_PATH):
     """
-    Itère sur les fichiers dans le dossier `results_dir` et génère un tableau markdown dans `output_file`.
-    Pour chaque fichier, le WER est calculé par rapport à la transcription de référence correspondante
-    dans `reference_dir`. Le tableau généré comprendra pour chaque modèle :
+    Itère sur les résultats du store indexé `db_path` (qui reprend à chaque ouverture les fichiers
+    nouveaux ou modifiés de `results_dir`)
+    et génère un tableau markdown dans `output_file`.
+    Pour chaque résultat, le WER est calculé par rapport à la transcription de référence correspondante
+    dans `reference_dir` ; les pages blanches de l'index des images (`image_index.py`) sont exclues.
+    Le tableau généré comprendra pour chaque modèle :
       - le nom du modèle,
       - l'éditeur,
       - le type de modèle (libre/propriétaire),
       - le nombre d'images prises en compte,
       - le coût total ($) (somme des coûts de chaque image),
       - le coût moyen ($),
-      - le WER min, médian et max.
+      - le WER min, médian et max,
+      - les latences p50, p95 et p99, les tokens par page, les tokens de sortie par seconde
+        et les pages par minute.
     En dessous du tableau, un paragraphe explique le calcul du WER ainsi que la signification des colonnes 'éditeur'
     et 'type de modèle'.
     Les modèles sont triés par WER médian croissant (meilleure performance en premier).
+    Un second tableau classe les modèles par latence médiane, avec leur WER médian et leur coût moyen.
+    Si des cascades de modèles ont été exécutées (`cascade.py run`), un troisième tableau donne
+    pour chacune les pages escaladées, le niveau retenu, le coût et le WER médian.
+    Les latences sont résumées par des esquisses de quantiles (`quantile_sketch.py`) : la mémoire
+    utilisée ne dépend pas du nombre de résultats.
     La date et l'heure de génération sont ajoutées en haut du fichier.
     """
-    try:
-        results_files = os.listdir(results_dir)
-    except FileNotFoundError:
+    if not os.path.isdir(results_dir) and not os.path.exists(db_path):
         print(f"Le dossier '{results_dir}' n'existe pas.")
         return
 
+    store = open_result_store(db_path, results_dir)
+
+    # Les pages blanches de l'index des images n'entrent pas dans le calcul du WER
+    excluded_from_wer = ImageIndex().excluded_from_wer()
+
     # Dictionnaire pour regrouper les données par modèle
     data_by_model = {}
+    # La vitesse porte sur toutes les pages envoyées, y compris celles exclues du WER
+    speed_by_model = {}
 
-    for filename in results_files:
-        result_file_path = os.path.join(results_dir, filename)
-        
-        # Vérifier que c'est bien un fichier JSON
-        if not os.path.isfile(result_file_path) or not filename.endswith('.json'):
-            continue
+    for record in store.iter_records():
+        base_name = record["image_name"]
+        # Si le résultat contient "model_info", on l'utilise pour récupérer le modèle
+        model = record["model_info"].get("id", record["model"]) if record["model_info"] else record["model"]
+        add_speed_record(speed_by_model.setdefault(model, new_speed_stats()), record)
 
-        # Extraire le nom de base de l'image (sans le modèle et l'extension)
-        # Format typique: NOM_IMAGE_page_XX_modele.json
-        # On cherche à extraire NOM_IMAGE_page_XX
-        
-        # Utiliser une expression régulière pour extraire le nom de base
-        # Recherche un motif qui correspond à "page_XX" suivi d'un underscore et d'autres caractères
-        match = re.search(r'(.*?page_\d+)_', filename)
-        if match:
-            base_name = match.group(1)
-        else:
-            # Si pas de correspondance, prendre tout avant .json
-            base_name = filename.split('.')[0]
-        
-        # Construire le chemin du fichier de référence
-        ref_file_path = os.path.join(reference_dir, base_name + ".md")
+        if base_name in excluded_from_wer:
+            continue
         
-        if not os.path.exists(ref_file_path):
-            print(f"Fichier de référence pour '{filename}' introuvable: '{ref_file_path}'. Ignoré.")
+        reference = load_reference_text(reference_dir, base_name)
+        if reference is None:
+            ref_file_path = os.path.join(reference_dir, base_name + ".md")
+            print(f"Fichier de référence pour '{base_name}_{record['model_key']}' introuvable: '{ref_file_path}'. Ignoré.")
             continue
 
-        # Lecture du fichier de résultat
-        with open(result_file_path, "r", encoding="utf-8") as res_file:
-            res_content = res_file.read().strip()
-        
-        # Parsing du contenu JSON pour extraire modèle, coût, éditeur, type de modèle et transcription
-        try:
-            res_json = json.loads(res_content)
-            hypothesis = res_json.get("result", res_content)
-            # Nouveauté : si le JSON contient "model_info", on l'utilise pour récupérer le modèle et le coût.
-            if "model_info" in res_json:
-                model_info = res_json["model_info"]
-                model = model_info.get("id", res_json.get("model", "inconnu"))
-                cost = model_info.get("total_cost", 0.0)
-            else:
-                model = res_json.get("model", "inconnu")
-                cost = res_json.get("prix", 0.0)
-            try:
-                cost = float(cost)
-            except (ValueError, TypeError):
-                cost = 0.0
-            editeur = res_json.get("editeur", "inconnu")
-            modele_type = res_json.get("modele_type", "inconnu")
-        except json.JSONDecodeError:
-            hypothesis = res_content
-            model = "inconnu"
-            cost = 0.0
-            editeur = "inconnu"
-            modele_type = "inconnu"
-
-        # Lecture du fichier de référence
-        with open(ref_file_path, "r", encoding="utf-8") as ref_file:
-            ref_content = ref_file.read().strip()
-            try:
-                ref_json = json.loads(ref_content)
-                reference = ref_json.get("result", ref_content)
-            except json.JSONDecodeError:
-                reference = ref_content
+        hypothesis = record["result"] or ""
+        cost = record["cost"]
+        editeur = record["editeur"] or "inconnu"
+        modele_type = record["modele_type"] or "inconnu"
 
         # Calcul du WER via la fonction calculate_wer
         wer = calculate_wer(reference, hypothesis)
@@ -143,7 +223,8 @@ def generate_results_md_table(results_dir="résultats", reference_dir="transcrip
             "mean_cost": mean_cost,
             "wer_min": wer_min,
             "wer_med": wer_med,
-            "wer_max": wer_max
+            "wer_max": wer_max,
+            **speed_summary(speed_by_model[model])
         })
     
     # Tri des modèles par WER médian croissant (meilleure performance en premier)
@@ -156,17 +237,54 @@ def generate_results_md_table(results_dir="résultats", reference_dir="transcrip
     # Création du tableau Markdown avec l'en-tête comprenant les nouvelles colonnes
     table_rows = []
     table_rows.append(f"# Résultats de transcription - Généré le {date_str}\n")
-    table_rows.append("| Modèle | Éditeur | Type de modèle | Nombre d'images | Coût total ($) | Coût moyen ($) | WER min | WER médian | WER max |")
-    table_rows.append("| --- | --- | --- | --- | ---: | ---: | ---: | ---: | ---: |")
+    table_rows.append("| Modèle | Éditeur | Type de modèle | Nombre d'images | Coût total ($) | Coût moyen ($) | WER min | WER médian | WER max "
+                      "| Latence p50 (s) | Latence p95 (s) | Latence p99 (s) | Tokens/page | Tokens de sortie/s | Pages/min |")
+    table_rows.append("| --- | --- | --- | --- | ---: | ---: | ---: | ---: | ---: | ---: | ---: | ---: | ---: | ---: | ---: |")
 
     # Ajout des lignes du tableau triées par performance
     for stat in model_stats:
         row = (
             f"| {stat['model']} | {stat['editeur']} | {stat['modele_type']} | {stat['n_images']} | "
-            f"{stat['total_cost']:.6f} | {stat['mean_cost']:.6f} | {stat['wer_min']:.3f} | {stat['wer_med']:.3f} | {stat['wer_max']:.3f} |"
+            f"{stat['total_cost']:.6f} | {stat['mean_cost']:.6f} | {stat['wer_min']:.3f} | {stat['wer_med']:.3f} | {stat['wer_max']:.3f} | "
+            f"{format_stat(stat['p50'], '.2f')} | {format_stat(stat['p95'], '.2f')} | {format_stat(stat['p99'], '.2f')} | "
+            f"{format_stat(stat['tokens_per_page'], '.0f')} | {format_stat(stat['output_tokens_per_s'], '.1f')} | "
+            f"{format_stat(stat['pages_per_min'], '.1f')} |"
         )
         table_rows.append(row)
 
+    # Classement par vitesse : tous les modèles chronométrés, y compris ceux sans référence
+    stats_by_model = {stat["model"]: stat for stat in model_stats}
+    leaderboard = []
+    for model, speed in speed_by_model.items():
+        summary = speed_summary(speed)
+        if summary["timed_pages"]:
+            leaderboard.append((model, summary, stats_by_model.get(model)))
+    leaderboard.sort(key=lambda entry: (entry[1]["p50"], entry[1]["p95"]))
+
+    table_rows.append("\n## Classement par vitesse\n")
+    table_rows.append("| Rang | Modèle | Pages chronométrées | Latence p50 (s) | Latence p95 (s) | Latence p99 (s) | Pages/min "
+                      "| Tokens de sortie/s | Tokens/page | WER médian | Coût moyen ($) |")
+    table_rows.append("| ---: | --- | ---: | ---: | ---: | ---: | ---: | ---: | ---: | ---: | ---: |")
+    for rank, (model, summary, stat) in enumerate(leaderboard, start=1):
+        table_rows.append(
+            f"| {rank} | {model} | {summary['timed_pages']} | {summary['p50']:.2f} | {summary['p95']:.2f} | "
+            f"{summary['p99']:.2f} | {format_stat(summary['pages_per_min'], '.1f')} | "
+            f"{format_stat(summary['output_tokens_per_s'], '.1f')} | {format_stat(summary['tokens_per_page'], '.0f')} | "
+            f"{format_stat(stat and stat['wer_med'], '.3f')} | {format_stat(stat and stat['mean_cost'], '.6f')} |"
+        )
+
+    cascades = cascade_summary(store, reference_dir, excluded_from_wer)
+    if cascades:
+        table_rows.append("\n## Cascades de modèles\n")
+        table_rows.append("| Cascade | Pages | Pages escaladées | Pages retenues par modèle | Coût total ($) | Coût moyen ($) | WER médian |")
+        table_rows.append("| --- | ---: | ---: | --- | ---: | ---: | ---: |")
+        for entry in cascades:
+            accepted = ", ".join(f"{model} : {count}" for model, count in sorted(entry["accepted"].items(), key=lambda item: -item[1]))
+            table_rows.append(
+                f"| {entry['cascade']} | {entry['pages']} | {entry['escalated']} ({entry['escalated'] / entry['pages']:.0%}) | "
+                f"{accepted} | {entry['cost']:.6f} | {entry['cost'] / entry['pages']:.6f} | {format_stat(entry['wer_med'], '.3f')} |"
+            )
+
     # Ajout d'un paragraphe explicatif en dessous du tableau
     explanation = (
         "\n\n"
@@ -177,6 +295,15 @@ def generate_results_md_table(results_dir="résultats", reference_dir="transcrip
         "une correspondance parfaite, tandis qu'un WER de 1 signifie que l'ensemble des mots diffère.\n\n"
         "Les colonnes 'Éditeur' et 'Type de modèle' indiquent respectivement l'entité ayant développé le modèle et si le modèle est libre "
         "(open source) ou propriétaire.\n\n"
+        "Les latences (p50, p95, p99 : temps en dessous duquel se terminent 50 %, 95 % et 99 % des appels) sont estimées "
+        "à 1 % près et portent sur toutes les pages envoyées aux modèles ; les résultats enregistrés sans appel "
+        "(pages blanches) et les latences absentes ou invraisemblables des anciens fichiers sont ignorés. 'Tokens/page' additionne les tokens d'entrée et de sortie, "
+        "'Tokens de sortie/s' rapporte les tokens générés au temps des appels, et 'Pages/min' correspond à un seul appel "
+        "à la fois (le débit croît avec le nombre d'appels en parallèle). Un tiret signale une valeur non mesurée "
+        "(modèles locaux sans décompte de tokens, par exemple).\n\n"
+        "Une page est escaladée par une cascade lorsque l'estimateur de qualité sans référence doute du premier "
+        "niveau ; le coût d'une cascade inclut son modèle de contrôle et tous les niveaux appelés. La courbe "
+        "coût / WER en fonction des seuils d'escalade est produite par `python cascade.py report`.\n\n"
         "Remarque : Si les coûts affichés sont nuls, vérifiez que vos fichiers de résultats incluent une clé 'cost' correcte. "
         "Le calcul des coûts repose sur la donnée renvoyée par les API et peut nécessiter un ajustement pour refléter les valeurs attendues."
     )
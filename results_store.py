@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Stockage indexé des résultats de transcription (SQLite).
+
+Chaque résultat est identifié par la clé primaire (image, modèle, run) : plus besoin
+de retrouver l'image et le modèle en analysant les noms de fichiers de `résultats/`.
+Il porte aussi l'empreinte SHA-256 du contenu de l'image (`image_index.py`) : une page
+copiée ou renommée est reconnue comme déjà traitée.
+Les réponses brutes des API, volumineuses, sont compressées dans une table séparée.
+
+Le dossier `résultats/` reste le format d'échange publié : le store peut l'importer
+et le réexporter à l'identique (`export`). Les runners n'y écrivent plus un fichier par
+résultat, sauf avec `--legacy-json`. `open_result_store` y reprend à chaque ouverture les
+fichiers nouveaux ou modifiés (notebook, anciens scripts), suivis dans `legacy_imports`.
+
+Usage :
+  python results_store.py import   # résultats/*.json -> résultats.sqlite
+  python results_store.py export   # résultats.sqlite -> résultats/*.json
+  python results_store.py stats
+"""
+
+import argparse
+import json
+import re
+import sqlite3
+import zlib
+from contextlib import contextmanager
+from pathlib import Path, PureWindowsPath
+
+from task_ledger import write_json_atomic
+
+# Emplacements par défaut
+DEFAULT_DB_PATH = Path("résultats.sqlite")
+RESULTS_DIR = Path("résultats")
+
+# Run par défaut (les autres runs servent aux variantes : prétraitement, découpage...)
+DEFAULT_RUN = "default"
+# Run des transcriptions retenues par la cascade de modèles (`cascade.py`)
+CASCADE_RUN = "cascade"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    image TEXT NOT NULL,
+    model TEXT NOT NULL,
+    run TEXT NOT NULL DEFAULT 'default',
+    model_key TEXT NOT NULL,
+    image_path TEXT,
+    editeur TEXT,
+    modele_type TEXT,
+    result TEXT,
+    cost REAL,
+    latency REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    timestamp TEXT,
+    model_info TEXT,
+    usage TEXT,
+    image_sha256 TEXT,
+    PRIMARY KEY (image, model, run)
+);
+CREATE INDEX IF NOT EXISTS results_model ON results (model, run);
+CREATE TABLE IF NOT EXISTS raw_responses (
+    image TEXT NOT NULL,
+    model TEXT NOT NULL,
+    run TEXT NOT NULL DEFAULT 'default',
+    response BLOB NOT NULL,
+    PRIMARY KEY (image, model, run)
+);
+CREATE TABLE IF NOT EXISTS legacy_imports (
+    file TEXT PRIMARY KEY,
+    run TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+"""
+
+# Latence maximale plausible (en secondes) : les anciens fichiers de résultats enregistraient
+# parfois l'horodatage de la requête dans le champ `latency`
+MAX_PLAUSIBLE_LATENCY = 24 * 3600
+
+# Champs du format historique des fichiers JSON, dans leur ordre d'origine
+LEGACY_FIELDS = ["model", "editeur", "modele_type", "image", "result", "timestamp", "model_info", "usage", "latency"]
+
+
+def safe_model_name(model):
+    """Create valid filename by replacing invalid characters"""
+    return model.replace('/', '_').replace('\\', '_').replace(':', '_')
+
+
+def image_stem(image_path):
+    """
+    Nom de l'image sans dossier ni extension.
+
+    Les chemins enregistrés peuvent venir de Windows (`images\\page.png`) : ils sont
+    donc découpés selon les deux séparateurs.
+    """
+    return PureWindowsPath(image_path).stem
+
+
+def _record_cost(record):
+    model_info = record.get("model_info") or {}
+    try:
+        return float(model_info.get("total_cost", record.get("prix", 0.0)) or 0.0)
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def record_latency(record):
+    """Latence d'un résultat en secondes, ou None si elle est absente ou invraisemblable."""
+    latency = record.get("latency")
+    if not isinstance(latency, (int, float)) or not 0 <= latency <= MAX_PLAUSIBLE_LATENCY:
+        return None
+    return float(latency)
+
+
+class ResultStore:
+    """
+    Accès aux résultats stockés dans une base SQLite.
+
+    Les enregistrements renvoyés sont des dictionnaires au format historique des
+    fichiers de `résultats/`, complétés des clés `image_name` (nom de l'image sans
+    extension), `model_key` (nom du modèle dans les noms de fichiers), `run`, `cost` et
+    `image_sha256` (empreinte du contenu de l'image, si elle est connue).
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, legacy_dir=None):
+        self.db_path = str(db_path)
+        # Dossier où chaque résultat du run par défaut est aussi écrit au format historique
+        # (option `--legacy-json` des runners), ou None
+        self.legacy_dir = Path(legacy_dir) if legacy_dir is not None else None
+        # Empreintes des images par nom, renseignées par `set_image_hashes`
+        self.image_hashes = {}
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            # Migration des bases créées avant l'empreinte des images
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(results)")}
+            if "image_sha256" not in columns:
+                conn.execute("ALTER TABLE results ADD COLUMN image_sha256 TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS results_sha256 ON results (image_sha256, model, run)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def put(self, record, run=DEFAULT_RUN, raw_response=None, model_key=None):
+        """
+        Enregistre (ou remplace) un résultat.
+
+        Args:
+            record: Résultat au format historique (clés model, image, result, ...)
+            run: Nom du run
+            raw_response: Réponse brute de l'API (stockée compressée, optionnelle)
+            model_key: Nom du modèle dans les noms de fichiers (déduit de `model` sinon)
+        """
+        image = image_stem(record["image"])
+        model = record["model"]
+        usage = record.get("usage") or {}
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (image, model, run, model_key, image_path, editeur, modele_type, "
+                "result, cost, latency, prompt_tokens, completion_tokens, timestamp, model_info, usage, image_sha256) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, "
+                # Un résultat remplacé sans empreinte (réimport d'un fichier) garde celle déjà connue
+                "COALESCE(?, (SELECT image_sha256 FROM results WHERE image = ? AND model = ? AND run = ?)))",
+                (
+                    image, model, run, model_key or safe_model_name(model), record["image"],
+                    record.get("editeur"), record.get("modele_type"), record.get("result"),
+                    _record_cost(record), record.get("latency"),
+                    usage.get("prompt_tokens"), usage.get("completion_tokens"), record.get("timestamp"),
+                    json.dumps(record.get("model_info") or {}, ensure_ascii=False),
+                    json.dumps(usage, ensure_ascii=False),
+                    record.get("image_sha256") or self.image_hashes.get(image), image, model, run
+                )
+            )
+            if raw_response is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO raw_responses (image, model, run, response) VALUES (?, ?, ?, ?)",
+                    (image, model, run, zlib.compress(json.dumps(raw_response, ensure_ascii=False).encode("utf-8")))
+                )
+        if self.legacy_dir is not None and run == DEFAULT_RUN:
+            self._write_legacy(record, f"{image}_{model_key or safe_model_name(model)}.json", run)
+
+    def _write_legacy(self, record, file_name, run):
+        """Écrit un résultat au format historique, noté comme importé pour ne pas être relu."""
+        self.legacy_dir.mkdir(exist_ok=True)
+        path = self.legacy_dir / file_name
+        # Écriture atomique : un fichier présent est toujours un résultat complet
+        write_json_atomic(path, record)
+        stat = path.stat()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO legacy_imports (file, run, mtime_ns, size) VALUES (?, ?, ?, ?)",
+                (str(path), run, stat.st_mtime_ns, stat.st_size)
+            )
+
+    @staticmethod
+    def _row_to_record(row):
+        record = {
+            "model": row["model"],
+            "editeur": row["editeur"],
+            "modele_type": row["modele_type"],
+            "image": row["image_path"],
+            "result": row["result"],
+            "timestamp": row["timestamp"],
+            "model_info": json.loads(row["model_info"] or "{}"),
+            "usage": json.loads(row["usage"] or "{}"),
+            "latency": row["latency"],
+        }
+        record.update({
+            "image_name": row["image"],
+            "model_key": row["model_key"],
+            "run": row["run"],
+            "cost": row["cost"] or 0.0,
+            "image_sha256": row["image_sha256"],
+        })
+        return record
+
+    def get(self, image, model, run=DEFAULT_RUN):
+        """Renvoie le résultat d'un couple (image, modèle), ou None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM results WHERE image = ? AND model = ? AND run = ?", (image, model, run)
+            ).fetchone()
+        return self._row_to_record(row) if row else None
+
+    def get_raw_response(self, image, model, run=DEFAULT_RUN):
+        """Renvoie la réponse brute décompressée d'un couple (image, modèle), ou None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT response FROM raw_responses WHERE image = ? AND model = ? AND run = ?", (image, model, run)
+            ).fetchone()
+        return json.loads(zlib.decompress(row["response"])) if row else None
+
+    def iter_records(self, run=DEFAULT_RUN, model=None, image=None):
+        """Itère sur les résultats d'un run, éventuellement filtrés par modèle ou par image."""
+        query = "SELECT * FROM results WHERE run = ?"
+        params = [run]
+        if model is not None:
+            query += " AND model = ?"
+            params.append(model)
+        if image is not None:
+            query += " AND image = ?"
+            params.append(image)
+        query += " ORDER BY image, model"
+        with self._connect() as conn:
+            for row in conn.execute(query, params):
+                yield self._row_to_record(row)
+
+    def completed_pairs(self, run=DEFAULT_RUN):
+        """Ensemble des couples (image, modèle) déjà traités pour un run."""
+        with self._connect() as conn:
+            return {(row["image"], row["model"]) for row in conn.execute(
+                "SELECT image, model FROM results WHERE run = ?", (run,)
+            )}
+
+    def completed_hashes(self, run=DEFAULT_RUN):
+        """Ensemble des couples (empreinte de l'image, modèle) déjà traités pour un run."""
+        with self._connect() as conn:
+            return {(row["image_sha256"], row["model"]) for row in conn.execute(
+                "SELECT image_sha256, model FROM results WHERE run = ? AND image_sha256 IS NOT NULL", (run,)
+            )}
+
+    def set_image_hashes(self, hashes):
+        """
+        Associe les noms d'images à l'empreinte de leur contenu : les résultats existants
+        qui n'en ont pas sont complétés, les prochains l'enregistrent.
+
+        Args:
+            hashes: {nom de l'image: empreinte SHA-256}
+        """
+        self.image_hashes.update(hashes)
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE results SET image_sha256 = ? WHERE image = ? AND image_sha256 IS NULL",
+                [(sha256, image) for image, sha256 in hashes.items()]
+            )
+
+    def runs(self):
+        """Liste des runs présents dans le store."""
+        with self._connect() as conn:
+            return [row["run"] for row in conn.execute("SELECT DISTINCT run FROM results ORDER BY run")]
+
+    def count(self, run=None):
+        """Nombre de résultats (pour un run, ou au total)."""
+        with self._connect() as conn:
+            if run is None:
+                return conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            return conn.execute("SELECT COUNT(*) FROM results WHERE run = ?", (run,)).fetchone()[0]
+
+    def import_legacy(self, results_dir=RESULTS_DIR, run=DEFAULT_RUN, only_changed=False):
+        """
+        Importe les fichiers `résultats/*.json` (format historique).
+
+        Chaque fichier lu est noté avec sa date de modification et sa taille : avec
+        `only_changed`, seuls les fichiers nouveaux ou modifiés depuis leur dernier
+        import sont relus.
+
+        Returns:
+            int: Nombre de fichiers importés
+        """
+        with self._connect() as conn:
+            known = {
+                row["file"]: (row["run"], row["mtime_ns"], row["size"])
+                for row in conn.execute("SELECT file, run, mtime_ns, size FROM legacy_imports")
+            }
+        imported = 0
+        for result_file in sorted(Path(results_dir).glob("*.json")):
+            stat = result_file.stat()
+            signature = (run, stat.st_mtime_ns, stat.st_size)
+            if only_changed and known.get(str(result_file)) == signature:
+                continue
+            with self._connect() as conn:
+                # Noté même s'il est illisible : il ne sera relu qu'une fois modifié
+                conn.execute(
+                    "INSERT OR REPLACE INTO legacy_imports (file, run, mtime_ns, size) VALUES (?, ?, ?, ?)",
+                    (str(result_file), *signature)
+                )
+            try:
+                with open(result_file, "r", encoding="utf-8") as f:
+                    record = json.load(f)
+            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                print(f"Fichier de résultat illisible, ignoré : {result_file} ({e})")
+                continue
+
+            image = image_stem(record.get("image", ""))
+            if image and result_file.stem.startswith(f"{image}_"):
+                model_key = result_file.stem[len(image) + 1:]
+            else:
+                # Format typique : NOM_IMAGE_page_XX_modele.json
+                match = re.search(r'(.*?page_\d+)_(.*)', result_file.stem)
+                if not match:
+                    print(f"Nom de fichier non reconnu, ignoré : {result_file.name}")
+                    continue
+                image, model_key = match.groups()
+                record.setdefault("image", f"images/{image}.png")
+            record.setdefault("model", model_key)
+
+            self.put(record, run=run, model_key=model_key)
+            imported += 1
+        return imported
+
+    def export_legacy(self, results_dir=RESULTS_DIR, run=DEFAULT_RUN):
+        """
+        Exporte les résultats d'un run au format historique (`<image>_<modèle>.json`).
+
+        Returns:
+            int: Nombre de fichiers écrits
+        """
+        results_dir = Path(results_dir)
+        results_dir.mkdir(exist_ok=True)
+        exported = 0
+        for record in self.iter_records(run=run):
+            write_json_atomic(results_dir / f"{record['image_name']}_{record['model_key']}.json", to_legacy(record))
+            exported += 1
+        return exported
+
+
+def to_legacy(record):
+    """Réduit un enregistrement du store au format historique des fichiers JSON."""
+    return {field: record.get(field) for field in LEGACY_FIELDS}
+
+
+def open_result_store(db_path=DEFAULT_DB_PATH, results_dir=RESULTS_DIR, legacy_json=False):
+    """
+    Ouvre le store, après y avoir importé les fichiers de `results_dir` nouveaux ou
+    modifiés depuis le dernier import (résultats du notebook ou d'anciens scripts).
+    Avec `legacy_json`, les résultats enregistrés sont aussi écrits dans `results_dir`.
+    """
+    store = ResultStore(db_path, results_dir if legacy_json else None)
+    if Path(results_dir).exists():
+        imported = store.import_legacy(results_dir, only_changed=True)
+        if imported:
+            print(f"{imported} résultats importés depuis '{results_dir}' dans '{db_path}'")
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gestion du store indexé des résultats.")
+    parser.add_argument("command", choices=["import", "export", "stats"])
+    parser.add_argument("--db", type=Path, default=DEFAULT_DB_PATH, help="Base SQLite des résultats")
+    parser.add_argument("--results-dir", type=Path, default=RESULTS_DIR, help="Dossier au format historique")
+    parser.add_argument("--run", default=DEFAULT_RUN, help="Nom du run")
+    args = parser.parse_args()
+
+    store = ResultStore(args.db)
+    if args.command == "import":
+        print(f"{store.import_legacy(args.results_dir, args.run)} résultats importés dans '{args.db}'")
+    elif args.command == "export":
+        print(f"{store.export_legacy(args.results_dir, args.run)} fichiers écrits dans '{args.results_dir}'")
+    else:
+        for run in store.runs():
+            print(f"{run}: {store.count(run)} résultats")
+
+
+if __name__ == "__main__":
+    main()
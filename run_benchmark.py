@@ -0,0 +1,701 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Exécution du benchmark HTR en ligne de commande.
+
+Le script reprend la logique du notebook `benchmark_htr.ipynb` (fonction `process_image`)
+mais étend `models_to_test.json` × `images/` en une seule file de tâches. Chaque fournisseur
+(préfixe de l'ID du modèle : openai, google, transkribus, kraken...) dispose de son propre
+pool de concurrence : tous les fournisseurs travaillent en même temps et un fournisseur lent
+ne bloque plus les autres. Les couples (image, modèle) déjà traités sont ignorés, ce qui
+permet de reprendre un benchmark interrompu. Les résultats vont dans le store indexé
+(`results_store.py`) ; `--legacy-json` les écrit aussi un par un dans `résultats/`, et
+`python results_store.py export` régénère ce dossier à la demande.
+
+Les appels en échec sont consignés dans un journal (voir `failure_journal.py`) ; `--replay`
+relance uniquement ces échecs, avec le délai adapté à chaque classe d'erreur, sans
+reparcourir toute la matrice. Les erreurs permanentes ne sont jamais relancées.
+
+Avec `--screen`, les modèles sont d'abord évalués sur un petit échantillon stratifié de
+pages et seuls les modèles compétitifs sont promus sur des échantillons plus grands
+(voir `screening.py`) : les modèles sans espoir ne sont pas payés sur tout le corpus.
+
+Avec `--tiling`, les pages sont découpées en colonnes et blocs de texte transcrits en
+parallèle puis recousus (voir `tiling.py`) ; les résultats vont dans le run `tiled`.
+Avec `--preprocess`, les pages sont recadrées, redressées et converties en niveaux de gris
+ou en noir et blanc avant l'envoi (voir `preprocessing.py`) ; les résultats vont dans le
+run `preprocess-<profil>`.
+
+Les images sont indexées par contenu (voir `image_index.py`) : une page présente sous
+plusieurs noms ou dans plusieurs dossiers n'est traitée qu'une fois par modèle. Les pages
+blanches détectées dans l'index ne sont pas envoyées aux modèles ; avec
+`--blank-pages stub`, un résultat vide est enregistré à la place de l'appel.
+
+`--estimate` affiche le coût prévu de chaque modèle et du run sans lancer d'appel ;
+`--budget` impose un plafond de dépense : si la file ne tient pas dans le budget, les
+tâches sont choisies pour maximiser la couverture par dollar (voir `cost_estimator.py`).
+Avec `--screen` ou `--ledger`, le plafond s'applique aussi (à chaque worker pour `--ledger`),
+sans sélection préalable des tâches. `--replay` relance les appels du journal tels quels et
+refuse ces options ; combiné à `--tiling` ou `--preprocess`, il relance les échecs de ce run.
+
+Avec `--ledger`, plusieurs processus ou machines partageant un système de fichiers se
+répartissent la matrice via un registre SQLite à baux (voir `task_ledger.py`) : aucun
+appel n'est payé deux fois et un worker arrêté brutalement rend ses tâches aux autres.
+
+Avec `--trace`, chaque étape des appels (préparation de l'image, tarifs, requête,
+lecture de la réponse, écriture du résultat) est mesurée et ajoutée à un fichier JSONL ;
+`python tracing.py report` résume le temps passé par étape, modèle et fournisseur.
+
+Exemples :
+  python run_benchmark.py --concurrency 4 --provider-concurrency transkribus=1 openai=8
+  python run_benchmark.py --ledger /mnt/partage/benchmark_ledger.sqlite
+  python run_benchmark.py --replay
+  python run_benchmark.py --budget 2.5
+  python run_benchmark.py --screen --screen-pages 4 --max-wer 1.0
+"""
+
+import argparse
+import concurrent.futures
+import functools
+import json
+import random
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from tqdm import tqdm
+
+from api_clients import query_model
+from cost_estimator import BudgetExceededError, BudgetGuard, CostEstimator, format_forecast, plan_budget
+from failure_journal import FailureJournal
+from results_store import open_result_store, DEFAULT_DB_PATH, DEFAULT_RUN
+import screening
+from image_index import ImageIndex
+from preprocessing import PROFILES, RUN_PREFIX, query_preprocessed
+from tiling import DEFAULT_TILE_MAX_PIXELS, DEFAULT_TILE_WORKERS, TILED_RUN, transcribe_tiled
+from task_ledger import TaskLedger, LeaseHeartbeat, default_worker_id
+from tracing import TASK_SPAN, TRACE_FILE, configure as configure_tracing, span
+
+# Chemins des dossiers (identiques à ceux du notebook)
+RESULTS_DIR = Path("résultats")
+IMAGES_DIR = Path("images")
+MODELS_FILE = Path("models_to_test.json")
+
+# Nombre de requêtes simultanées par défaut pour chaque fournisseur
+DEFAULT_CONCURRENCY = 4
+
+# Intervalle (en secondes) entre deux interrogations du registre partagé
+LEDGER_POLL_INTERVAL = 5
+
+
+def get_model_metadata(model_id, model_type):
+    """Extract editor and model type from model ID and type"""
+    parts = model_id.split("/")
+    editor = parts[0]
+
+    # Map model type to French
+    model_type_fr = "libre" if model_type == "open" else "propriétaire"
+
+    return {
+        "editeur": editor,
+        "modele_type": model_type_fr
+    }
+
+
+def get_provider(model):
+    """Fournisseur d'un modèle, utilisé pour répartir les tâches entre les pools."""
+    return model.split("/")[0]
+
+
+def extract_transcription(response_data):
+    """Extract the transcription from the response based on format"""
+    if 'choices' in response_data and response_data['choices']:
+        return response_data['choices'][0]['message']['content']
+    elif 'result' in response_data:
+        # This is for Transkribus API / Kraken daemon format
+        return response_data['result']
+    raise Exception(f"Unexpected response format: {response_data}")
+
+
+def process_image(img_path, model_info, store, run=DEFAULT_RUN, query=query_model):
+    """
+    Traite une image avec un modèle donné et enregistre le résultat.
+
+    Le résultat est enregistré dans le store indexé (avec la réponse brute de l'API) ;
+    avec `--legacy-json`, le store l'écrit aussi dans `résultats/` au format historique.
+
+    Args:
+        img_path (Path): Chemin vers l'image
+        model_info: Couple (ID du modèle, type "open"/"proprietary") issu de models_to_test.json
+        store (ResultStore): Store indexé des résultats
+        run: Nom du run dans le store (les variantes, comme le découpage en tuiles, ont leur propre run)
+        query: Fonction d'appel du modèle, de même signature que `query_model`
+
+    Returns:
+        dict: Les données du résultat
+
+    Raises:
+        Exception: si l'appel au modèle échoue
+    """
+    model, model_type = model_info
+    model_meta = get_model_metadata(model, model_type)
+
+    # Intervalle racine de la tâche : les étapes de l'appel (tracing.py) en sont les enfants
+    with span(TASK_SPAN, model=model, provider=get_provider(model), image=img_path.stem, run=run) as task_span:
+        start_time = time.perf_counter()
+        response_data, cost = query(str(img_path), model)
+        latency = time.perf_counter() - start_time
+
+        transcription = extract_transcription(response_data)
+
+        # Get usage data with defaults if missing
+        usage_data = response_data.get('usage', {})
+        if not usage_data or not isinstance(usage_data, dict):
+            usage_data = {
+                'prompt_tokens': 0,
+                'completion_tokens': 0,
+                'total_tokens': 0
+            }
+
+        result_data = {
+            "model": model,
+            "editeur": model_meta["editeur"],
+            "modele_type": model_meta["modele_type"],
+            "image": str(img_path),
+            "result": transcription,
+            "timestamp": datetime.now().isoformat(),
+            "model_info": response_data.get('model_info', {}),
+            "usage": usage_data,
+            "latency": latency
+        }
+        task_span.set(cost=cost, prompt_tokens=usage_data.get('prompt_tokens'),
+                      completion_tokens=usage_data.get('completion_tokens'))
+
+        with span("result.write"):
+            store.put(result_data, run=run, raw_response=response_data)
+
+    return result_data
+
+
+def stub_blank_pages(images, models, store, run=DEFAULT_RUN):
+    """
+    Enregistre un résultat vide, sans appel ni coût, pour chaque couple (page blanche, modèle)
+    pas encore traité.
+
+    Returns:
+        int: Nombre de résultats enregistrés
+    """
+    done_pairs = store.completed_pairs(run)
+    stubbed = 0
+    for model, model_type in models:
+        model_meta = get_model_metadata(model, model_type)
+        for img_path in images:
+            if (img_path.stem, model) in done_pairs:
+                continue
+            result_data = {
+                "model": model,
+                "editeur": model_meta["editeur"],
+                "modele_type": model_meta["modele_type"],
+                "image": str(img_path),
+                "result": "",
+                "timestamp": datetime.now().isoformat(),
+                "model_info": {"id": model, "total_cost": 0.0, "skipped": "blank"},
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                "latency": 0.0
+            }
+            store.put(result_data, run=run)
+            stubbed += 1
+    return stubbed
+
+
+def load_models(models_file=MODELS_FILE):
+    """Charge la liste des couples (modèle, type) à tester."""
+    with open(models_file, "r") as f:
+        return [tuple(model_info) for model_info in json.load(f)]
+
+
+def list_images(images_dir=IMAGES_DIR):
+    """Liste les images à traiter (jpg et png), sous-dossiers compris."""
+    return sorted(list(images_dir.rglob("*.jpg")) + list(images_dir.rglob("*.png")))
+
+
+def completed_checker(store, run=DEFAULT_RUN, journal=None):
+    """
+    Prédicat `(chemin de l'image, modèle) -> bool` : le couple est déjà traité (sous ce nom
+    ou, d'après l'empreinte de son contenu, sous un autre) ou, si un journal est fourni,
+    son échec est permanent.
+    """
+    done_pairs = store.completed_pairs(run)
+    if journal is not None:
+        done_pairs |= journal.permanent_pairs(run)
+    done_hashes = store.completed_hashes(run)
+
+    def is_completed(img_path, model):
+        return ((img_path.stem, model) in done_pairs
+                or (store.image_hashes.get(img_path.stem), model) in done_hashes)
+    return is_completed
+
+
+def build_task_queue(images, models, store, journal=None, run=DEFAULT_RUN):
+    """
+    Étend images × modèles en une file de tâches, en ignorant les couples déjà traités
+    (voir `completed_checker`) et ceux dont l'échec est permanent d'après le journal.
+
+    Returns:
+        tuple: (tâches restantes, nombre de couples déjà traités ou ignorés)
+    """
+    is_completed = completed_checker(store, run, journal)
+    tasks = []
+    completed = 0
+    for model_info in models:
+        for img_path in images:
+            if is_completed(img_path, model_info[0]):
+                completed += 1
+            else:
+                tasks.append((img_path, model_info))
+    # Mélange aléatoire pour éviter les biais (comme dans le notebook)
+    random.shuffle(tasks)
+    return tasks, completed
+
+
+def run_tasks(tasks, store, concurrency=DEFAULT_CONCURRENCY, provider_concurrency=None, journal=None, budget=None,
+              run=DEFAULT_RUN, query=query_model):
+    """
+    Exécute les tâches avec un pool de threads par fournisseur, tous actifs en parallèle.
+
+    Au sein d'un fournisseur, les tâches sont lancées dans l'ordre de la liste.
+
+    Args:
+        tasks: Liste de couples (image, (modèle, type))
+        store: Store indexé des résultats
+        journal: Journal des échecs (optionnel)
+        concurrency: Nombre de requêtes simultanées par défaut pour un fournisseur
+        provider_concurrency: Dictionnaire {fournisseur: nombre de requêtes simultanées}
+        budget (BudgetGuard): Plafond de dépense (optionnel) ; les appels qui le
+            dépasseraient ne sont pas lancés
+        run: Nom du run dans le store
+        query: Fonction d'appel du modèle (voir `process_image`)
+
+    Returns:
+        list: Les résultats obtenus
+    """
+    provider_concurrency = provider_concurrency or {}
+    providers = sorted({get_provider(model_info[0]) for _, model_info in tasks})
+    executors = {
+        provider: concurrent.futures.ThreadPoolExecutor(
+            max_workers=provider_concurrency.get(provider, concurrency),
+            thread_name_prefix=f"htr-{provider}"
+        )
+        for provider in providers
+    }
+
+    results = []
+    stats = Counter()
+    try:
+        future_to_task = {}
+        for img_path, model_info in tasks:
+            executor = executors[get_provider(model_info[0])]
+            if budget is None:
+                future = executor.submit(process_image, img_path, model_info, store, run, query)
+            else:
+                future = executor.submit(budget.call, img_path, model_info[0], process_image, img_path, model_info,
+                                         store, run, query)
+            future_to_task[future] = (img_path, model_info)
+        with tqdm(total=len(future_to_task), desc="Benchmark", unit="page") as progress:
+            for future in concurrent.futures.as_completed(future_to_task):
+                img_path, model_info = future_to_task[future]
+                try:
+                    results.append(future.result())
+                    stats["ok"] += 1
+                    if journal is not None:
+                        journal.resolve(img_path, model_info[0], run=run)
+                except BudgetExceededError:
+                    stats["hors budget"] += 1
+                except Exception as e:
+                    stats["erreurs"] += 1
+                    error_class = (journal.record_failure(img_path, model_info[0], e, model_info[1], run=run)
+                                   if journal else None)
+                    tqdm.write(f"Error processing {img_path} with {model_info[0]}: {str(e)}"
+                               + (f" [{error_class}]" if error_class else ""))
+                progress.set_postfix(stats)
+                progress.update(1)
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True, cancel_futures=True)
+    return results
+
+
+def run_ledger_tasks(ledger, store, images, models, concurrency=DEFAULT_CONCURRENCY,
+                     provider_concurrency=None, worker_id=None, journal=None, budget=None,
+                     run=DEFAULT_RUN, query=query_model):
+    """
+    Vide la matrice (image × modèle) en coopération avec les autres workers du registre.
+
+    Chaque fournisseur garde au plus `concurrency` tâches à bail à la fois ; les
+    tâches sont prises au fil de l'eau et leurs baux prolongés tant que le worker vit.
+    Avec un budget (`BudgetGuard`, propre à ce worker), le worker cesse de prendre des
+    tâches dès qu'un appel n'y tient plus et rend cette tâche aux autres workers.
+
+    Returns:
+        list: Les résultats obtenus par ce worker
+    """
+    worker_id = worker_id or default_worker_id()
+    provider_concurrency = provider_concurrency or {}
+    # Tâches désignées comme dans le store : par le nom de l'image sans extension
+    images_by_stem = {}
+    for img_path in images:
+        other = images_by_stem.setdefault(img_path.stem, img_path)
+        if other != img_path:
+            raise ValueError(f"Deux images distinctes portent le même nom : {other} et {img_path} ; "
+                             "renommez l'une d'elles avant de lancer le registre")
+    models_by_id = {model_info[0]: model_info for model_info in models}
+    providers = sorted({get_provider(model) for model in models_by_id})
+
+    # Une page déjà traitée sous un autre nom (même contenu) n'est pas payée une seconde fois
+    # (les échecs permanents du journal ne sont pas relancés non plus)
+    is_completed = completed_checker(store, run, journal)
+    ledger.add_tasks(
+        [(stem, model) for model in models_by_id for stem in images_by_stem],
+        done_pairs=[
+            (stem, model) for model in models_by_id for stem, img_path in images_by_stem.items()
+            if is_completed(img_path, model)
+        ],
+        run=run
+    )
+
+    limits = {provider: provider_concurrency.get(provider, concurrency) for provider in providers}
+    executors = {
+        provider: concurrent.futures.ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f"htr-{provider}")
+        for provider, limit in limits.items()
+    }
+    in_flight = {}
+    results = []
+    stats = Counter()
+    out_of_budget = False
+    print(f"Worker {worker_id} : {ledger.remaining(images_by_stem, models_by_id, run)} tâches restantes "
+          f"dans le registre (run {run})")
+
+    try:
+        with LeaseHeartbeat(ledger, worker_id), tqdm(desc="Benchmark", unit="page") as progress:
+            while True:
+                busy = Counter(provider for _, _, provider in in_flight.values())
+                for provider in providers:
+                    if out_of_budget:
+                        break
+                    free = limits[provider] - busy[provider]
+                    claimed = ledger.claim(worker_id, free, provider=provider,
+                                           images=images_by_stem, models=models_by_id, run=run)
+                    for image, model in claimed:
+                        if image not in images_by_stem or model not in models_by_id:
+                            # Tâche hors du périmètre de ce worker : la rendre sans compter de tentative
+                            ledger.release(image, model, worker_id, count_attempt=False, run=run)
+                            continue
+                        if budget is None:
+                            future = executors[provider].submit(process_image, images_by_stem[image],
+                                                                models_by_id[model], store, run, query)
+                        else:
+                            future = executors[provider].submit(budget.call, images_by_stem[image], model,
+                                                                process_image, images_by_stem[image],
+                                                                models_by_id[model], store, run, query)
+                        in_flight[future] = (image, model, provider)
+
+                if not in_flight:
+                    if out_of_budget or ledger.remaining(images_by_stem, models_by_id, run) == 0:
+                        break
+                    # Les tâches restantes sont à bail chez d'autres workers : attendre
+                    # qu'elles se terminent ou que leur bail expire
+                    time.sleep(LEDGER_POLL_INTERVAL)
+                    continue
+
+                done, _ = concurrent.futures.wait(
+                    in_flight, timeout=LEDGER_POLL_INTERVAL, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    image, model, _ = in_flight.pop(future)
+                    try:
+                        results.append(future.result())
+                        ledger.complete(image, model, worker_id, run)
+                        stats["ok"] += 1
+                        if journal is not None:
+                            journal.resolve(images_by_stem[image], model, run=run)
+                    except BudgetExceededError:
+                        # Appel non lancé : la tâche revient aux autres workers sans tentative comptée
+                        ledger.release(image, model, worker_id, count_attempt=False, run=run)
+                        out_of_budget = True
+                        stats["hors budget"] += 1
+                    except Exception as e:
+                        ledger.release(image, model, worker_id, error=str(e), run=run)
+                        if journal is not None:
+                            journal.record_failure(images_by_stem[image], model, e, models_by_id[model][1], run=run)
+                        stats["erreurs"] += 1
+                        tqdm.write(f"Error processing {image} with {model}: {str(e)}")
+                    progress.set_postfix(stats)
+                    progress.update(1)
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True, cancel_futures=True)
+    return results
+
+
+def replay_failures(journal, store, models, concurrency=DEFAULT_CONCURRENCY, provider_concurrency=None,
+                    run=DEFAULT_RUN, query=query_model):
+    """
+    Relance uniquement les échecs transitoires d'un run du journal, au rythme de leur backoff,
+    avec la fonction d'appel de ce run (découpage, prétraitement...).
+
+    La boucle s'arrête lorsque plus aucun échec n'est relançable (succès, erreur
+    permanente ou nombre maximal de tentatives atteint).
+
+    Returns:
+        list: Les résultats obtenus
+    """
+    model_types = dict(models)
+    results = []
+    while True:
+        due = journal.due(run)
+        if not due:
+            pending = journal.retryable(run)
+            if not pending:
+                break
+            wait = max(0, pending[0]["next_retry_at"] - time.time())
+            print(f"{len(pending)} échecs en attente de relance, prochaine tentative dans {wait:.0f} s")
+            time.sleep(wait)
+            continue
+
+        tasks = [
+            (Path(row["image_path"]), (row["model"], row["model_type"] or model_types.get(row["model"], "proprietary")))
+            for row in due
+        ]
+        print(f"Relance de {len(tasks)} appels en échec")
+        results.extend(run_tasks(tasks, store, concurrency, provider_concurrency, journal, run=run, query=query))
+    return results
+
+
+def run_screening(args, images, models, store, journal, provider_concurrency, budget=None):
+    """Lance la présélection des modèles et écrit son rapport (sous un budget commun à tous les tours)."""
+    def run_round(sample, round_models):
+        tasks, _ = build_task_queue(sample, round_models, store, journal)
+        if tasks:
+            run_tasks(tasks, store, args.concurrency, provider_concurrency, journal, budget)
+
+    settings = {
+        "pages du premier tour": args.screen_pages,
+        "croissance": args.screen_growth,
+        "WER médian max": args.max_wer,
+        "marge": args.margin,
+        "z": args.z,
+        "fraction conservée": args.keep_fraction,
+        "modèles minimum": args.min_models,
+    }
+    start_time = time.perf_counter()
+    rounds = screening.run_screening(
+        images, models, store, run_round, initial_pages=args.screen_pages, growth=args.screen_growth,
+        max_wer=args.max_wer, margin=args.margin, z=args.z, keep_fraction=args.keep_fraction,
+        min_models=args.min_models, seed=args.seed
+    )
+    if rounds:
+        screening.write_screening_report(rounds, store, len(images), settings, args.screen_report)
+    print(f"Présélection terminée en {time.perf_counter() - start_time:.1f} s")
+
+
+def forecast_costs(args, tasks, store):
+    """
+    Affiche le coût prévu d'une file de tâches (`--estimate`, `--budget`).
+
+    Returns:
+        dict: Estimation par couple (image, modèle), voir `CostEstimator.estimate_tasks`
+    """
+    estimates = CostEstimator(store, output_tokens=args.output_tokens).estimate_tasks(tasks)
+    print(format_forecast(tasks, estimates))
+    return estimates
+
+
+def parse_provider_concurrency(values):
+    """Convertit des arguments `fournisseur=N` en dictionnaire."""
+    concurrency = {}
+    for value in values or []:
+        provider, _, count = value.partition("=")
+        if not count:
+            raise argparse.ArgumentTypeError(f"Format attendu fournisseur=N, reçu : {value}")
+        concurrency[provider] = int(count)
+    return concurrency
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Exécute le benchmark HTR sur models_to_test.json × images/.")
+    parser.add_argument("--models-file", type=Path, default=MODELS_FILE, help="Fichier JSON des modèles à tester")
+    parser.add_argument("--images-dir", type=Path, default=IMAGES_DIR, help="Dossier des images")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="Requêtes simultanées par fournisseur (défaut : %(default)s)")
+    parser.add_argument("--provider-concurrency", nargs="*", metavar="FOURNISSEUR=N",
+                        help="Concurrence propre à certains fournisseurs, ex. transkribus=1 google=8")
+    parser.add_argument("--db", type=Path, default=DEFAULT_DB_PATH, help="Store indexé des résultats (SQLite)")
+    parser.add_argument("--legacy-json", action="store_true",
+                        help="Écrire aussi chaque résultat du run par défaut dans résultats/ (format historique)")
+    parser.add_argument("--replay", action="store_true",
+                        help="Relancer uniquement les appels en échec consignés dans le journal")
+    parser.add_argument("--ledger", type=Path,
+                        help="Registre SQLite partagé pour répartir le travail entre plusieurs workers")
+    parser.add_argument("--worker-id", help="Identifiant de ce worker dans le registre (défaut : machine-pid)")
+
+    parser.add_argument("--estimate", action="store_true",
+                        help="Afficher le coût prévu de la file de tâches sans lancer d'appel")
+    parser.add_argument("--budget", type=float, metavar="USD",
+                        help="Plafond de dépense du run en dollars (avec --ledger : de ce worker)")
+    parser.add_argument("--output-tokens", type=int,
+                        help="Tokens de sortie attendus par page (défaut : médiane de l'historique du modèle)")
+
+    tiling = parser.add_argument_group("découpage en tuiles (--tiling)")
+    tiling.add_argument("--tiling", action="store_true",
+                        help="Transcrire chaque page par colonnes et blocs de texte, en parallèle (run `tiled`)")
+    tiling.add_argument("--tile-max-pixels", type=int, default=DEFAULT_TILE_MAX_PIXELS,
+                        help="Pixels au plus par tuile dans l'image d'origine (défaut : %(default)s)")
+    tiling.add_argument("--tile-workers", type=int, default=DEFAULT_TILE_WORKERS,
+                        help="Tuiles d'une même page envoyées simultanément (défaut : %(default)s)")
+
+    parser.add_argument("--trace", type=Path, nargs="?", const=TRACE_FILE, metavar="FICHIER",
+                        help="Trace chaque étape des appels dans un fichier JSONL (défaut : %(const)s ; "
+                             "voir tracing.py)")
+    parser.add_argument("--blank-pages", choices=["skip", "stub", "send"], default="skip",
+                        help="Pages blanches de l'index : ignorées, résultat vide enregistré sans appel, "
+                             "ou envoyées comme les autres (défaut : %(default)s)")
+    parser.add_argument("--preprocess", choices=sorted(PROFILES) + ["auto"], metavar="PROFIL",
+                        help="Prétraiter les pages avant l'envoi : profil forcé ou `auto` pour le profil "
+                             "de chaque modèle (run `preprocess-<profil>`)")
+
+    screen = parser.add_argument_group("présélection (--screen)")
+    screen.add_argument("--screen", action="store_true",
+                        help="Présélectionner les modèles par tours successifs avant le corpus complet")
+    screen.add_argument("--screen-pages", type=int, default=screening.DEFAULT_INITIAL_PAGES,
+                        help="Pages du premier tour (défaut : %(default)s)")
+    screen.add_argument("--screen-growth", type=int, default=screening.DEFAULT_GROWTH,
+                        help="Facteur de croissance de l'échantillon par tour (défaut : %(default)s)")
+    screen.add_argument("--max-wer", type=float, default=screening.DEFAULT_MAX_WER,
+                        help="WER médian au-delà duquel un modèle est éliminé (défaut : %(default)s)")
+    screen.add_argument("--margin", type=float, default=screening.DEFAULT_MARGIN,
+                        help="Écart de WER toléré par rapport au meilleur modèle (défaut : %(default)s)")
+    screen.add_argument("--z", type=float, default=screening.DEFAULT_Z,
+                        help="Nombre d'erreurs types du test d'écart (défaut : %(default)s)")
+    screen.add_argument("--keep-fraction", type=float, default=screening.DEFAULT_KEEP_FRACTION,
+                        help="Fraction des modèles promus à chaque tour, 1.0 pour aucun plafond (défaut : %(default)s)")
+    screen.add_argument("--min-models", type=int, default=screening.DEFAULT_MIN_MODELS,
+                        help="Nombre minimal de modèles promus à chaque tour (défaut : %(default)s)")
+    screen.add_argument("--seed", type=int, default=0, help="Graine du tirage de l'échantillon")
+    screen.add_argument("--screen-report", type=Path, default=screening.REPORT_FILE,
+                        help="Rapport de présélection (défaut : %(default)s)")
+    args = parser.parse_args()
+    if args.tiling and args.preprocess:
+        parser.error("--tiling et --preprocess ne peuvent pas être combinés")
+    modes = [option for option, enabled in (("--replay", args.replay), ("--screen", args.screen),
+                                            ("--ledger", args.ledger)) if enabled]
+    if len(modes) > 1:
+        parser.error(f"{' et '.join(modes)} ne peuvent pas être combinés")
+    # La relance reprend les appels du journal tels quels (dans le run choisi par --tiling ou
+    # --preprocess) ; la présélection compare les modèles sur le run par défaut
+    if args.replay:
+        unsupported = [option for option, enabled in (
+            ("--budget", args.budget is not None), ("--estimate", args.estimate),
+            ("--blank-pages stub", args.blank_pages == "stub")) if enabled]
+        if unsupported:
+            parser.error(f"--replay ne peut pas être combiné avec {', '.join(unsupported)}")
+    if args.screen and (args.tiling or args.preprocess):
+        parser.error("--screen ne peut pas être combiné avec --tiling ou --preprocess")
+    return args
+
+
+def main():
+    args = parse_args()
+    RESULTS_DIR.mkdir(exist_ok=True)
+    if args.trace:
+        configure_tracing(args.trace)
+
+    models = load_models(args.models_file)
+    images = list_images(args.images_dir)
+    provider_concurrency = parse_provider_concurrency(args.provider_concurrency)
+    store = open_result_store(args.db, RESULTS_DIR, legacy_json=args.legacy_json)
+    journal = FailureJournal(args.db)
+
+    # Indexation des images : une page présente sous plusieurs noms n'est traitée qu'une fois,
+    # et les pages blanches sont détectées avant toute répartition des tâches
+    index = ImageIndex()
+    index.update(images)
+    images, duplicates = index.distinct(images)
+    for img_path, image_name in duplicates:
+        print(f"{img_path} : copie de la page {image_name}, ignorée")
+    store.set_image_hashes(index.hashes())
+    blank_pages = [img_path for img_path in images if index.is_blank(img_path.stem)]
+    if blank_pages and args.blank_pages != "send":
+        images = [img_path for img_path in images if not index.is_blank(img_path.stem)]
+        print(f"{len(blank_pages)} page(s) blanche(s) non envoyée(s) aux modèles : "
+              f"{', '.join(img_path.stem for img_path in blank_pages)}")
+
+    run, query = DEFAULT_RUN, query_model
+    if args.tiling:
+        run = TILED_RUN
+        query = functools.partial(transcribe_tiled, max_workers=args.tile_workers, max_tile_pixels=args.tile_max_pixels)
+    elif args.preprocess:
+        run = RUN_PREFIX + args.preprocess
+        query = functools.partial(query_preprocessed, profile=None if args.preprocess == "auto" else args.preprocess)
+
+    if args.replay:
+        results = replay_failures(journal, store, models, args.concurrency, provider_concurrency, run, query)
+        print(f"Relance terminée ({run}) : {len(results)} résultats obtenus, "
+              f"échecs restants par classe : {journal.stats(run) or 'aucun'}")
+        return
+
+    if blank_pages and args.blank_pages == "stub":
+        print(f"{stub_blank_pages(blank_pages, models, store, run)} résultats vides enregistrés pour les pages blanches")
+
+    tasks, completed = build_task_queue(images, models, store, journal, run)
+
+    if args.screen or args.ledger:
+        # La présélection et le registre choisissent leurs tâches au fil de l'eau : la prévision
+        # porte sur toute la file, et le budget est un plafond de dépense sans sélection préalable
+        budget = None
+        if tasks and (args.estimate or args.budget is not None):
+            estimates = forecast_costs(args, tasks, store)
+            if args.estimate:
+                return
+            budget = BudgetGuard(args.budget, estimates)
+
+        start_time = time.perf_counter()
+        if args.screen:
+            run_screening(args, images, models, store, journal, provider_concurrency, budget)
+        else:
+            results = run_ledger_tasks(TaskLedger(args.ledger), store, images, models, args.concurrency,
+                                       provider_concurrency, args.worker_id, journal, budget, run, query)
+            print(f"Traitement terminé : {len(results)} résultats obtenus par ce worker "
+                  f"en {time.perf_counter() - start_time:.1f} s")
+        if budget is not None:
+            print(f"Dépense réelle : {budget.spent:.4f} $ sur un budget de {budget.budget:.4f} $")
+        return
+
+    print(f"{len(images)} images × {len(models)} modèles : "
+          f"{completed} couples déjà traités ou en échec permanent, {len(tasks)} à traiter")
+    if not tasks:
+        return
+
+    budget = None
+    if args.estimate or args.budget is not None:
+        estimates = forecast_costs(args, tasks, store)
+        if args.estimate:
+            return
+        tasks, skipped, planned = plan_budget(tasks, estimates, args.budget)
+        print(f"Budget de {args.budget:.4f} $ : {len(tasks)} tâches retenues pour un coût prévu de {planned:.4f} $, "
+              f"{len(skipped)} écartées")
+        budget = BudgetGuard(args.budget, estimates)
+
+    start_time = time.perf_counter()
+    results = run_tasks(tasks, store, args.concurrency, provider_concurrency, journal, budget, run, query)
+    elapsed = time.perf_counter() - start_time
+
+    print(f"Traitement terminé : {len(results)} résultats obtenus en {elapsed:.1f} s "
+          f"({len(results) / elapsed * 60:.1f} pages/min)")
+    if budget is not None:
+        print(f"Dépense réelle : {budget.spent:.4f} $ sur un budget de {budget.budget:.4f} $")
+
+
+if __name__ == "__main__":
+    main()
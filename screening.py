@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Présélection des modèles par élimination successive (« successive halving »).
+
+Tous les modèles sont d'abord évalués sur un petit échantillon de pages, stratifié par
+document source. À chaque tour, le WER de chaque modèle est calculé avec
+`metrics.calculate_wer` et seuls les modèles encore compétitifs sont promus sur un
+échantillon plus grand (les pages des tours précédents sont conservées). Un modèle est
+éliminé lorsque :
+  - son WER médian dépasse un seuil absolu (`max_wer`) ;
+  - il est significativement moins bon que le meilleur modèle : la borne basse de
+    l'écart de WER apparié (page par page) dépasse la marge tolérée (`margin`) ;
+  - il ne fait pas partie de la meilleure fraction (`keep_fraction`) des modèles du tour,
+    sans être statistiquement à égalité avec le meilleur ;
+  - aucune de ses transcriptions n'a pu être évaluée.
+
+Seules les pages qui ont une référence servent à départager les modèles. Le dernier tour
+porte sur toutes ces pages ; les modèles retenus transcrivent ensuite les pages sans
+référence, pour que leurs résultats couvrent tout le corpus. Le rapport `rapports/screening.md` détaille
+les décisions de chaque tour et les appels évités.
+
+Le mode est lancé depuis le runner : `python run_benchmark.py --screen`.
+"""
+
+import json
+import math
+import random
+import statistics
+from datetime import datetime
+from pathlib import Path
+
+from metrics import calculate_wer, clean_text_for_wer
+
+REFERENCE_DIR = Path("transcriptions_de_référence")
+REPORT_FILE = Path("rapports") / "screening.md"
+
+# Nombre de pages du premier tour
+DEFAULT_INITIAL_PAGES = 4
+# Facteur de croissance de l'échantillon d'un tour au suivant
+DEFAULT_GROWTH = 2
+# WER médian au-delà duquel un modèle est éliminé
+DEFAULT_MAX_WER = 1.0
+# Écart de WER (page par page) toléré par rapport au meilleur modèle
+DEFAULT_MARGIN = 0.1
+# Plafond du WER d'une page dans le test d'écart : au-delà, la transcription est
+# inexploitable quel que soit son WER, et quelques hallucinations extrêmes (WER > 50)
+# ne doivent pas masquer l'écart sur les autres pages
+WER_CAP = 1.0
+# Seuil unilatéral du test d'écart (1.645 ≈ 95 %)
+DEFAULT_Z = 1.645
+# Fraction des modèles conservée à chaque tour (1.0 : pas de plafond)
+DEFAULT_KEEP_FRACTION = 0.5
+# Nombre minimal de modèles promus à chaque tour
+DEFAULT_MIN_MODELS = 3
+
+
+def document_key(image_name):
+    """Document source d'une page (`<document>_page_<n>` -> `<document>`)."""
+    return image_name.rsplit("_page_", 1)[0]
+
+
+def stratified_order(images, seed=0):
+    """
+    Ordonne les images de sorte que tout préfixe de la liste soit un échantillon
+    stratifié par document : les documents sont parcourus à tour de rôle et les
+    pages de chaque document sont tirées au hasard.
+    """
+    rng = random.Random(seed)
+    by_document = {}
+    for img_path in sorted(images):
+        by_document.setdefault(document_key(img_path.stem), []).append(img_path)
+    groups = list(by_document.values())
+    for pages in groups:
+        rng.shuffle(pages)
+    rng.shuffle(groups)
+
+    ordered = []
+    while groups:
+        for pages in groups:
+            ordered.append(pages.pop())
+        groups = [pages for pages in groups if pages]
+    return ordered
+
+
+def load_reference(image_name, reference_dir=REFERENCE_DIR):
+    """Transcription de référence d'une page, ou None si elle est absente."""
+    ref_file = Path(reference_dir) / f"{image_name}.md"
+    if not ref_file.exists():
+        return None
+    ref_content = ref_file.read_text(encoding="utf-8").strip()
+    try:
+        return json.loads(ref_content).get("result", ref_content)
+    except (json.JSONDecodeError, AttributeError):
+        return ref_content
+
+
+def load_references(images, reference_dir=REFERENCE_DIR):
+    """
+    Références des pages évaluables : les pages sans référence, ou dont la
+    référence est vide (page blanche), ne permettent pas de départager les modèles.
+    """
+    references = {}
+    for img_path in images:
+        reference = load_reference(img_path.stem, reference_dir)
+        if reference and clean_text_for_wer(reference):
+            references[img_path.stem] = reference
+    return references
+
+
+def score_models(store, models, images, references):
+    """
+    WER de chaque modèle sur chaque page pour laquelle un résultat existe.
+
+    Returns:
+        dict: {modèle: {image: WER}}
+    """
+    names = {img_path.stem for img_path in images}
+    scores = {}
+    for model in models:
+        scores[model] = {}
+        for record in store.iter_records(model=model):
+            image = record["image_name"]
+            if image in names and image in references:
+                scores[model][image] = calculate_wer(references[image], record["result"] or "")
+    return scores
+
+
+def paired_gap(scores, model, best):
+    """
+    Écart de WER apparié entre un modèle et le meilleur, sur leurs pages communes
+    (WER plafonné à `WER_CAP`).
+
+    Returns:
+        tuple: (écart moyen, erreur type, nombre de pages communes)
+    """
+    common = sorted(set(scores[model]) & set(scores[best]))
+    diffs = [min(scores[model][image], WER_CAP) - min(scores[best][image], WER_CAP) for image in common]
+    if not diffs:
+        return None, math.inf, 0
+    if len(diffs) < 2:
+        return diffs[0], math.inf, 1
+    return statistics.mean(diffs), statistics.stdev(diffs) / math.sqrt(len(diffs)), len(diffs)
+
+
+def screen_round(scores, max_wer=DEFAULT_MAX_WER, margin=DEFAULT_MARGIN, z=DEFAULT_Z,
+                 keep_fraction=DEFAULT_KEEP_FRACTION, min_models=DEFAULT_MIN_MODELS, final=False):
+    """
+    Décide, pour chaque modèle évalué dans un tour, s'il est promu ou éliminé.
+
+    Returns:
+        list: Une ligne par modèle (dictionnaire), du meilleur au moins bon
+    """
+    rows = []
+    for model, page_scores in scores.items():
+        values = list(page_scores.values())
+        rows.append({
+            "model": model,
+            "pages": len(values),
+            "median": statistics.median(values) if values else None,
+            "mean": statistics.mean(values) if values else None,
+            "gap": None,
+            "stderr": None,
+            "promoted": True,
+            "reason": "",
+        })
+    rows.sort(key=lambda row: (row["median"] is None, row["median"] or 0.0, row["mean"] or 0.0))
+
+    scored = [row for row in rows if row["pages"]]
+    best = scored[0]["model"] if scored else None
+    for row in rows:
+        if not row["pages"]:
+            row["promoted"] = False
+            row["reason"] = "aucune transcription évaluée"
+            continue
+        if row["model"] != best:
+            row["gap"], row["stderr"], _ = paired_gap(scores, row["model"], best)
+        if final:
+            continue
+        if row["median"] > max_wer:
+            row["promoted"] = False
+            row["reason"] = f"WER médian {row['median']:.3f} > {max_wer:.3f}"
+        elif row["gap"] is not None and row["gap"] - z * row["stderr"] > margin:
+            row["promoted"] = False
+            row["reason"] = (f"moins bon que {best} : écart {row['gap']:+.3f} ± {row['stderr']:.3f} "
+                             f"(marge {margin:.3f})")
+
+    if not final:
+        survivors = [row for row in rows if row["promoted"]]
+        quota = max(min_models, math.ceil(len(scored) * keep_fraction))
+        for rank, row in enumerate(survivors):
+            # Un modèle statistiquement à égalité avec le meilleur n'est jamais écarté par le plafond
+            tied = row["gap"] is None or row["gap"] - z * row["stderr"] <= 0
+            if rank >= quota and not tied:
+                row["promoted"] = False
+                row["reason"] = f"hors des {quota} meilleurs modèles du tour"
+    return rows
+
+
+def run_screening(images, models, store, run_round, reference_dir=REFERENCE_DIR,
+                  initial_pages=DEFAULT_INITIAL_PAGES, growth=DEFAULT_GROWTH, max_wer=DEFAULT_MAX_WER,
+                  margin=DEFAULT_MARGIN, z=DEFAULT_Z, keep_fraction=DEFAULT_KEEP_FRACTION,
+                  min_models=DEFAULT_MIN_MODELS, seed=0):
+    """
+    Exécute la présélection par tours successifs.
+
+    Args:
+        images: Images du corpus
+        models: Couples (ID du modèle, type) à évaluer
+        store: Store indexé des résultats (les résultats existants sont réutilisés)
+        run_round: Fonction (images, modèles) qui lance les appels manquants d'un tour
+            (appelée une dernière fois avec les pages sans référence et les modèles retenus)
+
+    Returns:
+        list: Les tours, chacun sous la forme {"pages": [...], "rows": [...]}
+    """
+    references = load_references(images, reference_dir)
+    ordered = [img_path for img_path in stratified_order(images, seed) if img_path.stem in references]
+    if not ordered:
+        print(f"Aucune page avec une référence dans '{reference_dir}' : présélection impossible")
+        return []
+
+    alive = list(models)
+    size = min(initial_pages, len(ordered))
+    rounds = []
+    while True:
+        sample = ordered[:size]
+        final = size >= len(ordered)
+        print(f"Tour {len(rounds) + 1} : {len(alive)} modèles × {len(sample)} pages"
+              + (" (corpus complet)" if final else ""))
+        run_round(sample, alive)
+
+        scores = score_models(store, [model for model, _ in alive], sample, references)
+        rows = screen_round(scores, max_wer, margin, z, keep_fraction, min_models, final)
+        rounds.append({"pages": [img_path.stem for img_path in sample], "rows": rows, "final": final})
+        if final:
+            break
+
+        promoted = {row["model"] for row in rows if row["promoted"]}
+        for row in rows:
+            if not row["promoted"]:
+                print(f"  éliminé : {row['model']} ({row['reason']})")
+        alive = [model_info for model_info in alive if model_info[0] in promoted]
+        if not alive:
+            break
+        size = len(ordered) if len(alive) <= min_models else min(len(ordered), size * growth)
+
+    retained = []
+    if rounds[-1]["final"]:
+        kept = {row["model"] for row in rounds[-1]["rows"] if row["promoted"]}
+        retained = [model_info for model_info in alive if model_info[0] in kept]
+    unreferenced = [img_path for img_path in images if img_path.stem not in references]
+    if retained and unreferenced:
+        print(f"Pages sans référence : {len(retained)} modèles retenus × {len(unreferenced)} pages")
+        run_round(unreferenced, retained)
+    return rounds
+
+
+def _format(value, pattern="{:.3f}"):
+    return "-" if value is None else pattern.format(value)
+
+
+def write_screening_report(rounds, store, total_pages, settings, output_file=REPORT_FILE):
+    """
+    Écrit le rapport de présélection : décisions par tour et appels évités.
+
+    Le coût évité est estimé à partir du coût moyen par page déjà observé pour le modèle.
+    """
+    output_file = Path(output_file)
+    output_file.parent.mkdir(exist_ok=True)
+    lines = [
+        "# Présélection des modèles par élimination successive",
+        "",
+        f"Généré le {datetime.now().strftime('%d/%m/%Y à %H:%M:%S')}",
+        "",
+        "Paramètres : " + ", ".join(f"{name} = {value}" for name, value in settings.items()),
+        "",
+    ]
+
+    pruned = []
+    for number, screening_round in enumerate(rounds, start=1):
+        lines += [
+            f"## Tour {number} ({len(screening_round['pages'])} pages)",
+            "",
+            "| Modèle | Pages évaluées | WER médian | WER moyen | Écart au meilleur | Décision | Motif |",
+            "|--------|----------------|------------|-----------|-------------------|----------|-------|",
+        ]
+        for row in screening_round["rows"]:
+            gap = "-" if row["gap"] is None else f"{row['gap']:+.3f} ± {_format(row['stderr'])}"
+            decision = "éliminé" if not row["promoted"] else "retenu" if screening_round["final"] else "promu"
+            lines.append(f"| {row['model']} | {row['pages']} | {_format(row['median'])} | {_format(row['mean'])} | "
+                         f"{gap} | {decision} | {row['reason']} |")
+            if not row["promoted"]:
+                pruned.append((number, len(screening_round["pages"]), row))
+        lines.append("")
+
+    lines += [
+        "## Modèles éliminés",
+        "",
+        "| Modèle | Tour | Pages évitées | Coût évité estimé ($) | Motif |",
+        "|--------|------|---------------|-----------------------|-------|",
+    ]
+    total_avoided = 0
+    total_saved = 0.0
+    for number, pages_seen, row in pruned:
+        costs = [record["cost"] for record in store.iter_records(model=row["model"])]
+        avoided = max(0, total_pages - pages_seen)
+        saved = avoided * statistics.mean(costs) if costs else 0.0
+        total_avoided += avoided
+        total_saved += saved
+        lines.append(f"| {row['model']} | {number} | {avoided} | {saved:.4f} | {row['reason']} |")
+    lines += [
+        "",
+        f"**Total : {len(pruned)} modèles éliminés, {total_avoided} appels évités, "
+        f"environ {total_saved:.4f} $ économisés.**",
+        "",
+        "L'écart au meilleur est la moyenne, sur les pages communes, de la différence de WER entre "
+        "le modèle et le meilleur modèle du tour (± erreur type), le WER de chaque page étant plafonné "
+        f"à {WER_CAP}. Un modèle est éliminé lorsque "
+        "cet écart reste supérieur à la marge tolérée même diminué de z erreurs types.",
+    ]
+
+    output_file.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    print(f"Rapport de présélection écrit dans '{output_file}'")
@@ -5,20 +5,28 @@
 Script pour générer un tableau comparatif des performances des modèles HTR par page.
 Ce script analyse les résultats dans le dossier 'résultats' et génère un tableau
 au format Markdown et HTML montrant le WER pour chaque modèle et chaque image.
+
+Le Markdown est écrit ligne par ligne. Le rapport HTML embarque la matrice en JSON compact
+et l'affiche dans un tableau virtualisé (triable, filtrable) : il reste léger et rapide à
+ouvrir avec des milliers de pages. `--styled` produit l'ancien rapport mis en forme par
+pandas, avec toute la matrice dans la page.
+
+  python scripts/generate_performance_table.py [--styled]
 """
 
+import argparse
 import os
 import json
 import re
 from pathlib import Path
-import pandas as pd
-import numpy as np
 import datetime
 import sys
 
 # Add the parent directory to sys.path to import utils
 sys.path.append(str(Path(__file__).parent.parent))
 from utils import calculate_wer
+from results_store import open_result_store
+from image_index import ImageIndex
 
 # Chemins des dossiers
 RESULTS_DIR = Path("./résultats")
@@ -53,6 +61,186 @@ PAGE_DESCRIPTIONS = {
 # Description par défaut pour les pages sans description spécifique
 DEFAULT_PAGE_DESCRIPTION = "Document d'archives historiques"
 
+# Décimales des WER dans les données JSON du rapport HTML
+WER_JSON_DECIMALS = 4
+
+# Rapport HTML virtualisé : la matrice est embarquée en JSON (`__DATA__`) et seules les lignes
+# visibles sont créées dans la page, quelle que soit la taille du corpus
+VIRTUAL_HTML_TEMPLATE = """<!DOCTYPE html>
+<html lang="fr">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>533yes - Performance des modèles HTR par page</title>
+    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
+    <style>
+        body { padding: 20px; }
+        .table-container { overflow: auto; height: 75vh; border: 1px solid #dee2e6; }
+        table { border-collapse: separate; border-spacing: 0; table-layout: fixed; }
+        th, td { padding: 0 8px; height: 30px; text-align: center; white-space: nowrap; overflow: hidden;
+                 text-overflow: ellipsis; border-bottom: 1px solid #dee2e6; border-right: 1px solid #dee2e6; }
+        thead th { position: sticky; top: 0; z-index: 2; background-color: #f8f9fa; cursor: pointer; user-select: none; }
+        tfoot td { position: sticky; bottom: 0; z-index: 2; background-color: #f8f9fa; font-weight: bold; }
+        th:nth-child(1), td:nth-child(1) { position: sticky; left: 0; z-index: 1; background-color: #fff; text-align: left; }
+        thead th:nth-child(1), tfoot td:nth-child(1) { z-index: 3; background-color: #f8f9fa; }
+        td:nth-child(2) { text-align: left; }
+        .spacer td { padding: 0; border: 0; }
+        .wer-na { background-color: #f8f8f8; color: #888888; }
+        .wer-excluded { background-color: #e8e8e8; color: #888888; }
+        .wer-good { background-color: #c6efce; color: #006100; }
+        .wer-medium { background-color: #ffeb9c; color: #9c5700; }
+        .wer-bad { background-color: #ffc7ce; color: #9c0006; }
+        .legend-box { display: inline-block; width: 20px; height: 20px; margin-right: 5px; vertical-align: middle; }
+    </style>
+</head>
+<body>
+    <div class="container-fluid">
+        <h1 class="mb-4">Performance des modèles HTR par page (WER)</h1>
+        <p>Généré le __GENERATED_AT__. Plus le WER est bas, meilleure est la performance.
+           Cliquez sur un en-tête pour trier.</p>
+
+        <div class="row mb-3">
+            <div class="col-md-6">
+                <input id="filter" type="search" class="form-control" placeholder="Filtrer les pages (nom ou description)">
+            </div>
+            <div class="col-md-6 align-self-center text-muted" id="count"></div>
+        </div>
+
+        <div class="table-container" id="container">
+            <table class="table-sm">
+                <colgroup id="columns"></colgroup>
+                <thead><tr id="header"></tr></thead>
+                <tbody id="body"></tbody>
+                <tfoot><tr id="footer"></tr></tfoot>
+            </table>
+        </div>
+
+        <div class="mt-4">
+            <h3>Légende</h3>
+            <div class="d-flex flex-wrap">
+                <div class="me-4 mb-2"><span class="legend-box wer-good"></span>Bon (WER &lt; 0.5)</div>
+                <div class="me-4 mb-2"><span class="legend-box wer-medium"></span>Moyen (WER &lt; 1.0)</div>
+                <div class="me-4 mb-2"><span class="legend-box wer-bad"></span>Mauvais (WER ≥ 1.0)</div>
+                <div class="me-4 mb-2"><span class="legend-box wer-excluded"></span>Exclue du calcul (page blanche)</div>
+            </div>
+        </div>
+    </div>
+
+    <script id="matrix" type="application/json">__DATA__</script>
+    <script>
+        const data = JSON.parse(document.getElementById('matrix').textContent);
+        const ROW_HEIGHT = 30;
+        // Lignes créées au-delà de la zone visible, pour un défilement sans blanc
+        const OVERSCAN = 10;
+        const container = document.getElementById('container');
+        const body = document.getElementById('body');
+
+        let visibleRows = data.rows;
+        let sortColumn = null;
+        let sortAscending = true;
+
+        function escapeHtml(text) {
+            return String(text).replace(/[&<>"']/g, c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'})[c]);
+        }
+
+        // Mêmes seuils que le rapport mis en forme par pandas
+        function werCell(value) {
+            if (value === null) return '<td class="wer-na">N/A</td>';
+            if (value === -1) return '<td class="wer-excluded">Excluded</td>';
+            const band = value < 0.5 ? 'wer-good' : value < 1.0 ? 'wer-medium' : 'wer-bad';
+            return `<td class="${band}">${value.toFixed(3)}</td>`;
+        }
+
+        function rowHtml(row) {
+            return `<tr><td title="${escapeHtml(row[0])}">${escapeHtml(row[0])}</td>`
+                + `<td title="${escapeHtml(row[1])}">${escapeHtml(row[1])}</td>`
+                + row.slice(2).map(werCell).join('') + '</tr>';
+        }
+
+        function spacer(height) {
+            return height > 0 ? `<tr class="spacer"><td colspan="${data.models.length + 2}" style="height: ${height}px"></td></tr>` : '';
+        }
+
+        // N'insère que les lignes visibles, entourées de deux lignes vides à la hauteur des autres
+        function render() {
+            const first = Math.max(0, Math.floor(container.scrollTop / ROW_HEIGHT) - OVERSCAN);
+            const last = Math.min(visibleRows.length, first + Math.ceil(container.clientHeight / ROW_HEIGHT) + 2 * OVERSCAN);
+            body.innerHTML = spacer(first * ROW_HEIGHT)
+                + visibleRows.slice(first, last).map(rowHtml).join('')
+                + spacer((visibleRows.length - last) * ROW_HEIGHT);
+        }
+
+        let renderPending = false;
+        container.addEventListener('scroll', () => {
+            if (!renderPending) {
+                renderPending = true;
+                requestAnimationFrame(() => {
+                    renderPending = false;
+                    render();
+                });
+            }
+        });
+        window.addEventListener('resize', render);
+
+        // Tri : texte pour le nom et la description, WER sinon (N/A et pages exclues toujours en dernier)
+        function sortKey(value) {
+            return value === null || value === -1 ? Infinity : value;
+        }
+
+        function applyView() {
+            const filter = document.getElementById('filter').value.trim().toLowerCase();
+            visibleRows = filter
+                ? data.rows.filter(row => row[0].toLowerCase().includes(filter) || row[1].toLowerCase().includes(filter))
+                : data.rows.slice();
+            if (sortColumn !== null) {
+                const direction = sortAscending ? 1 : -1;
+                visibleRows.sort(sortColumn < 2
+                    ? (a, b) => direction * a[sortColumn].localeCompare(b[sortColumn])
+                    : (a, b) => {
+                        const ka = sortKey(a[sortColumn]), kb = sortKey(b[sortColumn]);
+                        if (ka === kb) return 0;
+                        if (ka === Infinity) return 1;
+                        if (kb === Infinity) return -1;
+                        return direction * (ka - kb);
+                    });
+            }
+            document.getElementById('count').textContent =
+                `${visibleRows.length} page(s) sur ${data.rows.length}, ${data.models.length} modèle(s)`;
+            document.querySelectorAll('#header th').forEach((th, column) => {
+                th.dataset.sort = column === sortColumn ? (sortAscending ? ' ▲' : ' ▼') : '';
+                th.textContent = th.dataset.label + th.dataset.sort;
+            });
+            container.scrollTop = 0;
+            render();
+        }
+
+        function init() {
+            const labels = ['Image', 'Description', ...data.models];
+            document.getElementById('columns').innerHTML = labels
+                .map((_, column) => `<col style="width: ${column === 0 ? 360 : column === 1 ? 260 : 110}px">`).join('');
+            const header = document.getElementById('header');
+            labels.forEach((label, column) => {
+                const th = document.createElement('th');
+                th.dataset.label = label;
+                th.title = label;
+                th.addEventListener('click', () => {
+                    sortAscending = sortColumn === column ? !sortAscending : true;
+                    sortColumn = column;
+                    applyView();
+                });
+                header.appendChild(th);
+            });
+            document.getElementById('footer').innerHTML = '<td>Moyenne</td><td></td>' + data.means.map(werCell).join('');
+            document.getElementById('filter').addEventListener('input', applyView);
+            applyView();
+        }
+
+        init();
+    </script>
+</body>
+</html>
+"""
+
 def clean_text(text):
     """
     Nettoie le texte en supprimant les marqueurs [XXX] et les balises markdown.
@@ -91,26 +279,21 @@ def get_model_info(model_id):
     else:
         return {"editeur": "Autre", "type": "libre"}
 
-def calculate_wer_for_file(result_file, reference_dir):
+def calculate_wer_for_record(record, reference_dir, excluded_from_wer=()):
     """
-    Calcule le WER pour un fichier de résultat donné.
+    Calcule le WER pour un résultat du store indexé.
+    Les images de `excluded_from_wer` (pages blanches de l'index des images) restent dans le
+    corpus mais sans WER.
     """
     try:
-        # Charger le résultat
-        with open(result_file, 'r', encoding='utf-8') as f:
-            result_data = json.load(f)
-        
-        # Extraire le nom de l'image
-        image_name = Path(result_data.get('image', '')).stem
-        
-        # Liste des images à exclure du calcul WER (tout en les gardant dans le corpus)
-        excluded_from_wer = ["AN-284AP-4-doss 11_page_36"]
+        image_name = record['image_name']
+        model = record['model_key']
         
         # Si l'image est dans la liste des exclusions, on retourne -1 comme valeur WER spéciale
         if image_name in excluded_from_wer:
             return {
                 'image': image_name,
-                'model': Path(result_file).stem.replace(f"{image_name}_", ""),
+                'model': model,
                 'wer': -1
             }
         
@@ -127,108 +310,122 @@ def calculate_wer_for_file(result_file, reference_dir):
         
         # Nettoyer les textes
         clean_reference = clean_text(reference_text)
-        clean_result = clean_text(result_data.get('result', ''))
+        clean_result = clean_text(record.get('result') or '')
         
         # Calculer le WER
         wer = calculate_wer(clean_reference, clean_result)
         
         return {
             'image': image_name,
-            'model': Path(result_file).stem.replace(f"{image_name}_", ""),
+            'model': model,
             'wer': wer
         }
     
     except Exception as e:
-        print(f"Erreur lors du traitement de {result_file}: {str(e)}")
+        print(f"Erreur lors du traitement de {record.get('image_name')} / {record.get('model_key')}: {str(e)}")
         return None
 
-def generate_performance_table():
+def collect_wer_matrix():
     """
-    Génère un tableau comparatif des performances des modèles par page.
-    """
-    # Collecter tous les fichiers de résultats
-    result_files = list(RESULTS_DIR.glob("*.json"))
+    Calcule la matrice des WER (images × modèles) à partir du store indexé.
+    Un couple (image, modèle) présent plusieurs fois prend la moyenne de ses WER.
     
-    if not result_files:
-        print("Aucun fichier de résultat trouvé.")
-        return
+    Returns:
+        dict: Modèles triés par WER moyen (du meilleur au pire), lignes (image, description,
+              WER par modèle : None si absent, -1 si l'image est exclue) et moyennes par modèle,
+              ou None si aucun résultat n'est exploitable
+    """
+    # Pages exclues du calcul WER (pages blanches de l'index des images)
+    excluded_from_wer = ImageIndex().excluded_from_wer()
     
-    # Calculer le WER pour chaque fichier
-    results = []
-    for result_file in result_files:
-        result = calculate_wer_for_file(result_file, REFERENCE_DIR)
+    # Calculer le WER pour chaque résultat, au fil de la lecture du store
+    values = {}
+    for record in open_result_store(results_dir=RESULTS_DIR).iter_records():
+        result = calculate_wer_for_record(record, REFERENCE_DIR, excluded_from_wer)
         if result:
-            results.append(result)
+            values.setdefault((result['image'], result['model']), []).append(result['wer'])
     
-    if not results:
-        print("Aucun résultat valide trouvé.")
-        return
-    
-    # Créer un DataFrame
-    df = pd.DataFrame(results)
-    
-    # Pivoter le DataFrame pour avoir les modèles en colonnes et les images en lignes
-    pivot_df = df.pivot(index='image', columns='model', values='wer')
-    
-    # Trier les colonnes par WER moyen (du meilleur au pire)
-    # Exclure les valeurs -1 (images exclues du calcul WER) du calcul de la moyenne
-    model_avg_wer = pivot_df.replace(-1, float('nan')).mean().sort_values()
-    pivot_df = pivot_df[model_avg_wer.index]
-    
-    # Ajouter une ligne pour le WER moyen
-    # Exclure les valeurs -1 (images exclues du calcul WER) du calcul de la moyenne
-    pivot_df.loc['Moyenne'] = pivot_df.replace(-1, float('nan')).mean()
-    
-    # Créer un DataFrame pour les descriptions de pages
-    descriptions = {}
-    for image in pivot_df.index:
-        if image == 'Moyenne':
-            descriptions[image] = ""
-        else:
-            descriptions[image] = PAGE_DESCRIPTIONS.get(image, DEFAULT_PAGE_DESCRIPTION)
+    if not values:
+        return None
     
-    # Formater les valeurs WER
-    formatted_df = pivot_df.applymap(lambda x: f"{x:.3f}" if pd.notnull(x) else "N/A")
+    cells = {key: sum(wers) / len(wers) for key, wers in values.items()}
+    images = sorted({image for image, _ in cells})
+    models = {model for _, model in cells}
     
-    # Obtenir la date et l'heure actuelles
-    now = datetime.datetime.now()
-    date_str = now.strftime("%d/%m/%Y %H:%M:%S")
+    # WER moyen par modèle, sans les images exclues du calcul (-1)
+    means = {}
+    for model in models:
+        scored = [wer for (_, cell_model), wer in cells.items() if cell_model == model and wer != -1]
+        means[model] = sum(scored) / len(scored) if scored else None
+    models = sorted(models, key=lambda model: (means[model] is None, means[model] or 0.0, model))
     
-    # Générer le tableau markdown
-    md_content = f"# Performance des modèles HTR par page (WER) - Généré le {now.strftime('%d/%m/%Y %H:%M:%S')}\n\n"
-    md_content += "Plus le WER est bas, meilleure est la performance.\n\n"
+    rows = [
+        (image, PAGE_DESCRIPTIONS.get(image, DEFAULT_PAGE_DESCRIPTION), [cells.get((image, model)) for model in models])
+        for image in images
+    ]
+    return {"models": models, "rows": rows, "means": [means[model] for model in models]}
+
+def format_wer(value):
+    """Valeur d'une cellule : WER à trois décimales, N/A ou Excluded."""
+    if value is None:
+        return "N/A"
+    if value == -1:
+        return "Excluded"
+    return f"{value:.3f}"
+
+def write_markdown(path, matrix, generated_at):
+    """
+    Écrit le tableau Markdown ligne par ligne, sans le construire en mémoire.
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"# Performance des modèles HTR par page (WER) - Généré le {generated_at}\n\n")
+        f.write("Plus le WER est bas, meilleure est la performance.\n\n")
+        
+        # En-tête du tableau
+        f.write("| Image | Description |" + "".join(f" {model} |" for model in matrix["models"]) + "\n")
+        f.write("|:-----|:-----------|" + "-----:|" * len(matrix["models"]) + "\n")
+        
+        # Une ligne par image, puis la moyenne
+        for image, description, wers in matrix["rows"]:
+            f.write(f"| {image} | {description} |" + "".join(f" {format_wer(wer)} |" for wer in wers) + "\n")
+        f.write("| Moyenne |  |" + "".join(f" {format_wer(wer)} |" for wer in matrix["means"]) + "\n")
+
+def write_virtual_html(path, matrix, generated_at):
+    """
+    Écrit le rapport HTML : la matrice en JSON compact, affichée par un tableau virtualisé
+    (seules les lignes visibles sont dans la page), triable et filtrable.
+    """
+    def compact(value):
+        return None if value is None else round(value, WER_JSON_DECIMALS)
     
-    # Créer le tableau markdown
-    md_content += "| Image | Description |"
-    for model in pivot_df.columns:
-        md_content += f" {model} |"
-    md_content += "\n"
+    data = {
+        "models": matrix["models"],
+        "rows": [[image, description] + [compact(wer) for wer in wers] for image, description, wers in matrix["rows"]],
+        "means": [compact(wer) for wer in matrix["means"]],
+    }
+    # `</` échappé pour ne pas fermer la balise <script> qui contient les données
+    data_json = json.dumps(data, ensure_ascii=False, separators=(",", ":")).replace("</", "<\\/")
     
-    md_content += "|:-----|:-----------|"
-    for _ in pivot_df.columns:
-        md_content += "-----:|"
-    md_content += "\n"
+    html_content = VIRTUAL_HTML_TEMPLATE.replace("__GENERATED_AT__", generated_at).replace("__DATA__", data_json)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(html_content)
+
+def write_styled_html(path, matrix, generated_at):
+    """
+    Écrit le rapport HTML mis en forme par pandas (Styler) : toute la matrice dans la page.
+    Réservé aux petits corpus, le rendu devenant lent et volumineux avec des milliers de pages.
+    """
+    import pandas as pd
     
-    # Ajouter les lignes du tableau
-    for image in pivot_df.index:
-        description = descriptions.get(image, "Document d'archives historiques")
-        md_content += f"| {image} | {description} |"
-        
-        for model in pivot_df.columns:
-            value = pivot_df.loc[image, model]
-            if pd.isna(value):
-                md_content += " N/A |"
-            elif value == -1:
-                md_content += " Excluded |"
-            else:
-                md_content += f" {value:.3f} |"
-        md_content += "\n"
+    pivot_df = pd.DataFrame([wers for _, _, wers in matrix["rows"]],
+                            index=[image for image, _, _ in matrix["rows"]],
+                            columns=matrix["models"], dtype=float)
+    pivot_df.loc['Moyenne'] = pd.Series(matrix["means"], index=matrix["models"], dtype=float)
     
-    # Écrire le tableau markdown
-    with open(OUTPUT_DIR / "performance_par_page.md", 'w', encoding='utf-8') as f:
-        f.write(md_content)
+    # Créer un DataFrame pour les descriptions de pages
+    descriptions = {image: description for image, description, _ in matrix["rows"]}
+    descriptions['Moyenne'] = ""
     
-    # Générer le tableau HTML avec mise en forme conditionnelle
     html_df = pivot_df.copy()
     
     # Créer une fonction pour appliquer une couleur de fond basée sur la valeur WER
@@ -249,15 +446,12 @@ def generate_performance_table():
         else:
             return 'background-color: #ffc7ce; color: #9c0006'
     
-    # Appliquer la mise en forme conditionnelle
-    styled_df = html_df.style.map(color_wer).format(lambda x: "Excluded" if x == -1 else "{:.3f}".format(x) if not pd.isna(x) else "N/A")
-    
     # Créer un DataFrame avec les descriptions
     desc_df = pd.DataFrame({"Description": descriptions}, index=pivot_df.index)
     
     # Concaténer les DataFrames
     display_df = pd.concat([desc_df, html_df], axis=1)
-    styled_display_df = display_df.style.map(lambda x: color_wer(x) if not isinstance(x, str) else "", subset=html_df.columns).format("{:.3f}", subset=html_df.columns)
+    styled_display_df = display_df.style.map(lambda x: color_wer(x) if not isinstance(x, str) else "", subset=html_df.columns).format(lambda x: format_wer(None if pd.isna(x) else x), subset=html_df.columns)
     
     # Générer le HTML
     html_content = f"""
@@ -280,7 +474,7 @@ def generate_performance_table():
     <body>
         <div class="container">
             <h1 class="mb-4">Performance des modèles HTR par page (WER)</h1>
-            <p>Généré le {date_str}</p>
+            <p>Généré le {generated_at}</p>
             <p>Plus le WER est bas, meilleure est la performance.</p>
             
             <div class="table-container">
@@ -291,24 +485,20 @@ def generate_performance_table():
                 <h3>Légende</h3>
                 <div class="d-flex flex-wrap">
                     <div class="me-4 mb-2">
-                        <span style="display: inline-block; width: 20px; height: 20px; background-color: #d4edda; margin-right: 5px;"></span>
-                        Très bon (WER < 0.1)
-                    </div>
-                    <div class="me-4 mb-2">
-                        <span style="display: inline-block; width: 20px; height: 20px; background-color: #d1ecf1; margin-right: 5px;"></span>
-                        Bon (WER < 0.2)
+                        <span style="display: inline-block; width: 20px; height: 20px; background-color: #c6efce; margin-right: 5px;"></span>
+                        Bon (WER < 0.5)
                     </div>
                     <div class="me-4 mb-2">
-                        <span style="display: inline-block; width: 20px; height: 20px; background-color: #fff3cd; margin-right: 5px;"></span>
-                        Moyen (WER < 0.3)
+                        <span style="display: inline-block; width: 20px; height: 20px; background-color: #ffeb9c; margin-right: 5px;"></span>
+                        Moyen (WER < 1.0)
                     </div>
                     <div class="me-4 mb-2">
-                        <span style="display: inline-block; width: 20px; height: 20px; background-color: #ffe5d0; margin-right: 5px;"></span>
-                        Mauvais (WER < 0.5)
+                        <span style="display: inline-block; width: 20px; height: 20px; background-color: #ffc7ce; margin-right: 5px;"></span>
+                        Mauvais (WER ≥ 1.0)
                     </div>
                     <div class="me-4 mb-2">
-                        <span style="display: inline-block; width: 20px; height: 20px; background-color: #f8d7da; margin-right: 5px;"></span>
-                        Très mauvais (WER ≥ 0.5)
+                        <span style="display: inline-block; width: 20px; height: 20px; background-color: #e8e8e8; margin-right: 5px;"></span>
+                        Exclue du calcul (page blanche)
                     </div>
                 </div>
             </div>
@@ -317,13 +507,44 @@ def generate_performance_table():
     </html>
     """
     
-    with open(OUTPUT_DIR / "performance_par_page.html", 'w', encoding='utf-8') as f:
+    with open(path, 'w', encoding='utf-8') as f:
         f.write(html_content)
+
+def generate_performance_table(styled=False):
+    """
+    Génère un tableau comparatif des performances des modèles par page.
+    
+    Args:
+        styled: Rapport HTML mis en forme par pandas (toute la matrice dans la page) au lieu
+                du tableau virtualisé
+    
+    Returns:
+        dict: Matrice des WER (voir `collect_wer_matrix`), ou None
+    """
+    matrix = collect_wer_matrix()
+    if matrix is None:
+        print("Aucun résultat valide trouvé.")
+        return None
     
-    print(f"Tableaux générés dans le dossier {OUTPUT_DIR}")
+    # Obtenir la date et l'heure actuelles
+    generated_at = datetime.datetime.now().strftime("%d/%m/%Y %H:%M:%S")
     
-    # Retourner le DataFrame pour une utilisation ultérieure
-    return pivot_df
+    write_markdown(OUTPUT_DIR / "performance_par_page.md", matrix, generated_at)
+    if styled:
+        write_styled_html(OUTPUT_DIR / "performance_par_page.html", matrix, generated_at)
+    else:
+        write_virtual_html(OUTPUT_DIR / "performance_par_page.html", matrix, generated_at)
+    
+    print(f"Tableaux générés dans le dossier {OUTPUT_DIR} "
+          f"({len(matrix['rows'])} pages × {len(matrix['models'])} modèles)")
+    return matrix
+
+def main():
+    parser = argparse.ArgumentParser(description="Tableau des performances (WER) des modèles HTR par page.")
+    parser.add_argument("--styled", action="store_true",
+                        help="Rapport HTML mis en forme par pandas, toute la matrice dans la page (petits corpus)")
+    args = parser.parse_args()
+    generate_performance_table(styled=args.styled)
 
 if __name__ == "__main__":
-    generate_performance_table() 
\ No newline at end of file
+    main()
@@ -4,15 +4,27 @@
 """
 Script pour générer les fichiers JSON nécessaires au fonctionnement du viewer HTML.
 Ce script crée deux fichiers :
-- images_list.json : liste des images disponibles dans le dossier 'images'
+- images_list.json : liste des images disponibles dans le dossier 'images', avec leur vignette
+  (manifeste des dérivées, `python image_derivatives.py build`)
 - models_list.json : liste des modèles utilisés dans les résultats
+Il écrit aussi wer_data.json, les paquets par image de `bundles/` (viewer_bundles.py) et les
+données compressées du viewer autonome dans `data/standalone/` (standalone_bundle.py).
 """
 
 import os
+import sys
 import json
 import re
 from pathlib import Path
 
+# Add the parent directory to sys.path to import the project modules
+sys.path.append(str(Path(__file__).parent.parent))
+from results_store import open_result_store
+from image_index import ImageIndex
+from image_derivatives import load_manifest as load_derivatives_manifest
+from viewer_bundles import BUNDLES_DIR, build_static_bundles
+from standalone_bundle import STANDALONE_DIR, build_standalone_bundle
+
 # Chemins des dossiers
 IMAGES_DIR = Path("./images")
 RESULTS_DIR = Path("./résultats")
@@ -25,13 +37,23 @@ def generate_images_list():
         print(f"Le dossier {IMAGES_DIR} n'existe pas.")
         return False
     
-    # Récupérer la liste des images
-    images = [f.name for f in IMAGES_DIR.glob("*.png")]
-    images.extend([f.name for f in IMAGES_DIR.glob("*.jpg")])
+    # Récupérer la liste des images, une seule fois par page : les copies de l'index sont
+    # écartées, sauf si l'original a disparu (une copie restante le remplace)
+    files = list(IMAGES_DIR.glob("*.png")) + list(IMAGES_DIR.glob("*.jpg"))
+    kept, _ = ImageIndex().distinct(files)
+    images = [f.name for f in kept]
     
     # Trier les images par nom
     images.sort()
     
+    # Chaque image renvoie à sa vignette dans le manifeste des dérivées, s'il a été construit
+    derivatives = load_derivatives_manifest()
+    images = [
+        {"name": name, "thumbnail": derivatives[Path(name).stem]["thumbnail"]} if Path(name).stem in derivatives
+        else {"name": name}
+        for name in images
+    ]
+    
     # Écrire le fichier JSON
     with open("images_list.json", "w", encoding="utf-8") as f:
         json.dump(images, f, ensure_ascii=False, indent=2)
@@ -90,18 +112,8 @@ def generate_models_list():
         print(f"Le dossier {RESULTS_DIR} n'existe pas.")
         return False
     
-    # Récupérer tous les fichiers de résultats
-    result_files = list(RESULTS_DIR.glob("*.json"))
-    
-    # Extraire les IDs de modèles uniques
-    model_ids = set()
-    for file in result_files:
-        # Le format du nom de fichier est : image_modelid.json
-        parts = file.stem.split("_")
-        if len(parts) >= 2:
-            # Le dernier élément est l'ID du modèle
-            model_id = parts[-1]
-            model_ids.add(model_id)
+    # Extraire les IDs de modèles uniques (nom du modèle dans les fichiers de résultats)
+    model_ids = {record["model_key"] for record in open_result_store(results_dir=RESULTS_DIR).iter_records()}
     
     # Créer la liste des modèles
     models = []
@@ -130,11 +142,6 @@ def generate_wer_data():
     Génère un fichier JSON contenant les valeurs WER pour chaque combinaison image/modèle.
     Ce fichier sera utilisé pour afficher les badges WER dans le viewer.
     """
-    import sys
-    from pathlib import Path
-    
-    # Add the parent directory to sys.path to import utils
-    sys.path.append(str(Path(__file__).parent.parent))
     from utils import calculate_wer
     
     # Vérifier si le dossier des transcriptions de référence existe
@@ -143,14 +150,14 @@ def generate_wer_data():
         print(f"Le dossier {reference_dir} n'existe pas.")
         return False
     
-    # Récupérer tous les fichiers de résultats
-    result_files = list(RESULTS_DIR.glob("*.json"))
+    # Récupérer tous les résultats depuis le store indexé
+    records = open_result_store(results_dir=RESULTS_DIR).iter_records()
     
     # Dictionnaire pour stocker les valeurs WER
     wer_data = {}
     
-    # Liste des images à exclure du calcul WER (tout en les gardant dans le corpus)
-    excluded_from_wer = ["AN-284AP-4-doss 11_page_36"]
+    # Images à exclure du calcul WER (tout en les gardant dans le corpus) : pages blanches de l'index
+    excluded_from_wer = ImageIndex().excluded_from_wer()
     
     # Fonction pour nettoyer le texte
     def clean_text(text):
@@ -166,16 +173,12 @@ def generate_wer_data():
         
         return text
     
-    # Calculer le WER pour chaque fichier de résultat
-    for result_file in result_files:
+    # Calculer le WER pour chaque résultat
+    for result_data in records:
         try:
-            # Charger le résultat
-            with open(result_file, 'r', encoding='utf-8') as f:
-                result_data = json.load(f)
-            
-            # Extraire le nom de l'image et l'ID du modèle
-            image_name = Path(result_data.get('image', '')).stem
-            model_id = result_file.stem.replace(f"{image_name}_", "")
+            # Nom de l'image et ID du modèle, indexés dans le store
+            image_name = result_data['image_name']
+            model_id = result_data['model_key']
             
             # Si l'image est dans la liste des exclusions, on l'ajoute au dictionnaire mais on ne calcule pas son WER
             if image_name in excluded_from_wer:
@@ -198,7 +201,7 @@ def generate_wer_data():
             
             # Nettoyer les textes
             clean_reference = clean_text(reference_text)
-            clean_result = clean_text(result_data.get('result', ''))
+            clean_result = clean_text(result_data.get('result') or '')
             
             # Calculer le WER
             wer = calculate_wer(clean_reference, clean_result)
@@ -210,7 +213,7 @@ def generate_wer_data():
             wer_data[image_name][model_id] = wer
             
         except Exception as e:
-            print(f"Erreur lors du traitement de {result_file}: {str(e)}")
+            print(f"Erreur lors du traitement de {result_data['image_name']} / {result_data['model_key']}: {str(e)}")
     
     # Écrire le fichier JSON
     with open("wer_data.json", "w", encoding="utf-8") as f:
@@ -231,6 +234,12 @@ if __name__ == "__main__":
         print("Impossible de générer le fichier wer_data.json : module utils non trouvé.")
         success_wer = False
     
+    bundles_written = build_static_bundles(BUNDLES_DIR, results_dir=RESULTS_DIR)
+    print(f"{bundles_written} paquet(s) écrit(s) dans {BUNDLES_DIR}/")
+    
+    standalone = build_standalone_bundle(STANDALONE_DIR, IMAGES_DIR, results_dir=RESULTS_DIR)
+    print(f"Viewer autonome : {standalone['images']} image(s) en {standalone['chunks']} morceau(x) dans {STANDALONE_DIR}/")
+    
     if success_images and success_models:
         print("\nLes fichiers ont été générés avec succès.")
         print("Pour utiliser le viewer sur GitHub Pages :")
@@ -239,6 +248,8 @@ if __name__ == "__main__":
         print("   - models_list.json")
         if success_wer:
             print("   - wer_data.json")
+        print(f"   - {BUNDLES_DIR}/")
+        print(f"   - {STANDALONE_DIR}/")
         print("2. Activez GitHub Pages dans les paramètres de votre dépôt.")
         print("3. Le viewer sera accessible à l'adresse : https://[votre-nom-utilisateur].github.io/[nom-depot]/htr_viewer.html")
     else:
@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Index plein texte des transcriptions de référence et des résultats de tous les modèles.
+
+Pour comparer la lecture d'un terme (« Vendémiaire », « Condorcet ») par les modèles, il
+fallait parcourir les JSON des résultats avec grep. Les textes sont découpés en mots avec
+le même nettoyage que le calcul du WER (`metrics.clean_text_for_wer`), puis chaque mot est
+ramené à une clé de recherche (minuscules, sans accents ni ponctuation autour). L'index
+garde :
+  - un index inversé : clé -> {document: positions}, pour les mots et les expressions ;
+  - un index des trigrammes de caractères des clés, pour les recherches approchées
+    (graphies fautives, lectures partielles) ;
+  - le vocabulaire trié, pour les abréviations (« Vend. » cherche les mots qui commencent
+    par « vend »).
+
+Un document est une référence ou le résultat d'un modèle pour une image. La mise à jour
+est incrémentale : seuls les documents nouveaux ou modifiés sont redécoupés, les documents
+disparus sont retirés. Les documents découpés sont conservés dans `cache/search_index.json.gz` ;
+l'index inversé est reconstruit en mémoire au chargement.
+
+  python search_index.py build
+  python search_index.py query "Condorcet" --mode fuzzy
+
+Le serveur du viewer (`server.py`) répond à `/api/search?q=...&mode=exact|prefix|fuzzy`.
+"""
+
+import argparse
+import bisect
+import gzip
+import json
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import defaultdict
+from pathlib import Path
+
+from metrics import clean_text_for_wer
+from results_store import DEFAULT_DB_PATH, DEFAULT_RUN, RESULTS_DIR, open_result_store
+from screening import REFERENCE_DIR, load_reference
+
+INDEX_FILE = Path("./cache/search_index.json.gz")
+
+# Source des documents de référence (les autres sources sont les identifiants des modèles)
+REFERENCE_SOURCE = "reference"
+
+# Types de recherche : mot exact, préfixe (abréviations), approchée (erreurs d'OCR/HTR)
+SEARCH_MODES = ("exact", "prefix", "fuzzy")
+
+# Similarité minimale (coefficient de Dice sur les trigrammes) d'une clé pour la recherche approchée
+FUZZY_MIN_SIMILARITY = 0.5
+
+# Nombre maximal de clés retenues pour un mot de la requête (recherches approchées et préfixes)
+MAX_EXPANSIONS = 50
+
+# Mots de contexte de part et d'autre d'une occurrence
+SNIPPET_WORDS = 6
+
+# Délai minimal (en secondes) entre deux vérifications des sources par le serveur
+REFRESH_INTERVAL = 5.0
+
+EDGE_PUNCTUATION = re.compile(r"^[\W_]+|[\W_]+$")
+
+
+def search_key(word):
+    """Clé de recherche d'un mot : minuscules, sans accents ni ponctuation autour."""
+    word = EDGE_PUNCTUATION.sub("", word).casefold()
+    return "".join(c for c in unicodedata.normalize("NFKD", word) if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """Mots d'un texte, nettoyé comme pour le calcul du WER."""
+    return clean_text_for_wer(text or "").split()
+
+
+def trigrams(key):
+    """Trigrammes de caractères d'une clé, bornée par ^ et $."""
+    padded = f"^{key}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def document_id(image_name, source):
+    return f"{image_name}\t{source}"
+
+
+class SearchIndex:
+    """
+    Index inversé avec positions et index des trigrammes.
+
+    `docs` : {identifiant: {"image", "source", "signature", "words"}} ;
+    `postings` : {clé: {identifiant: [positions]}} ;
+    `grams` : {trigramme: {clés}} ;
+    `gram_counts` : {clé: nombre de trigrammes}.
+    """
+
+    def __init__(self, path=INDEX_FILE, db_path=DEFAULT_DB_PATH, results_dir=RESULTS_DIR,
+                 reference_dir=REFERENCE_DIR, run=DEFAULT_RUN):
+        self.path = Path(path)
+        self.db_path = Path(db_path)
+        self.results_dir = Path(results_dir)
+        self.reference_dir = Path(reference_dir)
+        self.run = run
+        self.docs = {}
+        self.postings = defaultdict(dict)
+        self.grams = defaultdict(set)
+        self.gram_counts = {}
+        self._vocabulary = None
+        self._lock = threading.RLock()
+        self._checked_at = 0.0
+        if self.path.exists():
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                for doc_id, doc in json.load(f)["docs"].items():
+                    self._add(doc_id, doc)
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump({"version": 1, "docs": self.docs}, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def _add(self, doc_id, doc):
+        self.docs[doc_id] = doc
+        for position, word in enumerate(doc["words"]):
+            key = search_key(word)
+            if not key:
+                continue
+            if key not in self.postings:
+                key_grams = trigrams(key)
+                for gram in key_grams:
+                    self.grams[gram].add(key)
+                self.gram_counts[key] = len(key_grams)
+                self._vocabulary = None
+            self.postings[key].setdefault(doc_id, []).append(position)
+
+    def _remove(self, doc_id):
+        doc = self.docs.pop(doc_id)
+        for key in {search_key(word) for word in doc["words"]} - {""}:
+            postings = self.postings[key]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self.postings[key]
+                del self.gram_counts[key]
+                for gram in trigrams(key):
+                    self.grams[gram].discard(key)
+                self._vocabulary = None
+
+    def _sources(self):
+        """Documents actuels : {identifiant: (image, source, signature, chargeur du texte)}."""
+        sources = {}
+        if self.reference_dir.exists():
+            for ref_file in self.reference_dir.glob("*.md"):
+                stat = ref_file.stat()
+                sources[document_id(ref_file.stem, REFERENCE_SOURCE)] = (
+                    ref_file.stem, REFERENCE_SOURCE, f"{stat.st_size}-{stat.st_mtime_ns}",
+                    lambda image_name=ref_file.stem: load_reference(image_name, self.reference_dir)
+                )
+        if self.db_path.exists() or self.results_dir.exists():
+            store = open_result_store(self.db_path, self.results_dir)
+            for record in store.iter_records(run=self.run):
+                text = record["result"] or ""
+                sources[document_id(record["image_name"], record["model"])] = (
+                    record["image_name"], record["model"], f"{len(text)}-{zlib.crc32(text.encode('utf-8')):08x}",
+                    lambda text=text: text
+                )
+        return sources
+
+    def update(self):
+        """
+        Met l'index à jour : découpe les documents nouveaux ou modifiés, retire les disparus.
+
+        Returns:
+            tuple: (documents ajoutés ou modifiés, documents retirés)
+        """
+        sources = self._sources()
+        with self._lock:
+            removed = [doc_id for doc_id in self.docs if doc_id not in sources]
+            for doc_id in removed:
+                self._remove(doc_id)
+            changed = 0
+            for doc_id, (image_name, source, signature, load_text) in sources.items():
+                current = self.docs.get(doc_id)
+                if current and current["signature"] == signature:
+                    continue
+                if current:
+                    self._remove(doc_id)
+                self._add(doc_id, {"image": image_name, "source": source, "signature": signature,
+                                   "words": tokenize(load_text())})
+                changed += 1
+            self._checked_at = time.monotonic()
+        return changed, len(removed)
+
+    def refresh(self, max_age=REFRESH_INTERVAL):
+        """
+        Met l'index à jour (et l'enregistre s'il a changé) si la dernière vérification
+        date de plus de `max_age` secondes.
+        """
+        if time.monotonic() - self._checked_at >= max_age:
+            with self._lock:
+                changed, removed = self.update()
+                if changed or removed:
+                    self.save()
+
+    def vocabulary(self):
+        """Clés de l'index, triées (reconstruites après une modification du vocabulaire)."""
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.postings)
+        return self._vocabulary
+
+    def expand(self, key, mode="exact"):
+        """
+        Clés de l'index qui correspondent à un mot de la requête.
+
+        Args:
+            key: Clé de recherche du mot
+            mode: "exact", "prefix" (abréviations) ou "fuzzy" (trigrammes)
+
+        Returns:
+            list: Clés retenues, les plus proches d'abord
+        """
+        if mode == "prefix":
+            vocabulary = self.vocabulary()
+            start = bisect.bisect_left(vocabulary, key)
+            matches = []
+            for candidate in vocabulary[start:]:
+                if not candidate.startswith(key) or len(matches) >= MAX_EXPANSIONS:
+                    break
+                matches.append(candidate)
+            return matches
+        if mode == "fuzzy":
+            # Dice >= s impose un nombre minimal de trigrammes communs : une clé retenue figure
+            # forcément dans l'un des trigrammes les plus rares de la requête
+            query_grams = sorted(trigrams(key), key=lambda gram: len(self.grams.get(gram, ())))
+            size = len(query_grams)
+            min_shared = math.ceil(FUZZY_MIN_SIMILARITY * (size + 1) / 2)
+            candidates = set()
+            for gram in query_grams[:size - min_shared + 1]:
+                candidates.update(self.grams.get(gram, ()))
+            scored = []
+            for candidate in candidates:
+                candidate_size = self.gram_counts[candidate]
+                shared = sum(candidate in self.grams.get(gram, ()) for gram in query_grams)
+                similarity = 2 * shared / (size + candidate_size)
+                if similarity >= FUZZY_MIN_SIMILARITY:
+                    scored.append((similarity, candidate))
+            scored.sort(key=lambda item: (-item[0], item[1]))
+            return [candidate for _, candidate in scored[:MAX_EXPANSIONS]]
+        return [key] if key in self.postings else []
+
+    def search(self, query, mode="exact", limit=50):
+        """
+        Occurrences d'un mot ou d'une expression (mots consécutifs) dans les documents.
+
+        Returns:
+            dict: Requête, clés retenues pour chaque mot, nombre d'occurrences et
+                occurrences (image, source, position, mots trouvés, contexte), triées par
+                image puis référence d'abord
+        """
+        started = time.perf_counter()
+        keys = [key for key in (search_key(word) for word in query.split()) if key]
+        with self._lock:
+            expansions = [self.expand(key, mode) for key in keys]
+            # Documents contenant tous les mots, puis positions de départ possibles de l'expression
+            candidates = None
+            for expanded in expansions:
+                docs = set().union(*(self.postings[key].keys() for key in expanded))
+                candidates = docs if candidates is None else candidates & docs
+            starts = {doc_id: None for doc_id in candidates or ()}
+            for offset, expanded in enumerate(expansions):
+                for doc_id in list(starts):
+                    positions = set()
+                    for key in expanded:
+                        positions.update(position - offset for position in self.postings[key].get(doc_id, ()))
+                    doc_starts = positions if starts[doc_id] is None else starts[doc_id] & positions
+                    if doc_starts:
+                        starts[doc_id] = doc_starts
+                    else:
+                        del starts[doc_id]
+
+            # Occurrences triées par image, la référence d'abord ; seules les premières sont détaillées
+            occurrences = sorted(
+                (self.docs[doc_id]["image"], self.docs[doc_id]["source"] != REFERENCE_SOURCE,
+                 self.docs[doc_id]["source"], start, doc_id)
+                for doc_id, doc_starts in starts.items() for start in doc_starts
+            )
+            hits = []
+            for image_name, _, source, start, doc_id in occurrences[:limit]:
+                words = self.docs[doc_id]["words"]
+                end = start + len(keys)
+                hits.append({
+                    "image": image_name,
+                    "source": source,
+                    "position": start,
+                    "match": " ".join(words[start:end]),
+                    "snippet": " ".join(words[max(0, start - SNIPPET_WORDS):end + SNIPPET_WORDS]),
+                })
+        return {
+            "query": query,
+            "mode": mode,
+            "terms": dict(zip(keys, expansions)),
+            "total": len(occurrences),
+            "hits": hits,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index plein texte des références et des résultats.")
+    parser.add_argument("command", choices=["build", "query"])
+    parser.add_argument("query", nargs="?", help="Mot ou expression à chercher (query)")
+    parser.add_argument("--mode", choices=SEARCH_MODES, default="exact", help="Type de recherche")
+    parser.add_argument("--limit", type=int, default=50, help="Nombre maximal d'occurrences affichées")
+    parser.add_argument("--db", type=Path, default=DEFAULT_DB_PATH, help="Store indexé des résultats (SQLite)")
+    parser.add_argument("--index", type=Path, default=INDEX_FILE, help="Fichier de l'index")
+    args = parser.parse_args()
+
+    index = SearchIndex(args.index, args.db)
+    changed, removed = index.update()
+    if changed or removed:
+        index.save()
+    print(f"{len(index.docs)} documents, {len(index.postings)} clés "
+          f"({changed} document(s) indexé(s), {removed} retiré(s))")
+
+    if args.command == "query":
+        if not args.query:
+            parser.error("la commande query demande un mot ou une expression")
+        results = index.search(args.query, args.mode, args.limit)
+        for key, expanded in results["terms"].items():
+            print(f"{key} -> {', '.join(expanded) or 'aucune clé'}")
+        print(f"{results['total']} occurrence(s) en {results['elapsed_ms']} ms")
+        for hit in results["hits"]:
+            print(f"{hit['image']} | {hit['source']} | {hit['match']} | …{hit['snippet']}…")
+
+
+if __name__ == "__main__":
+    main()
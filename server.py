@@ -2,45 +2,416 @@
 # -*- coding: utf-8 -*-
 
 """
-Serveur web simple pour le viewer HTR.
+Serveur web du viewer HTR.
 Exécutez ce script puis accédez à http://localhost:8000/viewer/htr_viewer.html
+
+Le serveur traite les requêtes en parallèle (un thread par connexion) et évite de
+retransférer ce que le navigateur a déjà :
+  - ETag et Last-Modified sur chaque fichier, réponses 304 aux requêtes conditionnelles ;
+  - requêtes partielles (Range) pour les grands scans ;
+  - tuiles des pyramides de zoom (`pyramids/`) et dérivées des images (`derivatives/`),
+    adressées par contenu, gardées sans revalidation ;
+  - variantes précompressées `.br`/`.gz` des JSON, HTML, JS, CSS et Markdown, servies
+    selon l'en-tête Accept-Encoding. Elles sont produites par :
+
+  python server.py --precompress
+
+Les variantes plus anciennes que leur fichier d'origine sont ignorées.
+
+`/api/bundle/<image>` renvoie en une requête la référence et les transcriptions de tous
+les modèles pour une image, avec leurs métriques (`viewer_bundles.py`).
+
+`/api/search?q=<mots>&mode=exact|prefix|fuzzy&limit=50` cherche un mot ou une expression
+dans les références et toutes les transcriptions (`search_index.py`).
 """
 
+import argparse
+import email.utils
+import gzip
+import hashlib
 import http.server
-import socketserver
-import webbrowser
+import json
 import os
+import re
+import threading
+import webbrowser
+from http import HTTPStatus
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from results_store import DEFAULT_DB_PATH, RESULTS_DIR
+from search_index import INDEX_FILE, SEARCH_MODES, SearchIndex
+from viewer_bundles import BUNDLE_PAGE_SIZE, REFERENCE_DIR, BundleSource
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Port sur lequel le serveur va écouter
 PORT = 8000
 
-class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
-    """Handler qui ajoute les en-têtes CORS pour permettre les requêtes cross-origin"""
-    
+# Durée (en secondes) pendant laquelle le navigateur réutilise une image sans la revalider
+IMAGE_MAX_AGE = 3600
+
+# Dossiers des tuiles (image_pyramid.py) et des dérivées (image_derivatives.py) : adressées
+# par contenu, elles ne changent jamais
+IMMUTABLE_PREFIXES = ("/pyramids/", "/derivatives/")
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Extensions des fichiers texte servis avec leurs variantes précompressées
+COMPRESSIBLE_SUFFIXES = {".json", ".html", ".js", ".css", ".md", ".svg", ".txt"}
+
+# Taille minimale d'un fichier pour que sa précompression vaille la peine (en octets)
+PRECOMPRESS_MIN_SIZE = 1024
+
+# Dossiers ignorés lors de la précompression
+PRECOMPRESS_SKIP_DIRS = {".git", "cache", "__pycache__", "images", "node_modules", "pyramids", "derivatives"}
+
+# Encodages précompressés, par ordre de préférence
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+# Préfixe des paquets de données par image
+BUNDLE_API = "/api/bundle/"
+
+# Recherche plein texte, et nombre d'occurrences renvoyées par défaut
+SEARCH_API = "/api/search"
+SEARCH_LIMIT = 50
+
+RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+def file_etag(stat, encoding=None):
+    """ETag fort d'un fichier (taille et date de modification), distinct pour chaque encodage."""
+    etag = f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+    return f'"{etag}-{encoding}"' if encoding else f'"{etag}"'
+
+
+class RangeFile:
+    """Fichier limité à un intervalle d'octets, copié par `copyfile` comme un fichier entier."""
+
+    def __init__(self, f, start, length):
+        self.f = f
+        self.f.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b""
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+class ViewerRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Handler avec en-têtes CORS, validation de cache, requêtes partielles et variantes compressées"""
+
+    # Connexions persistantes : le viewer enchaîne de nombreuses petites requêtes
+    protocol_version = "HTTP/1.1"
+
+    # Source des paquets par image, fixée par `run_server`
+    bundles = None
+    search = None
+
+    # Types absents de la table par défaut : descripteurs DeepZoom, tuiles et dérivées WebP/AVIF
+    extensions_map = {**http.server.SimpleHTTPRequestHandler.extensions_map,
+                      ".dzi": "application/xml", ".webp": "image/webp", ".avif": "image/avif"}
+
     def end_headers(self):
         # Ajouter les en-têtes CORS
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET')
-        self.send_header('Cache-Control', 'no-store, no-cache, must-revalidate')
+        self.send_header('Access-Control-Allow-Methods', 'GET, HEAD')
         super().end_headers()
-    
+
+    def accepted_encodings(self):
+        """Encodages acceptés par le client (ceux à q=0 sont exclus)."""
+        accepted = set()
+        for part in self.headers.get("Accept-Encoding", "").split(","):
+            name, _, params = part.strip().partition(";")
+            if name and not re.search(r"q=0(\.0*)?\s*$", params):
+                accepted.add(name.strip().lower())
+        return accepted
+
+    def select_variant(self, path, stat):
+        """Variante précompressée à servir (chemin, stat, encodage), ou l'original."""
+        if Path(path).suffix.lower() in COMPRESSIBLE_SUFFIXES:
+            accepted = self.accepted_encodings()
+            for encoding, suffix in ENCODINGS:
+                if encoding not in accepted:
+                    continue
+                try:
+                    variant_stat = os.stat(path + suffix)
+                except OSError:
+                    continue
+                if variant_stat.st_mtime >= stat.st_mtime:
+                    return path + suffix, variant_stat, encoding
+        return path, stat, None
+
+    def not_modified(self, etag, stat):
+        """Vrai si la requête conditionnelle montre que le client a déjà cette version."""
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+            return "*" in candidates or etag in candidates
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            return int(stat.st_mtime) <= since.timestamp()
+        return False
+
+    def requested_range(self, size, etag):
+        """
+        Intervalle demandé par l'en-tête Range, s'il s'applique.
+
+        Returns:
+            tuple ou None ou False: (début, fin incluse), None sans Range, False si non satisfaisable
+        """
+        header = self.headers.get("Range")
+        if not header:
+            return None
+        if_range = self.headers.get("If-Range")
+        if if_range and if_range.strip() != etag:
+            return None
+        match = RANGE.match(header.strip())
+        if not match or match.groups() == ("", ""):
+            # Plusieurs intervalles ou syntaxe inconnue : réponse complète
+            return None
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            # bytes=-N : les N derniers octets
+            start = max(0, size - int(last))
+            end = size - 1
+        if start >= size or start > end:
+            return False
+        return start, end
+
     def do_GET(self):
-        # Gérer les requêtes GET
-        return http.server.SimpleHTTPRequestHandler.do_GET(self)
+        path = urlsplit(self.path).path
+        if path == SEARCH_API:
+            self.send_search()
+            return
+        if path.startswith(BUNDLE_API):
+            self.send_bundle()
+        else:
+            super().do_GET()
+
+    def send_bundle(self):
+        """Page du paquet d'une image (`?offset=&limit=`), compressée si le client l'accepte."""
+        url = urlsplit(self.path)
+        image_name = unquote(url.path[len(BUNDLE_API):])
+        query = parse_qs(url.query)
+        try:
+            offset = max(0, int(query.get("offset", ["0"])[0]))
+            limit = max(1, int(query.get("limit", [str(BUNDLE_PAGE_SIZE)])[0]))
+        except ValueError:
+            self.send_error(HTTPStatus.BAD_REQUEST, "offset and limit must be integers")
+            return
+        page = self.bundles.page(image_name, offset, limit) if self.bundles and image_name else None
+        if page is None:
+            self.send_error(HTTPStatus.NOT_FOUND, "No results for this image")
+            return
+        self.send_json(page)
+
+    def send_search(self):
+        """Occurrences d'un mot ou d'une expression (`?q=&mode=&limit=`) dans tous les documents."""
+        query = parse_qs(urlsplit(self.path).query)
+        words = query.get("q", [""])[0]
+        mode = query.get("mode", ["exact"])[0]
+        if not words.strip() or mode not in SEARCH_MODES:
+            self.send_error(HTTPStatus.BAD_REQUEST, f"q is required and mode must be one of {', '.join(SEARCH_MODES)}")
+            return
+        try:
+            limit = max(1, int(query.get("limit", [str(SEARCH_LIMIT)])[0]))
+        except ValueError:
+            self.send_error(HTTPStatus.BAD_REQUEST, "limit must be an integer")
+            return
+        if self.search is None:
+            self.send_error(HTTPStatus.SERVICE_UNAVAILABLE, "Search index unavailable")
+            return
+        self.search.refresh()
+        results = self.search.search(words, mode, limit)
+        # Durée de la recherche en en-tête : le corps (et son ETag) ne dépend que des résultats
+        elapsed_ms = results.pop("elapsed_ms")
+        self.send_json(results, {"Server-Timing": f"search;dur={elapsed_ms}"})
+
+    def send_json(self, data, headers=None):
+        """Réponse JSON compacte, compressée si le client l'accepte, avec un ETag sur son contenu."""
+        body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        encoding = "gzip" if "gzip" in self.accepted_encodings() and len(body) >= PRECOMPRESS_MIN_SIZE else None
+        etag = f'"{hashlib.sha1(body).hexdigest()}{"-" + encoding if encoding else ""}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return
+
+        if encoding:
+            body = gzip.compress(body, 6)
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Vary", "Accept-Encoding")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            return super().send_head()
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+
+        served_path, served_stat, encoding = self.select_variant(path, stat)
+        etag = file_etag(served_stat, encoding)
+        content_type = self.guess_type(path)
+        is_image = content_type.startswith("image/")
+        if urlsplit(self.path).path.startswith(IMMUTABLE_PREFIXES) and not path.endswith("manifest.json"):
+            cache_control = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+        elif is_image:
+            cache_control = f"public, max-age={IMAGE_MAX_AGE}"
+        else:
+            cache_control = "no-cache"
+
+        if self.not_modified(etag, stat):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", cache_control)
+            if Path(path).suffix.lower() in COMPRESSIBLE_SUFFIXES:
+                self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return None
+
+        try:
+            f = open(served_path, "rb")
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+
+        size = served_stat.st_size
+        byte_range = self.requested_range(size, etag) if encoding is None else None
+        if byte_range is False:
+            f.close()
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+
+        if byte_range:
+            start, end = byte_range
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            length = end - start + 1
+            body = RangeFile(f, start, length)
+        else:
+            self.send_response(HTTPStatus.OK)
+            length = size
+            body = f
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", self.date_time_string(stat.st_mtime))
+        self.send_header("Cache-Control", cache_control)
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        if Path(path).suffix.lower() in COMPRESSIBLE_SUFFIXES:
+            self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+        return body
 
-def run_server():
+
+def precompress(root):
+    """
+    Écrit les variantes `.gz` (et `.br` si le module brotli est installé) des fichiers texte
+    du dossier servi, lorsqu'elles manquent ou sont plus anciennes que l'original.
+
+    Returns:
+        int: Nombre de variantes écrites
+    """
+    written = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if name not in PRECOMPRESS_SKIP_DIRS]
+        for filename in filenames:
+            path = Path(dirpath) / filename
+            if path.suffix.lower() not in COMPRESSIBLE_SUFFIXES:
+                continue
+            stat = path.stat()
+            if stat.st_size < PRECOMPRESS_MIN_SIZE:
+                continue
+            data = None
+            for encoding, suffix in ENCODINGS:
+                if encoding == "br" and brotli is None:
+                    continue
+                variant = path.with_name(path.name + suffix)
+                if variant.exists() and variant.stat().st_mtime >= stat.st_mtime:
+                    continue
+                data = data if data is not None else path.read_bytes()
+                compressed = brotli.compress(data, quality=11) if encoding == "br" else gzip.compress(data, 9, mtime=0)
+                tmp_path = variant.with_name(variant.name + ".tmp")
+                tmp_path.write_bytes(compressed)
+                os.replace(tmp_path, variant)
+                written += 1
+    return written
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serveur web du viewer HTR.")
+    parser.add_argument("--port", type=int, default=PORT, help="Port d'écoute (défaut : %(default)s)")
+    parser.add_argument("--directory", type=Path, default=Path(__file__).resolve().parent,
+                        help="Dossier servi (défaut : racine du projet)")
+    parser.add_argument("--precompress", action="store_true",
+                        help="Écrire les variantes .gz/.br des fichiers texte puis quitter")
+    parser.add_argument("--no-browser", action="store_true", help="Ne pas ouvrir le navigateur")
+    return parser.parse_args()
+
+
+def run_server(directory=None, port=PORT, open_browser=True):
     """Démarrer le serveur web"""
-    
-    # Créer le serveur
-    handler = CORSHTTPRequestHandler
-    httpd = socketserver.TCPServer(("", PORT), handler)
-    
-    print(f"Serveur démarré sur le port {PORT}")
-    print(f"Ouvrez votre navigateur à l'adresse : http://localhost:{PORT}/viewer/htr_viewer.html")
-    
+    directory = str(directory or Path(__file__).resolve().parent)
+
+    # Créer le serveur (un thread par connexion)
+    ViewerRequestHandler.bundles = BundleSource(directory)
+    root = Path(directory)
+    ViewerRequestHandler.search = SearchIndex(root / INDEX_FILE, root / DEFAULT_DB_PATH, root / RESULTS_DIR,
+                                              root / REFERENCE_DIR)
+    # Index mis à jour dès le démarrage, sans attendre la première recherche
+    threading.Thread(target=ViewerRequestHandler.search.refresh, daemon=True).start()
+
+    def handler(*args, **kwargs):
+        return ViewerRequestHandler(*args, directory=directory, **kwargs)
+
+    httpd = http.server.ThreadingHTTPServer(("", port), handler)
+    httpd.daemon_threads = True
+
+    print(f"Serveur démarré sur le port {port}")
+    print(f"Ouvrez votre navigateur à l'adresse : http://localhost:{port}/viewer/htr_viewer.html")
+
     # Ouvrir automatiquement le navigateur
-    webbrowser.open(f"http://localhost:{PORT}/viewer/htr_viewer.html")
-    
+    if open_browser:
+        webbrowser.open(f"http://localhost:{port}/viewer/htr_viewer.html")
+
     try:
         # Démarrer le serveur
         httpd.serve_forever()
@@ -49,5 +420,16 @@ def run_server():
         print("\nServeur arrêté.")
         httpd.server_close()
 
+
+def main():
+    args = parse_args()
+    if args.precompress:
+        written = precompress(args.directory)
+        print(f"{written} variante(s) compressée(s) écrite(s)"
+              f"{'' if brotli else ' (gzip seulement : module brotli non installé)'}")
+        return
+    run_server(args.directory, args.port, not args.no_browser)
+
+
 if __name__ == "__main__":
-    run_server() 
\ No newline at end of file
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Données compressées du viewer autonome (`viewer/htr_viewer_standalone.html`).
+
+Ouvert depuis le disque (`file://`), le navigateur refuse les `fetch` vers les JSON et les
+Markdown du projet : seules les balises `<script>` peuvent charger des données. Les données
+du viewer sont donc emballées dans des scripts, sous `data/standalone/` :
+  - `index.js` : liste des images, liste des modèles, matrice des WER (une ligne par image,
+    une colonne par modèle) et, pour chaque image, le morceau qui contient ses textes ;
+  - `chunk-<empreinte>.js` : références et transcriptions d'un groupe d'images consécutives,
+    d'au plus `CHUNK_MAX_BYTES` octets de JSON avant compression.
+
+Chaque script appelle `HTR_STANDALONE.register(<fichier>, <JSON compressé gzip en base64>)` ;
+le viewer ne charge et ne décompresse (DecompressionStream) que le morceau de l'image
+affichée. Les morceaux sont nommés d'après leur contenu : un hébergement statique peut les
+garder en cache indéfiniment, et une reconstruction ne réécrit que ceux qui ont changé.
+
+  python standalone_bundle.py build
+"""
+
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+from pathlib import Path
+
+from image_derivatives import load_manifest as load_derivatives_manifest
+from image_index import IMAGES_DIR, ImageIndex, list_images
+from results_store import DEFAULT_DB_PATH, DEFAULT_RUN, RESULTS_DIR, open_result_store
+from viewer_bundles import REFERENCE_DIR, group_by_image, image_bundle
+
+STANDALONE_DIR = Path("data") / "standalone"
+INDEX_SCRIPT = "index.js"
+
+# Taille maximale (en octets de JSON non compressé) des textes regroupés dans un morceau ;
+# une image n'est jamais coupée entre deux morceaux
+CHUNK_MAX_BYTES = 256 * 1024
+
+# Version du format, vérifiée par le viewer
+FORMAT_VERSION = 1
+
+
+def encode_payload(data):
+    """JSON compact, compressé (gzip, sans date pour un résultat reproductible) et encodé en base64."""
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.b64encode(gzip.compress(raw, 9, mtime=0)).decode("ascii")
+
+
+def payload_script(name, payload):
+    return f"HTR_STANDALONE.register({json.dumps(name)}, \"{payload}\");\n"
+
+
+def write_script(path, name, payload):
+    """Écrit un script de données, sauf s'il existe déjà avec le même contenu."""
+    content = payload_script(name, payload)
+    if path.exists() and path.read_text(encoding="utf-8") == content:
+        return False
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.write_text(content, encoding="utf-8")
+    tmp_path.replace(path)
+    return True
+
+
+def list_models(records_by_image):
+    """Modèles présents dans les résultats : libres d'abord, puis par nom."""
+    models = {}
+    for records in records_by_image.values():
+        for record in records:
+            models.setdefault(record["model_key"], {
+                "id": record["model_key"],
+                "name": record["model"],
+                "type": record["modele_type"] or "libre",
+            })
+    return sorted(models.values(), key=lambda m: (m["type"] != "libre", m["name"].lower()))
+
+
+def list_pages(images_dir, records_by_image, reference_dir, index):
+    """
+    Pages du viewer : images du dossier, et pages qui n'ont que des résultats ou une
+    référence (image supposée en PNG). Les copies de l'index des images sont écartées,
+    sauf si l'original n'existe plus : la première copie restante le remplace.
+
+    Returns:
+        list: (nom du fichier image, nom sans extension), triés par nom
+    """
+    names = {path.stem: path.name for path in list_images(Path(images_dir))}
+    stems = set(records_by_image) | {path.stem for path in Path(reference_dir).glob("*.md")}
+    for stem in stems - set(names):
+        names[stem] = f"{stem}.png"
+    pages = {}
+    for stem in sorted(names, key=lambda stem: (index.canonical(stem) != stem, stem)):
+        pages.setdefault(index.canonical(stem), stem)
+    return sorted((names[stem], stem) for stem in pages.values())
+
+
+def image_texts(bundle):
+    """Textes d'une image pour un morceau : référence et transcription de chaque modèle."""
+    return {
+        "reference": bundle["reference"],
+        "results": {entry["model_key"]: entry["result"] for entry in bundle["models"]},
+    }
+
+
+def split_chunks(texts_by_image, max_bytes=CHUNK_MAX_BYTES):
+    """
+    Regroupe les images consécutives en morceaux d'au plus `max_bytes` octets de JSON.
+
+    Returns:
+        list: Morceaux {nom de l'image: textes}
+    """
+    chunks, current, size = [], {}, 0
+    for image_name, texts in texts_by_image.items():
+        image_size = len(json.dumps(texts, ensure_ascii=False).encode("utf-8"))
+        if current and size + image_size > max_bytes:
+            chunks.append(current)
+            current, size = {}, 0
+        current[image_name] = texts
+        size += image_size
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def build_standalone_bundle(output_dir=STANDALONE_DIR, images_dir=IMAGES_DIR, db_path=DEFAULT_DB_PATH,
+                            results_dir=RESULTS_DIR, reference_dir=REFERENCE_DIR, run=DEFAULT_RUN,
+                            max_bytes=CHUNK_MAX_BYTES):
+    """
+    Écrit l'index et les morceaux du viewer autonome, et supprime les morceaux périmés.
+
+    Returns:
+        dict: Nombre d'images, de modèles, de morceaux et de morceaux (ré)écrits
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    index = ImageIndex()
+    excluded_from_wer = index.excluded_from_wer()
+    derivatives = load_derivatives_manifest()
+    records_by_image = group_by_image(open_result_store(db_path, results_dir), run)
+
+    images = list_pages(images_dir, records_by_image, reference_dir, index)
+    models = list_models(records_by_image)
+    columns = {model["id"]: column for column, model in enumerate(models)}
+
+    texts_by_image = {}
+    wer_matrix = []
+    for name, stem in images:
+        bundle = image_bundle(stem, records_by_image.get(stem, []), reference_dir, excluded_from_wer)
+        row = [None] * len(models)
+        for entry in bundle["models"]:
+            # -1 : image exclue du calcul du WER (même convention que wer_data.json)
+            row[columns[entry["model_key"]]] = -1 if bundle["excluded_from_wer"] else entry["wer"]
+        wer_matrix.append(row)
+        texts_by_image[name] = image_texts(bundle)
+
+    chunk_of_image = {}
+    chunk_files = []
+    written = 0
+    for chunk in split_chunks(texts_by_image, max_bytes):
+        payload = encode_payload(chunk)
+        file_name = f"chunk-{hashlib.sha256(payload.encode('ascii')).hexdigest()[:16]}.js"
+        written += write_script(output_dir / file_name, file_name, payload)
+        chunk_files.append(file_name)
+        for name in chunk:
+            chunk_of_image[name] = len(chunk_files) - 1
+
+    image_entries = []
+    for name, stem in images:
+        entry = {"name": name, "chunk": chunk_of_image[name]}
+        if stem in derivatives:
+            entry["thumbnail"] = derivatives[stem]["thumbnail"]
+        image_entries.append(entry)
+
+    index_data = {
+        "version": FORMAT_VERSION,
+        "images": image_entries,
+        "models": models,
+        "wer": wer_matrix,
+        "chunks": chunk_files,
+    }
+    written += write_script(output_dir / INDEX_SCRIPT, INDEX_SCRIPT, encode_payload(index_data))
+
+    # Morceaux d'une construction précédente qui ne sont plus référencés
+    for stale in output_dir.glob("chunk-*.js"):
+        if stale.name not in chunk_files:
+            stale.unlink()
+
+    return {"images": len(image_entries), "models": len(models), "chunks": len(chunk_files), "written": written}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Données compressées du viewer autonome (sans serveur).")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--output-dir", type=Path, default=STANDALONE_DIR, help="Dossier des données")
+    parser.add_argument("--images-dir", type=Path, default=IMAGES_DIR, help="Dossier des images")
+    parser.add_argument("--run", default=DEFAULT_RUN, help="Run des résultats à publier")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_MAX_BYTES,
+                        help="Taille maximale d'un morceau, en octets de JSON non compressé")
+    args = parser.parse_args()
+
+    summary = build_standalone_bundle(args.output_dir, args.images_dir, run=args.run, max_bytes=args.chunk_size)
+    print(f"{summary['images']} image(s), {summary['models']} modèle(s) en {summary['chunks']} morceau(x) "
+          f"dans {args.output_dir}/ ({summary['written']} fichier(s) écrit(s))")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""Registre de tâches partagé (SQLite) avec baux, battements de cœur et écritures atomiques.
+
+Plusieurs processus, sur une ou plusieurs machines partageant un système de fichiers,
+peuvent vider la même matrice (image × modèle) sans payer deux fois le même appel :
+chaque tâche est prise à bail par un seul worker, le bail est prolongé par des
+battements de cœur tant que le worker est vivant, et une tâche dont le bail a expiré
+(worker arrêté brutalement) redevient disponible pour les autres.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Durée d'un bail en secondes (prolongée par les battements de cœur)
+DEFAULT_LEASE_SECONDS = 300
+
+# Nombre de tentatives avant qu'une tâche soit marquée en échec
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Run par défaut (même nom que `results_store.DEFAULT_RUN`, qui importe ce module)
+DEFAULT_RUN = "default"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    image TEXT NOT NULL,
+    model TEXT NOT NULL,
+    run TEXT NOT NULL DEFAULT 'default',
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    updated_at REAL,
+    PRIMARY KEY (image, model, run)
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, lease_expires);
+"""
+
+
+def default_worker_id():
+    """Identifiant unique du worker courant (machine + processus)."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def write_json_atomic(path, data):
+    """
+    Écrit un fichier JSON de manière atomique (fichier temporaire puis renommage).
+
+    Un arrêt brutal pendant l'écriture laisse au pire un fichier `.tmp` orphelin,
+    jamais un JSON à moitié écrit qui serait pris pour un résultat terminé.
+    """
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def _scope_filter(images, models):
+    """
+    Clause SQL restreignant les tâches à des images et des modèles donnés (None : tous).
+    Les listes sont passées en un seul paramètre JSON, sans limite sur le nombre d'éléments.
+    """
+    clause, params = "", []
+    if images is not None:
+        clause += " AND image IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(list(images)))
+    if models is not None:
+        clause += " AND model IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(list(models)))
+    return clause, params
+
+
+class TaskLedger:
+    """
+    Registre des tâches (image, modèle, run) stocké dans une base SQLite. Les images sont
+    désignées par leur nom sans extension, comme dans le store des résultats.
+
+    Les états possibles d'une tâche sont `pending`, `leased`, `done` et `failed`.
+    """
+
+    def __init__(self, db_path, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.db_path = str(db_path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with self._connect() as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(tasks)")}
+            if columns and "run" not in columns:
+                # Registre créé avant les runs : la table est mise de côté puis reprise
+                conn.execute("ALTER TABLE tasks RENAME TO tasks_v1")
+                conn.execute("DROP INDEX IF EXISTS tasks_state")
+            conn.executescript(SCHEMA)
+        self._migrate_v1()
+
+    def _migrate_v1(self):
+        """
+        Reprend les tâches d'un registre créé avant les runs (clé image × modèle, images
+        désignées par leur nom de fichier) : elles passent dans le run par défaut, sous le
+        nom de l'image sans extension.
+        """
+        with self._transaction() as conn:
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tasks_v1'").fetchone():
+                return
+            rows = conn.execute(
+                "SELECT image, model, state, worker, lease_expires, attempts, last_error, updated_at FROM tasks_v1"
+            ).fetchall()
+            conn.executemany(
+                "INSERT OR IGNORE INTO tasks (image, model, run, state, worker, lease_expires, attempts, "
+                "last_error, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(os.path.splitext(image)[0], model, DEFAULT_RUN, *rest) for image, model, *rest in rows]
+            )
+            conn.execute("DROP TABLE tasks_v1")
+
+    @contextmanager
+    def _connect(self):
+        # Une connexion par opération : sûr entre threads et entre processus.
+        # Pas de WAL, qui ne fonctionne pas sur les systèmes de fichiers réseau.
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._connect() as conn:
+            # Verrou en écriture dès le début : deux workers ne peuvent pas prendre la même tâche
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def add_tasks(self, pairs, done_pairs=(), run=DEFAULT_RUN):
+        """
+        Enregistre des tâches (les tâches déjà connues sont conservées telles quelles).
+
+        Args:
+            pairs: Couples (image, modèle) à traiter
+            done_pairs: Couples dont le résultat existe déjà
+            run: Run des résultats (un même registre peut servir à plusieurs runs)
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO tasks (image, model, run, updated_at) VALUES (?, ?, ?, ?)",
+                [(image, model, run, now) for image, model in pairs]
+            )
+            conn.executemany(
+                "UPDATE tasks SET state = 'done', worker = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE image = ? AND model = ? AND run = ? AND state != 'done'",
+                [(now, image, model, run) for image, model in done_pairs]
+            )
+
+    def claim(self, worker_id, limit=1, provider=None, images=None, models=None, run=DEFAULT_RUN):
+        """
+        Prend à bail jusqu'à `limit` tâches en attente ou dont le bail a expiré.
+
+        Un worker ne doit prendre que les tâches qu'il sait traiter : une tâche prise puis
+        rendue compterait une tentative et finirait en échec sans avoir été essayée.
+
+        Args:
+            worker_id: Identifiant du worker
+            limit: Nombre maximal de tâches
+            provider: Ne prendre que les modèles de ce fournisseur (préfixe de l'ID)
+            images: Ne prendre que ces images (toutes si None)
+            models: Ne prendre que ces modèles (tous si None)
+            run: Run des tâches
+
+        Returns:
+            list: Couples (image, modèle) obtenus
+        """
+        if limit <= 0:
+            return []
+        now = time.time()
+        query = (
+            "SELECT image, model FROM tasks "
+            "WHERE run = ? AND (state = 'pending' OR (state = 'leased' AND lease_expires < ?))"
+        )
+        params = [run, now]
+        if provider is not None:
+            # Comparaison littérale du préfixe : `_` et `%` sont fréquents dans les IDs de modèles
+            prefix = f"{provider}/"
+            query += " AND substr(model, 1, ?) = ?"
+            params.extend([len(prefix), prefix])
+        scope, scope_params = _scope_filter(images, models)
+        query += scope
+        params.extend(scope_params)
+        query += " ORDER BY attempts, RANDOM() LIMIT ?"
+        params.append(limit)
+
+        with self._transaction() as conn:
+            rows = conn.execute(query, params).fetchall()
+            conn.executemany(
+                "UPDATE tasks SET state = 'leased', worker = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE image = ? AND model = ? AND run = ?",
+                [(worker_id, now + self.lease_seconds, now, image, model, run) for image, model in rows]
+            )
+        return rows
+
+    def heartbeat(self, worker_id):
+        """Prolonge les baux de toutes les tâches détenues par un worker."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET lease_expires = ?, updated_at = ? WHERE worker = ? AND state = 'leased'",
+                (now + self.lease_seconds, now, worker_id)
+            )
+
+    def complete(self, image, model, worker_id, run=DEFAULT_RUN):
+        """Marque une tâche comme terminée (seulement si le worker en détient toujours le bail)."""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET state = 'done', lease_expires = NULL, last_error = NULL, updated_at = ? "
+                "WHERE image = ? AND model = ? AND run = ? AND worker = ? AND state = 'leased'",
+                (time.time(), image, model, run, worker_id)
+            )
+            return cursor.rowcount == 1
+
+    def release(self, image, model, worker_id, error=None, count_attempt=True, run=DEFAULT_RUN):
+        """
+        Rend une tâche en échec : elle redevient disponible, ou passe à l'état `failed`
+        une fois le nombre maximal de tentatives atteint.
+
+        Avec `count_attempt=False`, la tâche est rendue sans avoir été essayée : la
+        tentative comptée par `claim` est annulée et la tâche redevient disponible.
+        """
+        with self._transaction() as conn:
+            if count_attempt:
+                conn.execute(
+                    "UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                    "worker = NULL, lease_expires = NULL, last_error = ?, updated_at = ? "
+                    "WHERE image = ? AND model = ? AND run = ? AND worker = ? AND state = 'leased'",
+                    (self.max_attempts, error, time.time(), image, model, run, worker_id)
+                )
+            else:
+                conn.execute(
+                    "UPDATE tasks SET state = 'pending', attempts = MAX(attempts - 1, 0), "
+                    "worker = NULL, lease_expires = NULL, updated_at = ? "
+                    "WHERE image = ? AND model = ? AND run = ? AND worker = ? AND state = 'leased'",
+                    (time.time(), image, model, run, worker_id)
+                )
+
+    def counts(self, images=None, models=None, run=DEFAULT_RUN):
+        """Nombre de tâches d'un run par état (restreint à certaines images ou certains modèles)."""
+        scope, params = _scope_filter(images, models)
+        with self._connect() as conn:
+            return dict(conn.execute(
+                f"SELECT state, COUNT(*) FROM tasks WHERE run = ?{scope} GROUP BY state", [run, *params]
+            ).fetchall())
+
+    def remaining(self, images=None, models=None, run=DEFAULT_RUN):
+        """Nombre de tâches d'un run encore en attente ou en cours chez un worker."""
+        counts = self.counts(images, models, run)
+        return counts.get("pending", 0) + counts.get("leased", 0)
+
+
+class LeaseHeartbeat:
+    """
+    Thread de fond qui prolonge régulièrement les baux d'un worker.
+
+    S'utilise comme gestionnaire de contexte autour de la boucle de travail.
+    """
+
+    def __init__(self, ledger, worker_id, interval=None):
+        self.ledger = ledger
+        self.worker_id = worker_id
+        self.interval = interval or ledger.lease_seconds / 3
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lease-heartbeat", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.ledger.heartbeat(self.worker_id)
+            except sqlite3.Error as e:
+                print(f"Battement de cœur impossible pour {self.worker_id}: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
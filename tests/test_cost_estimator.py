@@ -0,0 +1,101 @@
+"""Tests de la sélection sous budget et du garde-fou (`cost_estimator.py`)."""
+
+from pathlib import Path
+
+import pytest
+
+from cost_estimator import BudgetExceededError, BudgetGuard, plan_budget
+
+
+def make_tasks(costs):
+    """Tâches et estimations à partir de {modèle: [coût de chaque page]}."""
+    tasks, estimates = [], {}
+    for model, page_costs in costs.items():
+        for number, cost in enumerate(page_costs, start=1):
+            img_path = Path(f"doc_page_{number}.png")
+            tasks.append((img_path, (model, "openrouter")))
+            estimates[(img_path.stem, model)] = {"cost": cost}
+    return tasks, estimates
+
+
+def selected_pages(selected):
+    pages = {}
+    for img_path, (model, _) in selected:
+        pages.setdefault(model, []).append(img_path.stem)
+    return pages
+
+
+def test_plan_budget_covers_every_model_before_deepening_one():
+    tasks, estimates = make_tasks({"cheap": [0.01] * 10, "pricey": [0.05] * 10})
+
+    selected, skipped, planned = plan_budget(tasks, estimates, budget=0.12)
+
+    pages = selected_pages(selected)
+    assert len(pages["pricey"]) >= 1
+    assert len(pages["cheap"]) > len(pages["pricey"])
+    assert planned == pytest.approx(sum(estimates[(img.stem, m)]["cost"] for img, (m, _) in selected))
+    assert planned <= 0.12
+    assert len(selected) + len(skipped) == len(tasks)
+
+
+def test_plan_budget_prefers_cheapest_pages_and_runs_free_tasks_first():
+    tasks, estimates = make_tasks({"paid": [0.30, 0.10, 0.20], "free": [0.0, 0.0]})
+
+    selected, skipped, planned = plan_budget(tasks, estimates, budget=0.25)
+
+    assert [model for _, (model, _) in selected[:2]] == ["free", "free"]
+    assert selected_pages(selected)["paid"] == ["doc_page_2"]
+    assert planned == pytest.approx(0.10)
+    assert {img.stem for img, _ in skipped} == {"doc_page_1", "doc_page_3"}
+
+
+def transcription(cost):
+    return lambda: {"result": "texte", "model_info": {"total_cost": cost}}
+
+
+def test_budget_guard_reserves_estimate_with_margin():
+    estimates = {("p1", "m"): {"cost": 1.0}, ("p2", "m"): {"cost": 1.0}}
+    guard = BudgetGuard(budget=2.4, estimates=estimates, margin=1.25)
+
+    guard.call(Path("p1.png"), "m", transcription(1.0))
+    assert guard.spent == pytest.approx(1.0)
+    assert guard.reserved == pytest.approx(0.0)
+
+    # 1.0 dépensé + 1.25 réservé tient dans 2.4 ; sans la marge, 1.0 + 1.0 aussi
+    guard.call(Path("p2.png"), "m", transcription(1.0))
+    with pytest.raises(BudgetExceededError):
+        guard.call(Path("p1.png"), "m", transcription(0.1))
+
+
+def test_budget_guard_scales_reservation_by_observed_ratio():
+    estimates = {(f"p{n}", "m"): {"cost": 1.0} for n in range(3)}
+    guard = BudgetGuard(budget=6.0, estimates=estimates, margin=1.0)
+
+    guard.call(Path("p0.png"), "m", transcription(2.0))
+    reservations = []
+
+    def spy():
+        reservations.append(guard.reserved)
+        return {"model_info": {"total_cost": 1.0}}
+
+    guard.call(Path("p1.png"), "m", spy)
+
+    assert reservations == [pytest.approx(2.0)]
+    assert guard.spent == pytest.approx(3.0)
+
+
+def test_budget_guard_charges_nothing_for_failed_calls():
+    estimates = {("p1", "m"): {"cost": 1.0}}
+    guard = BudgetGuard(budget=1.5, estimates=estimates, margin=1.25)
+
+    def failing():
+        raise RuntimeError("erreur du fournisseur")
+
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            guard.call(Path("p1.png"), "m", failing)
+
+    assert guard.spent == 0.0
+    assert guard.reserved == pytest.approx(0.0)
+    guard.call(Path("p1.png"), "m", transcription(1.0))
+    assert guard.spent == pytest.approx(1.0)
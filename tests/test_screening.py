@@ -0,0 +1,103 @@
+"""Tests de la présélection des modèles (`screening.py`)."""
+
+import math
+import statistics
+from pathlib import Path
+
+import pytest
+
+from screening import WER_CAP, paired_gap, run_screening, screen_round, stratified_order
+
+
+def pages(document, count):
+    return [Path(f"{document}_page_{number}.png") for number in range(1, count + 1)]
+
+
+def test_stratified_order_takes_every_document_before_repeating_one():
+    images = pages("a", 5) + pages("b", 2) + pages("c", 3)
+
+    ordered = stratified_order(images, seed=3)
+
+    assert sorted(ordered) == sorted(images)
+    first_round = {img_path.stem.rsplit("_page_", 1)[0] for img_path in ordered[:3]}
+    assert first_round == {"a", "b", "c"}
+    second_round = {img_path.stem.rsplit("_page_", 1)[0] for img_path in ordered[3:6]}
+    assert second_round == {"a", "b", "c"}
+
+
+def test_stratified_order_is_reproducible_for_a_seed():
+    images = pages("a", 6) + pages("b", 6)
+
+    assert stratified_order(images, seed=1) == stratified_order(list(reversed(images)), seed=1)
+
+
+def test_paired_gap_uses_common_pages_and_caps_wer():
+    scores = {
+        "best": {"p1": 0.1, "p2": 0.2, "p3": 0.3},
+        "other": {"p1": 0.3, "p2": 0.4, "p3": 40.0, "p4": 0.0},
+    }
+
+    gap, stderr, common = paired_gap(scores, "other", "best")
+
+    diffs = [0.2, 0.2, WER_CAP - 0.3]
+    assert common == 3
+    assert gap == pytest.approx(sum(diffs) / 3)
+    assert stderr == pytest.approx(statistics.stdev(diffs) / math.sqrt(3))
+
+
+def test_paired_gap_without_enough_common_pages():
+    assert paired_gap({"a": {"p1": 0.5}, "b": {"p2": 0.1}}, "a", "b") == (None, math.inf, 0)
+    assert paired_gap({"a": {"p1": 0.5}, "b": {"p1": 0.1}}, "a", "b") == (pytest.approx(0.4), math.inf, 1)
+
+
+def test_screen_round_eliminates_a_significantly_worse_model_only():
+    best = {f"p{n}": 0.10 for n in range(8)}
+    close = {f"p{n}": 0.10 + (0.02 if n % 2 else -0.02) for n in range(8)}
+    worse = {f"p{n}": 0.60 + 0.01 * n for n in range(8)}
+
+    rows = screen_round({"best": best, "close": close, "worse": worse, "silent": {}},
+                        margin=0.1, keep_fraction=1.0, min_models=1)
+
+    decisions = {row["model"]: row["promoted"] for row in rows}
+    assert decisions == {"best": True, "close": True, "worse": False, "silent": False}
+    assert rows[0]["model"] in {"best", "close"}
+
+
+class FakeStore:
+    """Store en mémoire : chaque modèle transcrit parfaitement ou rend une page vide."""
+
+    def __init__(self, references, good_models):
+        self.references = references
+        self.good_models = good_models
+        self.records = {}
+
+    def transcribe(self, images, models):
+        for img_path in images:
+            for model, _ in models:
+                text = self.references.get(img_path.stem, "texte") if model in self.good_models else ""
+                self.records[(img_path.stem, model)] = text
+
+    def iter_records(self, model=None):
+        for (image, record_model), text in self.records.items():
+            if record_model == model:
+                yield {"image_name": image, "result": text}
+
+
+def test_run_screening_transcribes_unreferenced_pages_with_retained_models(tmp_path, monkeypatch):
+    images = pages("a", 4) + pages("b", 4)
+    references = {img_path.stem: f"texte de la page {img_path.stem}" for img_path in images[:6]}
+    for stem, text in references.items():
+        (tmp_path / f"{stem}.md").write_text(text, encoding="utf-8")
+    store = FakeStore(references, good_models={"bon"})
+    calls = []
+
+    def run_round(sample, models):
+        calls.append(({img_path.stem for img_path in sample}, [model for model, _ in models]))
+        store.transcribe(sample, models)
+
+    rounds = run_screening(images, [("bon", "t"), ("mauvais", "t")], store, run_round,
+                           reference_dir=tmp_path, initial_pages=2, min_models=1, keep_fraction=1.0)
+
+    assert rounds[-1]["final"]
+    assert all(stem in references for stem in rounds[-1]["pages"])
+    assert calls[-1] == ({"b_page_3", "b_page_4"}, ["bon"])
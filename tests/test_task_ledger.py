@@ -0,0 +1,148 @@
+"""Tests du registre de tâches partagé (`task_ledger.py`)."""
+
+import sqlite3
+import time
+
+import pytest
+
+from task_ledger import TaskLedger
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    return TaskLedger(tmp_path / "ledger.sqlite", lease_seconds=60, max_attempts=2)
+
+
+def states(ledger):
+    with ledger._connect() as conn:
+        return {
+            (image, model): (state, worker, attempts)
+            for image, model, state, worker, attempts in conn.execute(
+                "SELECT image, model, state, worker, attempts FROM tasks"
+            )
+        }
+
+
+def test_claim_leases_each_task_once(ledger):
+    ledger.add_tasks([("p1.png", "openai/gpt-4o"), ("p2.png", "openai/gpt-4o")])
+
+    first = ledger.claim("w1", limit=1)
+    second = ledger.claim("w2", limit=5)
+
+    assert len(first) == 1
+    assert sorted(first + second) == [("p1.png", "openai/gpt-4o"), ("p2.png", "openai/gpt-4o")]
+    assert ledger.claim("w3", limit=5) == []
+    assert ledger.counts() == {"leased": 2}
+
+
+def test_add_tasks_marks_done_pairs(ledger):
+    ledger.add_tasks([("p1.png", "m/a"), ("p2.png", "m/a")], done_pairs=[("p1.png", "m/a")])
+
+    assert ledger.claim("w1", limit=5) == [("p2.png", "m/a")]
+    assert ledger.remaining() == 1
+
+
+def test_claim_filters_provider_literally(ledger):
+    # `_` est un joker de LIKE : `my_ai/` ne doit pas correspondre à `myXai/`
+    ledger.add_tasks([("p1.png", "myXai/model"), ("p1.png", "my_ai/model")])
+
+    assert ledger.claim("w1", limit=5, provider="my_ai") == [("p1.png", "my_ai/model")]
+    assert ledger.claim("w1", limit=5, provider="my%") == []
+
+
+def test_claim_is_restricted_to_worker_scope(ledger):
+    ledger.add_tasks([("p1.png", "m/a"), ("p2.png", "m/a"), ("p1.png", "m/b")])
+
+    claimed = ledger.claim("w1", limit=5, images={"p1.png"}, models=["m/a"])
+
+    assert claimed == [("p1.png", "m/a")]
+    assert ledger.remaining(images={"p1.png"}, models=["m/a"]) == 1
+    assert ledger.counts(images={"p2.png"}) == {"pending": 1}
+    # Les tâches hors périmètre ne sont jamais touchées
+    assert states(ledger)[("p2.png", "m/a")] == ("pending", None, 0)
+
+
+def test_expired_lease_can_be_taken_over(tmp_path):
+    ledger = TaskLedger(tmp_path / "ledger.sqlite", lease_seconds=0.05)
+    ledger.add_tasks([("p1.png", "m/a")])
+
+    assert ledger.claim("w1") == [("p1.png", "m/a")]
+    assert ledger.claim("w2") == []
+    time.sleep(0.1)
+    assert ledger.claim("w2") == [("p1.png", "m/a")]
+
+    # L'ancien détenteur a perdu le bail : ni sa complétion ni son échec ne comptent
+    assert not ledger.complete("p1.png", "m/a", "w1")
+    ledger.release("p1.png", "m/a", "w1", error="trop tard")
+    assert states(ledger)[("p1.png", "m/a")] == ("leased", "w2", 2)
+    assert ledger.complete("p1.png", "m/a", "w2")
+    assert ledger.counts() == {"done": 1}
+
+
+def test_heartbeat_extends_lease(tmp_path):
+    ledger = TaskLedger(tmp_path / "ledger.sqlite", lease_seconds=0.2)
+    ledger.add_tasks([("p1.png", "m/a")])
+    ledger.claim("w1")
+
+    time.sleep(0.15)
+    ledger.heartbeat("w1")
+    time.sleep(0.1)
+
+    assert ledger.claim("w2") == []
+
+
+def test_release_fails_task_after_max_attempts(ledger):
+    ledger.add_tasks([("p1.png", "m/a")])
+
+    ledger.claim("w1")
+    ledger.release("p1.png", "m/a", "w1", error="HTTP 500")
+    assert states(ledger)[("p1.png", "m/a")] == ("pending", None, 1)
+
+    ledger.claim("w1")
+    ledger.release("p1.png", "m/a", "w1", error="HTTP 500")
+    assert states(ledger)[("p1.png", "m/a")] == ("failed", None, 2)
+    assert ledger.claim("w1") == []
+    assert ledger.remaining() == 0
+
+
+def test_release_without_counting_attempt(ledger):
+    ledger.add_tasks([("p1.png", "m/a")])
+
+    for _ in range(5):
+        assert ledger.claim("w1") == [("p1.png", "m/a")]
+        ledger.release("p1.png", "m/a", "w1", count_attempt=False)
+
+    assert states(ledger)[("p1.png", "m/a")] == ("pending", None, 0)
+
+
+def test_one_ledger_serves_several_runs(ledger):
+    ledger.add_tasks([("p1", "m/a")], done_pairs=[("p1", "m/a")])
+    ledger.add_tasks([("p1", "m/a")], run="tiled")
+
+    # Le couple terminé dans le run par défaut reste à faire dans le run `tiled`
+    assert ledger.claim("w1") == []
+    assert ledger.claim("w1", run="tiled") == [("p1", "m/a")]
+    assert not ledger.complete("p1", "m/a", "w1")
+    assert ledger.complete("p1", "m/a", "w1", run="tiled")
+    assert ledger.counts() == {"done": 1}
+    assert ledger.counts(run="tiled") == {"done": 1}
+    assert ledger.remaining(run="tiled") == 0
+
+
+def test_ledger_without_runs_is_migrated(tmp_path):
+    db_path = tmp_path / "ledger.sqlite"
+    conn = sqlite3.connect(db_path)
+    conn.executescript(
+        "CREATE TABLE tasks (image TEXT NOT NULL, model TEXT NOT NULL, state TEXT NOT NULL DEFAULT 'pending', "
+        "worker TEXT, lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, last_error TEXT, updated_at REAL, "
+        "PRIMARY KEY (image, model));"
+        "CREATE INDEX tasks_state ON tasks (state, lease_expires);"
+        "INSERT INTO tasks (image, model, state, attempts) VALUES ('p1.png', 'm/a', 'done', 1), ('p2.png', 'm/a', 'pending', 0);"
+    )
+    conn.commit()
+    conn.close()
+
+    ledger = TaskLedger(db_path)
+
+    assert states(ledger) == {("p1", "m/a"): ("done", None, 1), ("p2", "m/a"): ("pending", None, 0)}
+    assert ledger.claim("w1") == [("p2", "m/a")]
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Transcription par tuiles des pages grandes ou à plusieurs colonnes.
+
+Au lieu de réduire tout le scan pour respecter les limites des fournisseurs, la page est
+découpée en blocs de texte :
+  1. les colonnes (deux colonnes, double page imprimée) sont séparées par les gouttières
+     du profil de projection vertical du masque d'encre ;
+  2. chaque colonne est découpée entre deux lignes de texte (profil de projection
+     horizontal) en blocs qui tiennent dans un budget de pixels.
+Les tuiles, recadrées dans l'image d'origine, sont envoyées au modèle en parallèle puis
+les transcriptions sont recousues dans l'ordre de lecture (colonnes de gauche à droite,
+blocs de haut en bas).
+
+Le mode est lancé depuis le runner : `python run_benchmark.py --tiling` ; les résultats
+sont enregistrés dans le run `tiled` du store.
+"""
+
+import concurrent.futures
+import contextvars
+import re
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image
+
+from api_clients import query_model
+from image_analysis import detect_columns, ink_mask, load_grayscale, text_line_bands
+
+# Run du store où sont enregistrés les résultats par tuiles
+TILED_RUN = "tiled"
+
+# Nombre maximal de pixels d'une tuile dans l'image d'origine
+DEFAULT_TILE_MAX_PIXELS = 8_000_000
+
+# Tuiles envoyées simultanément pour une même page
+DEFAULT_TILE_WORKERS = 4
+
+# Marge ajoutée autour de chaque tuile (fraction du plus grand côté de la page)
+TILE_PADDING = 0.01
+
+FENCE = re.compile(r"^\s*```(?:markdown)?\s*\n?(.*?)\n?```\s*$", re.DOTALL)
+
+
+def split_blocks(bands, max_height):
+    """
+    Regroupe des lignes de texte consécutives en blocs d'au plus `max_height` pixels.
+
+    Les coupures tombent au milieu de l'interligne, jamais à travers une ligne.
+
+    Returns:
+        list: Intervalles [y0, y1) de haut en bas
+    """
+    blocks = []
+    start, end = bands[0]
+    for band_start, band_end in bands[1:]:
+        if band_end - start > max_height:
+            cut = (end + band_start) // 2
+            blocks.append((start, cut))
+            start = cut
+        end = band_end
+    blocks.append((start, end))
+    return blocks
+
+
+def plan_tiles(image_path, max_tile_pixels=DEFAULT_TILE_MAX_PIXELS):
+    """
+    Calcule les tuiles d'une page dans l'ordre de lecture.
+
+    Returns:
+        list: Boîtes (gauche, haut, droite, bas) en pixels de l'image d'origine
+    """
+    gray, scale = load_grayscale(image_path)
+    mask = ink_mask(gray)
+    with Image.open(image_path) as img:
+        original_width, original_height = img.size
+    padding = int(TILE_PADDING * max(original_width, original_height))
+
+    boxes = []
+    for x0, x1 in detect_columns(mask):
+        bands = text_line_bands(mask[:, x0:x1])
+        if not bands:
+            continue
+        column_width = (x1 - x0) / scale
+        max_height = max(1, int(max_tile_pixels / column_width * scale))
+        for y0, y1 in split_blocks(bands, max_height):
+            boxes.append((
+                max(0, int(x0 / scale) - padding),
+                max(0, int(y0 / scale) - padding),
+                min(original_width, int(x1 / scale) + padding),
+                min(original_height, int(y1 / scale) + padding),
+            ))
+    return boxes or [(0, 0, original_width, original_height)]
+
+
+def strip_markdown_fence(text):
+    """Retire le bloc ```markdown``` qui entoure parfois une transcription."""
+    match = FENCE.match(text or "")
+    return match.group(1).strip() if match else (text or "").strip()
+
+
+def transcribe_tiled(image_path, model, max_workers=DEFAULT_TILE_WORKERS, max_tile_pixels=DEFAULT_TILE_MAX_PIXELS):
+    """
+    Transcrit une page tuile par tuile, en parallèle, puis recoud le texte.
+
+    Même signature de retour que `api_clients.query_model` : la réponse porte le texte
+    recousu dans `result`, l'usage et le coût cumulés de toutes les tuiles, et la
+    réponse de chaque tuile dans `tiles`.
+
+    Returns:
+        tuple: (response_data, cost)
+    """
+    boxes = plan_tiles(image_path, max_tile_pixels)
+    with tempfile.TemporaryDirectory(prefix="htr-tiles-") as tmp_dir:
+        tile_paths = []
+        with Image.open(image_path) as img:
+            img = img.convert("RGB")
+            for index, box in enumerate(boxes):
+                tile_path = Path(tmp_dir) / f"{Path(image_path).stem}_tile_{index:02d}.jpg"
+                img.crop(box).save(tile_path, format="JPEG", quality=95)
+                tile_paths.append(tile_path)
+
+        start_time = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="htr-tile") as executor:
+            # Chaque tuile s'exécute dans une copie du contexte courant : ses intervalles de
+            # traçage restent rattachés à celui de la tâche. map conserve l'ordre des tuiles,
+            # donc l'ordre de lecture
+            contexts = [contextvars.copy_context() for _ in tile_paths]
+            responses = list(executor.map(
+                lambda context, tile_path: context.run(query_model, str(tile_path), model), contexts, tile_paths
+            ))
+        latency = time.perf_counter() - start_time
+
+    texts, tiles = [], []
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    total_cost = 0.0
+    for box, (response_data, cost) in zip(boxes, responses):
+        if response_data.get("choices"):
+            text = response_data["choices"][0]["message"]["content"]
+        else:
+            text = response_data.get("result", "")
+        texts.append(strip_markdown_fence(text))
+        tile_usage = response_data.get("usage") or {}
+        for key in usage:
+            usage[key] += tile_usage.get(key) or 0
+        total_cost += cost or 0.0
+        tiles.append({"box": list(box), "response": response_data})
+
+    response_data = {
+        "result": "\n\n".join(text for text in texts if text),
+        "usage": usage,
+        "tiles": tiles,
+        "model_info": {
+            "id": model,
+            "pricing": (tiles[0]["response"].get("model_info") or {}).get("pricing", (0, 0)),
+            "total_cost": total_cost,
+            "tiles": len(tiles),
+            "tiles_latency": latency,
+        },
+    }
+    return response_data, round(total_cost, 12)
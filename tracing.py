@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Traces des appels de transcription : une durée par étape de chaque tâche (image, modèle).
+
+Chaque tâche est une trace faite d'intervalles (spans) imbriqués : décodage de l'image,
+recherche de la qualité JPEG, encodage base64, récupération des tarifs, requête réseau,
+lecture de la réponse, écriture du résultat ; pour Kraken, chargement des modèles,
+segmentation et reconnaissance. Les intervalles terminés sont ajoutés, un par ligne,
+à un fichier JSONL.
+
+Le traçage est désactivé par défaut (les intervalles ne coûtent alors qu'un test) ; il est
+activé par `--trace` (run_benchmark.py, benchmark_kraken.py) ou par la variable
+d'environnement `HTR_TRACE=<fichier>`, héritée par les processus de travail.
+
+  python tracing.py report                      # temps par étape, modèle et fournisseur
+  python tracing.py report --by provider --output rapports/traces.md
+  python tracing.py export --output traces.otlp.json
+  python tracing.py export --endpoint http://localhost:4318/v1/traces
+
+L'export suit le format OTLP/JSON d'OpenTelemetry, lisible par un collecteur
+(Jaeger, Tempo...).
+"""
+
+import argparse
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+TRACE_FILE = Path("cache") / "traces.jsonl"
+
+# Variable d'environnement qui active le traçage (chemin du fichier JSONL)
+TRACE_ENV = "HTR_TRACE"
+
+# Attributs transmis par un intervalle à ses descendants, pour regrouper les étapes
+INHERITED_ATTRIBUTES = ("model", "provider", "image", "run")
+
+# Nom de l'intervalle racine d'une tâche (image, modèle)
+TASK_SPAN = "task"
+
+# Service déclaré dans l'export OpenTelemetry
+SERVICE_NAME = "533yes-htr-benchmark"
+
+_current = contextvars.ContextVar("htr_current_span", default=None)
+_exporter = None
+
+
+class JsonlExporter:
+    """
+    Ajoute les intervalles terminés à un fichier JSONL, une ligne par intervalle.
+
+    Chaque ligne est écrite d'un seul appel en mode ajout : plusieurs threads et processus
+    peuvent partager le fichier. Le fichier est rouvert après un fork.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._file = None
+        self._pid = None
+
+    def export(self, record):
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file is None or self._pid != os.getpid():
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+                self._pid = os.getpid()
+            self._file.write(line)
+            self._file.flush()
+
+
+class Span:
+    """Intervalle mesuré d'une étape ; s'utilise comme gestionnaire de contexte."""
+
+    __slots__ = ("name", "attributes", "inherited", "trace_id", "span_id", "parent_id", "start", "error",
+                 "_started", "_token")
+
+    def __init__(self, name, attributes, parent):
+        self.name = name
+        self.inherited = dict(parent.inherited) if parent else {}
+        self.inherited.update((key, value) for key, value in attributes.items() if key in INHERITED_ATTRIBUTES)
+        self.attributes = {key: value for key, value in attributes.items() if key not in INHERITED_ATTRIBUTES}
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.error = None
+
+    def set(self, **attributes):
+        """Ajoute des attributs à l'intervalle (taille, statut HTTP, qualité...)."""
+        self.attributes.update(attributes)
+
+    def fail(self, message):
+        """Marque l'intervalle en erreur quand l'exception est interceptée avant sa fin."""
+        self.error = message
+
+    def __enter__(self):
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._started
+        _current.reset(self._token)
+        record = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(duration * 1000, 3),
+            **self.inherited,
+            "attributes": self.attributes,
+            "status": "ok" if exc_type is None and self.error is None else "error",
+            "pid": os.getpid(),
+            "thread": threading.current_thread().name,
+        }
+        if exc_type is not None:
+            record["error"] = f"{exc_type.__name__}: {exc}"
+        elif self.error is not None:
+            record["error"] = self.error
+        exporter = _exporter
+        if exporter is not None:
+            exporter.export(record)
+        return False
+
+
+class _NoopSpan:
+    """Intervalle renvoyé quand le traçage est désactivé : aucune mesure, aucune écriture."""
+
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def fail(self, message):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def configure(path=TRACE_FILE):
+    """
+    Active le traçage vers un fichier JSONL, ou le désactive (`path=None`).
+    La variable d'environnement est mise à jour pour les processus lancés ensuite.
+    """
+    global _exporter
+    if path is None:
+        _exporter = None
+        os.environ.pop(TRACE_ENV, None)
+    else:
+        _exporter = JsonlExporter(path)
+        os.environ[TRACE_ENV] = str(path)
+
+
+def configure_from_env():
+    """Active le traçage si `HTR_TRACE` désigne un fichier (processus de travail)."""
+    global _exporter
+    path = os.environ.get(TRACE_ENV)
+    if path and (_exporter is None or _exporter.path != Path(path)):
+        _exporter = JsonlExporter(path)
+
+
+def span(name, **attributes):
+    """
+    Intervalle d'une étape, enfant de l'intervalle courant du thread.
+
+    Les attributs `model`, `provider`, `image` et `run` sont transmis aux descendants.
+
+        with span("http.request", url=url) as s:
+            response = requests.post(url, ...)
+            s.set(status_code=response.status_code)
+    """
+    if _exporter is None:
+        return NOOP_SPAN
+    return Span(name, attributes, _current.get())
+
+
+def read_spans(path=TRACE_FILE):
+    """Intervalles d'un fichier JSONL (les lignes tronquées d'un arrêt brutal sont ignorées)."""
+    spans = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                spans.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return spans
+
+
+def percentile(sorted_values, fraction):
+    """Quantile par rang le plus proche d'une liste triée."""
+    if not sorted_values:
+        return None
+    rank = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(spans, by="model"):
+    """
+    Temps par étape, regroupé par modèle (et fournisseur) ou par fournisseur seul.
+
+    La part d'une étape est rapportée au temps total des tâches du même groupe ; les étapes
+    imbriquées se recouvrent, leurs parts ne s'additionnent donc pas.
+
+    Returns:
+        list: Lignes (groupe, étape, nombre, total en s, moyenne, p50 et p95 en ms, part,
+              erreurs), triées par groupe puis par temps total décroissant
+    """
+    def group_of(record):
+        provider = record.get("provider") or "?"
+        return provider if by == "provider" else f"{provider} / {record.get('model') or '?'}"
+
+    durations = defaultdict(list)
+    errors = defaultdict(int)
+    task_time = defaultdict(float)
+    for record in spans:
+        key = (group_of(record), record["name"])
+        durations[key].append(record["duration_ms"])
+        errors[key] += record.get("status") == "error"
+        if record["name"] == TASK_SPAN:
+            task_time[key[0]] += record["duration_ms"]
+
+    rows = []
+    for (group, name), values in durations.items():
+        values.sort()
+        total = sum(values)
+        rows.append({
+            "group": group,
+            "stage": name,
+            "count": len(values),
+            "total_s": total / 1000,
+            "mean_ms": total / len(values),
+            "p50_ms": percentile(values, 0.5),
+            "p95_ms": percentile(values, 0.95),
+            "share": total / task_time[group] if task_time.get(group) else None,
+            "errors": errors[(group, name)],
+        })
+    rows.sort(key=lambda row: (row["group"], -row["total_s"]))
+    return rows
+
+
+def format_report(rows, by="model"):
+    """Tableau Markdown du résumé."""
+    lines = [
+        "# Temps par étape des appels de transcription",
+        "",
+        "Part : temps de l'étape rapporté au temps total des tâches du groupe "
+        "(les étapes imbriquées se recouvrent).",
+        "",
+        f"| {'Fournisseur' if by == 'provider' else 'Fournisseur / modèle'} | Étape | Appels | Total (s) "
+        "| Moyenne (ms) | p50 (ms) | p95 (ms) | Part | Erreurs |",
+        "|:---|:---|---:|---:|---:|---:|---:|---:|---:|",
+    ]
+    for row in rows:
+        share = f"{row['share']:.0%}" if row["share"] is not None else ""
+        lines.append(f"| {row['group']} | {row['stage']} | {row['count']} | {row['total_s']:.2f} "
+                     f"| {row['mean_ms']:.1f} | {row['p50_ms']:.1f} | {row['p95_ms']:.1f} | {share} "
+                     f"| {row['errors']} |")
+    return "\n".join(lines) + "\n"
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans):
+    """
+    Intervalles au format OTLP/JSON d'OpenTelemetry (un seul service, une seule portée).
+
+    Returns:
+        dict: Corps d'une requête `POST /v1/traces` d'un collecteur OTLP/HTTP
+    """
+    otlp_spans = []
+    for record in spans:
+        start_ns = int(record["start"] * 1e9)
+        attributes = {key: record[key] for key in INHERITED_ATTRIBUTES if record.get(key) is not None}
+        attributes.update(record.get("attributes") or {})
+        attributes.update({"process.pid": record.get("pid"), "thread.name": record.get("thread")})
+        otlp_span = {
+            "traceId": record["trace_id"],
+            "spanId": record["span_id"],
+            "name": record["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(start_ns + int(record["duration_ms"] * 1e6)),
+            "attributes": [{"key": key, "value": _otlp_value(value)}
+                           for key, value in attributes.items() if value is not None],
+            "status": {"code": 2, "message": record.get("error", "")} if record.get("status") == "error"
+            else {"code": 1},
+        }
+        if record.get("parent_id"):
+            otlp_span["parentSpanId"] = record["parent_id"]
+        otlp_spans.append(otlp_span)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": otlp_spans}],
+        }]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Traces des appels de transcription : rapport et export.")
+    parser.add_argument("command", choices=["report", "export"])
+    parser.add_argument("--trace-file", type=Path, default=TRACE_FILE, help="Fichier JSONL des intervalles")
+    parser.add_argument("--by", choices=["model", "provider"], default="model",
+                        help="Regroupement du rapport (défaut : %(default)s)")
+    parser.add_argument("--output", type=Path, help="Fichier de sortie (rapport Markdown ou export OTLP/JSON)")
+    parser.add_argument("--endpoint", help="Collecteur OTLP/HTTP auquel envoyer l'export (…/v1/traces)")
+    args = parser.parse_args()
+
+    spans = read_spans(args.trace_file)
+    if args.command == "report":
+        report = format_report(summarize(spans, args.by), args.by)
+        if args.output:
+            args.output.write_text(report, encoding="utf-8")
+            print(f"Rapport écrit dans {args.output} ({len(spans)} intervalles)")
+        else:
+            print(report)
+        return
+
+    payload = to_otlp(spans)
+    if args.output:
+        args.output.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+        print(f"{len(spans)} intervalles exportés dans {args.output}")
+    if args.endpoint:
+        import requests
+        response = requests.post(args.endpoint, json=payload, timeout=30)
+        response.raise_for_status()
+        print(f"{len(spans)} intervalles envoyés à {args.endpoint}")
+    if not args.output and not args.endpoint:
+        parser.error("export demande --output ou --endpoint")
+
+
+configure_from_env()
+
+if __name__ == "__main__":
+    main()
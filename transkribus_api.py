@@ -4,6 +4,8 @@ import base64
 from pathlib import Path
 from dotenv import load_dotenv
 from typing import Dict, Tuple, Optional
+from api_errors import APIError
+from tracing import span
 
 # Load environment variables
 load_dotenv()
@@ -30,7 +32,7 @@ class TranskribusAPI:
             headers=self.headers
         )
         if response.status_code != 200:
-            raise Exception(f"Failed to get session ID: {response.text}")
+            raise APIError(f"Failed to get session ID: {response.text}", status_code=response.status_code)
         return response.json().get("sessionId")
 
     def transcribe_image(self, 
@@ -49,7 +51,8 @@ class TranskribusAPI:
             - cost is the API usage cost (if applicable)
         """
         # Get session ID first
-        session_id = self.get_session_id()
+        with span("auth.session"):
+            session_id = self.get_session_id()
         
         # Prepare the image
         with open(image_path, "rb") as image_file:
@@ -67,17 +70,20 @@ class TranskribusAPI:
             params["modelId"] = model_id
         
         # Send request to Transkribus
-        response = requests.post(
-            f"{self.base_url}/recognition/text",
-            headers=headers,
-            files=files,
-            params=params
-        )
+        with span("http.request") as request_span:
+            response = requests.post(
+                f"{self.base_url}/recognition/text",
+                headers=headers,
+                files=files,
+                params=params
+            )
+            request_span.set(status_code=response.status_code, response_bytes=len(response.content))
         
         if response.status_code != 200:
-            raise Exception(f"Error from Transkribus API: {response.text}")
+            raise APIError(f"Error from Transkribus API: {response.text}", status_code=response.status_code)
         
-        response_data = response.json()
+        with span("response.parse"):
+            response_data = response.json()
         
         # Format response to match existing code structure
         formatted_response = {
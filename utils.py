@@ -11,6 +11,8 @@ from api_clients import (
     query_openrouter,
     validate_model_id,
     is_transkribus_model,
+    is_kraken_model,
+    query_kraken,
     fetch_openrouter_pricing,
     resize_image_if_needed,
     OPENROUTER_PRICING
@@ -28,6 +30,8 @@ __all__ = [
     'query_openrouter',
     'validate_model_id',
     'is_transkribus_model',
+    'is_kraken_model',
+    'query_kraken',
     'fetch_openrouter_pricing',
     'resize_image_if_needed',
     'generate_results_md_table',
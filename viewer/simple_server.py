@@ -2,52 +2,19 @@
 # -*- coding: utf-8 -*-
 
 """
-Serveur web simple pour le viewer HTR.
-Exécutez ce script puis accédez à http://localhost:8000/htr_viewer.html
-"""
-
-import http.server
-import socketserver
-import webbrowser
-import os
+Lance le serveur du viewer HTR (`server.py` à la racine du projet) depuis le dossier viewer.
+Exécutez ce script puis accédez à http://localhost:8000/viewer/htr_viewer.html
 
-# Port sur lequel le serveur va écouter
-PORT = 8000
+Le viewer charge les listes JSON, les images et les résultats depuis la racine du projet :
+c'est donc elle qui est servie, quel que soit le dossier de lancement.
+"""
 
-class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
-    """Handler qui ajoute les en-têtes CORS pour permettre les requêtes cross-origin"""
-    
-    def end_headers(self):
-        # Ajouter les en-têtes CORS
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET')
-        self.send_header('Cache-Control', 'no-store, no-cache, must-revalidate')
-        super().end_headers()
-    
-    def do_GET(self):
-        # Gérer les requêtes GET
-        return http.server.SimpleHTTPRequestHandler.do_GET(self)
+import sys
+from pathlib import Path
 
-def run_server():
-    """Démarrer le serveur web"""
-    
-    # Créer le serveur
-    handler = CORSHTTPRequestHandler
-    httpd = socketserver.TCPServer(("", PORT), handler)
-    
-    print(f"Serveur démarré sur le port {PORT}")
-    print(f"Ouvrez votre navigateur à l'adresse : http://localhost:{PORT}/htr_viewer.html")
-    
-    # Ouvrir automatiquement le navigateur
-    webbrowser.open(f"http://localhost:{PORT}/htr_viewer.html")
-    
-    try:
-        # Démarrer le serveur
-        httpd.serve_forever()
-    except KeyboardInterrupt:
-        # Arrêter le serveur proprement avec Ctrl+C
-        print("\nServeur arrêté.")
-        httpd.server_close()
+# Racine du projet, pour importer server.py
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from server import main
 
 if __name__ == "__main__":
-    run_server() 
\ No newline at end of file
+    main()
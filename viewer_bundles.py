@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Paquets de données du viewer HTR, un par image.
+
+Au lieu de charger la transcription de référence puis le fichier de résultat de chaque
+modèle un par un, le viewer demande un seul paquet par image : la référence et, pour chaque
+modèle, la transcription, le WER, le CER, le coût, la latence et les tokens. Les modèles
+sont triés par WER croissant et paginés (`BUNDLE_PAGE_SIZE` par page) : la première page
+suffit à afficher une image, les suivantes ne sont chargées qu'à la demande.
+
+Deux sources, au même format :
+  - le serveur (`server.py`) répond à `/api/bundle/<image>?offset=0&limit=40` à partir
+    du store et des références, en gardant les paquets calculés tant que rien n'a changé ;
+  - les paquets statiques de `bundles/`, pour un hébergement sans serveur (GitHub Pages) :
+
+  python viewer_bundles.py build
+
+Chaque page indique l'adresse de la suivante (`next`), relative à la page courante.
+"""
+
+import argparse
+import json
+import threading
+from pathlib import Path
+from urllib.parse import quote
+
+from image_index import INDEX_FILE, ImageIndex
+from metrics import calculate_cer, calculate_wer
+from results_store import DEFAULT_DB_PATH, DEFAULT_RUN, RESULTS_DIR, open_result_store, record_latency
+from task_ledger import write_json_atomic
+
+BUNDLES_DIR = Path("bundles")
+REFERENCE_DIR = Path("transcriptions_de_référence")
+
+# Nombre de modèles par page de paquet (la plupart des images tiennent en une page)
+BUNDLE_PAGE_SIZE = 40
+
+# Décimales conservées pour les métriques, le coût et la latence
+PRECISION = 6
+
+
+def read_reference(reference_file):
+    """Transcription de référence d'une image (texte brut, ou champ `result` d'un JSON), ou None."""
+    try:
+        content = Path(reference_file).read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        return content
+    return data.get("result", content) if isinstance(data, dict) else content
+
+
+def _rounded(value):
+    return round(value, PRECISION) if isinstance(value, float) else value
+
+
+def model_entry(record, reference, excluded=False):
+    """Résumé compact d'un résultat, avec son WER et son CER par rapport à la référence."""
+    hypothesis = record["result"] or ""
+    usage = record["usage"] or {}
+    scored = reference is not None and not excluded
+    return {
+        "model": record["model"],
+        "model_key": record["model_key"],
+        "editeur": record["editeur"],
+        "modele_type": record["modele_type"],
+        "result": hypothesis,
+        "wer": _rounded(calculate_wer(reference, hypothesis)) if scored else None,
+        "cer": _rounded(calculate_cer(reference, hypothesis)) if scored else None,
+        "cost": _rounded(record["cost"]),
+        "latency": _rounded(record_latency(record)),
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+    }
+
+
+def image_bundle(image_name, records, reference_dir=REFERENCE_DIR, excluded_from_wer=()):
+    """
+    Paquet complet d'une image : référence et résultats de tous les modèles, triés par WER.
+
+    Args:
+        image_name: Nom de l'image sans extension
+        records: Résultats de l'image (enregistrements du store)
+        excluded_from_wer: Images dont le WER n'est pas calculé (pages blanches)
+    """
+    reference = read_reference(Path(reference_dir) / f"{image_name}.md")
+    excluded = image_name in excluded_from_wer
+    models = [model_entry(record, reference, excluded) for record in records]
+    models.sort(key=lambda entry: (entry["wer"] is None, entry["wer"] or 0.0, entry["model"]))
+    return {
+        "image": image_name,
+        "reference": reference,
+        "excluded_from_wer": excluded,
+        "models": models,
+    }
+
+
+def bundle_page(bundle, offset=0, limit=BUNDLE_PAGE_SIZE, next_url=None):
+    """
+    Page d'un paquet : `limit` modèles à partir de `offset`. La référence n'est
+    envoyée qu'avec la première page.
+
+    Args:
+        next_url: Fonction (offset suivant) -> adresse de la page suivante
+    """
+    models = bundle["models"]
+    page = {
+        "image": bundle["image"],
+        "excluded_from_wer": bundle["excluded_from_wer"],
+        "total_models": len(models),
+        "offset": offset,
+        "models": models[offset:offset + limit],
+    }
+    if offset == 0:
+        page["reference"] = bundle["reference"]
+    following = offset + limit
+    page["next"] = next_url(following) if following < len(models) and next_url else None
+    return page
+
+
+def static_page_name(image_name, page_number):
+    """Nom du fichier statique d'une page (`<image>.json`, puis `<image>.<n>.json`)."""
+    return f"{image_name}.json" if page_number == 0 else f"{image_name}.{page_number}.json"
+
+
+def group_by_image(store, run):
+    """Résultats d'un run regroupés par image (une seule lecture du store)."""
+    records_by_image = {}
+    for record in store.iter_records(run=run):
+        records_by_image.setdefault(record["image_name"], []).append(record)
+    return records_by_image
+
+
+def build_static_bundles(output_dir=BUNDLES_DIR, db_path=DEFAULT_DB_PATH, results_dir=RESULTS_DIR,
+                         reference_dir=REFERENCE_DIR, run=DEFAULT_RUN, page_size=BUNDLE_PAGE_SIZE):
+    """
+    Écrit les paquets de toutes les images du store dans `output_dir`.
+
+    Returns:
+        int: Nombre d'images écrites
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    store = open_result_store(db_path, results_dir)
+    excluded_from_wer = ImageIndex().excluded_from_wer()
+
+    written = 0
+    for image_name, records in group_by_image(store, run).items():
+        bundle = image_bundle(image_name, records, reference_dir, excluded_from_wer)
+        for offset in range(0, max(len(bundle["models"]), 1), page_size):
+            page = bundle_page(bundle, offset, page_size,
+                               lambda following: quote(static_page_name(image_name, following // page_size)))
+            path = output_dir / static_page_name(image_name, offset // page_size)
+            write_json_atomic(path, page)
+        written += 1
+    return written
+
+
+class BundleSource:
+    """
+    Paquets calculés à la demande pour le serveur du viewer.
+
+    Un paquet est recalculé quand le store, la référence ou l'index des images a changé
+    depuis son calcul (dates de modification).
+    """
+
+    def __init__(self, root=".", run=DEFAULT_RUN):
+        root = Path(root)
+        self.db_path = root / DEFAULT_DB_PATH
+        self.results_dir = root / RESULTS_DIR
+        self.reference_dir = root / REFERENCE_DIR
+        self.index_path = root / INDEX_FILE
+        self.run = run
+        self._bundles = {}
+        self._lock = threading.Lock()
+        self._store = None
+
+    def _signature(self, image_name):
+        signature = []
+        for path in (self.db_path, self.reference_dir / f"{image_name}.md", self.index_path):
+            try:
+                signature.append(path.stat().st_mtime_ns)
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def bundle(self, image_name):
+        """Paquet complet d'une image, ou None si elle n'a aucun résultat ni référence."""
+        signature = self._signature(image_name)
+        with self._lock:
+            cached = self._bundles.get(image_name)
+            if cached and cached[0] == signature:
+                return cached[1]
+            if self._store is None:
+                self._store = open_result_store(self.db_path, self.results_dir)
+        records = list(self._store.iter_records(run=self.run, image=image_name))
+        if not records and signature[1] is None:
+            return None
+        excluded_from_wer = ImageIndex(self.index_path).excluded_from_wer()
+        bundle = image_bundle(image_name, records, self.reference_dir, excluded_from_wer)
+        with self._lock:
+            self._bundles[image_name] = (signature, bundle)
+        return bundle
+
+    def page(self, image_name, offset=0, limit=BUNDLE_PAGE_SIZE):
+        """Page d'un paquet, avec l'adresse de l'API pour la page suivante, ou None."""
+        bundle = self.bundle(image_name)
+        if bundle is None:
+            return None
+        return bundle_page(bundle, offset, limit,
+                           lambda following: f"{quote(image_name)}?offset={following}&limit={limit}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Paquets de données du viewer HTR (un par image).")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--output-dir", type=Path, default=BUNDLES_DIR, help="Dossier des paquets statiques")
+    parser.add_argument("--run", default=DEFAULT_RUN, help="Run des résultats à publier")
+    parser.add_argument("--page-size", type=int, default=BUNDLE_PAGE_SIZE, help="Modèles par page")
+    args = parser.parse_args()
+
+    written = build_static_bundles(args.output_dir, run=args.run, page_size=args.page_size)
+    print(f"{written} paquet(s) écrit(s) dans {args.output_dir}/")
+
+
+if __name__ == "__main__":
+    main()